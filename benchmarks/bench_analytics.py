@@ -0,0 +1,110 @@
+"""The stats report with NumPy columns against the same statistics in pure Python.
+
+Both read the same (day, category code, cents) rows from db.iter_columns. The Python baseline
+loops over the rows with dicts and a sorted list for the percentiles, the NumPy version loads
+the rows into arrays and runs analytics.build_report.
+
+Run from the project root (needs NumPy):
+    python3 benchmarks/bench_analytics.py [--rows 1000000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+import db.database as db
+from db.encoding import from_day
+from internal_libs import analytics
+from internal_libs.expense import Expense
+from internal_libs.income import Income
+from internal_libs.category import ExpCategory, IncCategory
+
+def populate(db_path: str, rows: int):
+    rng = random.Random(42)
+    start = date(2000, 1, 1)
+    exp_categories = list(ExpCategory)
+    inc_categories = list(IncCategory)
+
+    db.import_expenses((Expense(round(rng.uniform(1, 200), 2), start + timedelta(days = rng.randrange(9000)),
+                                "bench", rng.choice(exp_categories)) for _ in range(rows)), db_path)
+    db.import_incomes((Income(round(rng.uniform(500, 3000), 2), start + timedelta(days = rng.randrange(9000)),
+                              "bench", rng.choice(inc_categories)) for _ in range(rows // 20)), db_path)
+
+def python_report(db_path: str, window: int, quantiles = analytics.DEFAULT_QUANTILES):
+    monthly = {"exp": {}, "inc": {}}
+    categories = {"exp": {}, "inc": {}}
+    amounts = []
+
+    for kind in ("exp", "inc"):
+        _, chunks = db.iter_columns(kind, db_path = db_path)
+        for chunk in chunks:
+            for day, category, cents in chunk:
+                month = from_day(day).strftime("%Y-%m")
+                monthly[kind][month] = monthly[kind].get(month, 0) + cents
+                categories[kind][category] = categories[kind].get(category, 0) + cents
+                if kind == "exp":
+                    amounts.append(cents)
+
+    months = sorted(set(monthly["exp"]) | set(monthly["inc"]))
+    expenses = [monthly["exp"].get(month, 0) / 100 for month in months]
+    incomes = [monthly["inc"].get(month, 0) / 100 for month in months]
+    averages = [sum(expenses[i - window + 1:i + 1]) / window if i >= window - 1 else None for i in range(len(expenses))]
+    rates = [(inc - exp) / inc if inc else None for inc, exp in zip(incomes, expenses)]
+
+    amounts.sort()
+    percentiles = {}
+    for quantile in quantiles:
+        position = (len(amounts) - 1) * quantile / 100
+        low = int(position)
+        high = min(low + 1, len(amounts) - 1)
+        percentiles[quantile] = (amounts[low] + (amounts[high] - amounts[low]) * (position - low)) / 100
+
+    total_income = sum(incomes)
+    savings = (total_income - sum(expenses)) / total_income if total_income else None
+    return categories, months, expenses, incomes, averages, rates, percentiles, savings
+
+def numpy_report(db_path: str, window: int):
+    _, expenses = analytics.load_columns("exp", db_path = db_path)
+    _, incomes = analytics.load_columns("inc", db_path = db_path)
+    return analytics.build_report(expenses, incomes, window)
+
+def measure(label: str, function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed:8.2f} s")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description = "Analytics benchmark")
+    parser.add_argument("--rows", type = int, default = 1_000_000)
+    parser.add_argument("--window", type = int, default = analytics.DEFAULT_WINDOW)
+    args = parser.parse_args()
+
+    if not analytics.numpy_available():
+        print("NumPy is not installed.")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        db.init_db(db_path)
+        populate(db_path, args.rows)
+        print(f"{args.rows:,} expenses, {args.rows // 20:,} incomes\n")
+
+        python_time = measure("pure Python", python_report, db_path, args.window)
+        numpy_time = measure("NumPy (load + report)", numpy_report, db_path, args.window)
+
+        _, expenses = analytics.load_columns("exp", db_path = db_path)
+        _, incomes = analytics.load_columns("inc", db_path = db_path)
+        measure("NumPy report only", analytics.build_report, expenses, incomes, args.window)
+
+        print(f"\nspeedup {python_time / numpy_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
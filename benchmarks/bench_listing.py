@@ -0,0 +1,78 @@
+"""Time and memory of listing expenses, tuples + per row objects against the record row factory.
+
+"tuples" is the read path list_exp used before records existed: a tuple from the db, then an
+object with a __dict__ and an ExpCategory(name.capitalize()) lookup per row. "records" builds
+slotted Expense objects in the row factory with cached category and date decoding.
+Both keep every row alive so tracemalloc sees the full cost of a materialized listing.
+
+Run from the project root:
+    python3 benchmarks/bench_listing.py [--rows 1000000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+import db.database as db
+from internal_libs.expense import Expense
+from internal_libs.category import ExpCategory
+
+class DictExpense:
+    """Expense as it was before __slots__."""
+
+    def __init__(self, amount, date, description, category):
+        self.amount = amount
+        self.date = date
+        self.description = description
+        self.category = category
+
+def populate(db_path: str, rows: int):
+    rng = random.Random(42)
+    start = date(2015, 1, 1)
+    categories = list(ExpCategory)
+
+    db.import_expenses((Expense(round(rng.uniform(1, 200), 2),
+                                start + timedelta(days = rng.randrange(3650)),
+                                f"row {i % 5000}",
+                                rng.choice(categories)) for i in range(rows)), db_path)
+
+def list_tuples(db_path: str) -> list:
+    _, rows = db.iter_expenses(db_path = db_path)
+    return [(row[0], DictExpense(row[4], row[1], row[2], ExpCategory(row[3].capitalize()))) for row in rows]
+
+def list_records(db_path: str) -> list:
+    _, records = db.iter_expense_records(db_path = db_path)
+    return list(records)
+
+def measure(label: str, function, db_path: str):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(db_path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<8} {len(result):>10,} rows {elapsed:8.2f} s {peak / 2**20:10.1f} MiB")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Listing read path benchmark")
+    parser.add_argument("--rows", type = int, default = 1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        db.init_db(db_path)
+        populate(db_path, args.rows)
+
+        measure("tuples", list_tuples, db_path)
+        measure("records", list_records, db_path)
+
+if __name__ == "__main__":
+    main()
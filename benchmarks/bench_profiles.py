@@ -0,0 +1,102 @@
+"""Write throughput of the db performance profiles (see db.PROFILES).
+
+For every profile a fresh db gets single row commits (one add_expense per transaction, the
+cost of every CLI command), a bulk import and point reads while a writer is busy.
+
+Durability of each profile:
+    durable    every commit is synced, survives power loss
+    balanced   survives application crashes, a power loss can drop the last commits
+    bulk-load  survives application crashes, a power loss can corrupt the db
+
+Run from the project root:
+    python3 benchmarks/bench_profiles.py [--commits 2000] [--rows 200000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+import db.database as db
+from internal_libs.expense import Expense
+from internal_libs.category import ExpCategory
+
+def make_expenses(rows: int):
+    rng = random.Random(42)
+    start = date(2015, 1, 1)
+    categories = list(ExpCategory)
+
+    return (Expense(round(rng.uniform(1, 200), 2),
+                    start + timedelta(days = rng.randrange(3650)),
+                    f"row {i % 1000}",
+                    rng.choice(categories)) for i in range(rows))
+
+def bench_commits(db_path: str, commits: int) -> float:
+    expense = Expense(1.5, date(2024, 1, 1), "bench", ExpCategory.FOOD)
+
+    with db.Session(db_path) as session:
+        start = time.perf_counter()
+        for _ in range(commits):
+            db.add_expense(expense, session)
+        return commits / (time.perf_counter() - start)
+
+def bench_import(db_path: str, rows: int) -> float:
+    expenses = make_expenses(rows)
+
+    start = time.perf_counter()
+    db.import_expenses(expenses, db_path)
+    return rows / (time.perf_counter() - start)
+
+def bench_reads_during_writes(db_path: str, seconds: float = 1.0) -> float:
+    """Reads per second on one connection while another thread keeps committing."""
+
+    stop = threading.Event()
+
+    def writer():
+        with db.Session(db_path) as session:
+            while not stop.is_set():
+                db.add_expense(Expense(1), session)
+
+    thread = threading.Thread(target = writer)
+    thread.start()
+
+    reads = 0
+    with db.Session(db_path) as session:
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            db.get_balance(session)
+            reads += 1
+
+    stop.set()
+    thread.join()
+    return reads / seconds
+
+def main():
+    parser = argparse.ArgumentParser(description = "Db performance profiles benchmark")
+    parser.add_argument("--commits", type = int, default = 2_000)
+    parser.add_argument("--rows", type = int, default = 200_000)
+    args = parser.parse_args()
+
+    print(f"{'profile':<10} {'commits/s':>12} {'imported rows/s':>16} {'reads/s (busy writer)':>22}")
+
+    for profile in db.PROFILES:
+        db.set_profile(profile)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "bench.db")
+            db.init_db(db_path)
+
+            commits = bench_commits(db_path, args.commits)
+            imported = bench_import(db_path, args.rows)
+            reads = bench_reads_during_writes(db_path)
+
+        print(f"{profile:<10} {commits:>12,.0f} {imported:>16,.0f} {reads:>22,.0f}")
+
+if __name__ == "__main__":
+    main()
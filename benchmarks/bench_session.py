@@ -0,0 +1,63 @@
+"""Per-call latency of the db functions with a db path versus a reused Session.
+
+Run from the project root:
+    python3 benchmarks/bench_session.py [--rows 200000] [--calls 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+import db.database as db
+from internal_libs.expense import Expense
+from internal_libs.category import ExpCategory
+
+def populate(db_path: str, rows: int):
+    rng = random.Random(42)
+    start = date(2015, 1, 1)
+    categories = list(ExpCategory)
+
+    expenses = (Expense(round(rng.uniform(1, 200), 2),
+                        start + timedelta(days = rng.randrange(3650)),
+                        f"row {i}",
+                        rng.choice(categories)) for i in range(rows))
+    db.import_expenses(expenses, db_path)
+
+def time_calls(label: str, calls: int, fn):
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed / calls * 1e6:10.1f} us/call")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Session vs db path benchmark")
+    parser.add_argument("--rows", type = int, default = 200_000)
+    parser.add_argument("--calls", type = int, default = 2_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        db.init_db(db_path)
+        populate(db_path, args.rows)
+        print(f"database with {args.rows} expenses, {args.calls} calls per case\n")
+
+        expense = Expense(1.5, date(2024, 1, 1), "bench", ExpCategory.FOOD)
+
+        time_calls("get_balance (db path)", args.calls, lambda i: db.get_balance(db_path))
+        time_calls("add_expense (db path)", args.calls, lambda i: db.add_expense(expense, db_path))
+        time_calls("edit_expense (db path)", args.calls, lambda i: db.edit_expense(i + 1, new_amount = 2.0, db_path = db_path))
+
+        with db.Session(db_path) as session:
+            time_calls("get_balance (session)", args.calls, lambda i: db.get_balance(session))
+            time_calls("add_expense (session)", args.calls, lambda i: db.add_expense(expense, session))
+            time_calls("edit_expense (session)", args.calls, lambda i: db.edit_expense(i + 1, new_amount = 3.0, db_path = session))
+
+if __name__ == "__main__":
+    main()
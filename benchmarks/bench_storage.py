@@ -0,0 +1,100 @@
+"""File size and aggregate query speed of storage format v1 against v2.
+
+Builds a v1 db (text dates, REAL amounts, inline descriptions), copies it, migrates the copy
+with init_db and runs the same SUM / GROUP BY questions on both.
+
+Run from the project root:
+    python3 benchmarks/bench_storage.py [--rows 1000000]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+import db.database as db
+from internal_libs.category import ExpCategory
+
+DESCRIPTIONS = ["Groceries", "Rent", "Coffee", "Fuel", "Electricity bill", "Restaurant", "Train ticket", "Cinema"]
+
+V1_SCHEMA = """
+    CREATE TABLE expenses (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, description TEXT, category TEXT, amount REAL NOT NULL);
+    CREATE TABLE incomes (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, description TEXT, category TEXT, amount REAL NOT NULL);
+    CREATE TABLE balance (id INTEGER PRIMARY KEY CHECK (id = 1), curr_balance REAL NOT NULL DEFAULT 0);
+    INSERT INTO balance VALUES (1, 0);
+    CREATE INDEX expenses_date_idx ON expenses (date);
+    CREATE INDEX expenses_category_date_idx ON expenses (category, date);
+    CREATE INDEX expenses_month_idx ON expenses (substr(date, 1, 7));
+"""
+
+# (label, v1 query, v2 query)
+QUERIES = [
+    ("total spent",
+     "SELECT SUM(amount) FROM expenses",
+     "SELECT SUM(cents) FROM expenses"),
+    ("total per category",
+     "SELECT category, SUM(amount) FROM expenses GROUP BY category",
+     "SELECT category, SUM(cents) FROM expenses GROUP BY category"),
+    ("total per month",
+     "SELECT substr(date, 1, 7), SUM(amount) FROM expenses GROUP BY 1",
+     "SELECT strftime('%Y-%m', day * 86400, 'unixepoch'), SUM(cents) FROM expenses GROUP BY 1"),
+    ("one year range",
+     "SELECT SUM(amount) FROM expenses WHERE date >= '2020-01-01' AND date < '2021-01-01'",
+     "SELECT SUM(cents) FROM expenses WHERE day >= 18262 AND day < 18628"),
+]
+
+def build_v1(db_path: str, rows: int):
+    rng = random.Random(42)
+    start = date(2015, 1, 1)
+    categories = [c.name for c in ExpCategory]
+
+    connection = sqlite3.connect(db_path)
+    connection.executescript(V1_SCHEMA)
+    connection.executemany("INSERT INTO expenses (date, description, category, amount) VALUES (?, ?, ?, ?)",
+                           ((str(start + timedelta(days = rng.randrange(3650))),
+                             rng.choice(DESCRIPTIONS),
+                             rng.choice(categories),
+                             round(rng.uniform(1, 200), 2)) for _ in range(rows)))
+    connection.commit()
+    connection.execute("VACUUM")
+    connection.close()
+
+def time_query(db_path: str, query: str, repeat: int = 3) -> float:
+    connection = sqlite3.connect(db_path)
+    connection.execute(query).fetchall() # warm the page cache
+    start = time.perf_counter()
+    for _ in range(repeat):
+        connection.execute(query).fetchall()
+    connection.close()
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description = "Storage format v1 vs v2 benchmark")
+    parser.add_argument("--rows", type = int, default = 1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        v1_path = os.path.join(tmp, "v1.db")
+        v2_path = os.path.join(tmp, "v2.db")
+
+        build_v1(v1_path, args.rows)
+        shutil.copy(v1_path, v2_path)
+
+        start = time.perf_counter()
+        db.init_db(v2_path)
+        migration = time.perf_counter() - start
+
+        print(f"{args.rows} expenses, migration took {migration:.2f}s\n")
+        print(f"{'file size':<20} {os.path.getsize(v1_path) / 2**20:9.1f} MiB -> {os.path.getsize(v2_path) / 2**20:9.1f} MiB")
+        for label, v1_query, v2_query in QUERIES:
+            print(f"{label:<20} {time_query(v1_path, v1_query) * 1e3:9.1f} ms  -> {time_query(v2_path, v2_query) * 1e3:9.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""Times every public db function and CLI command on a synthetic history, with JSON results
+that can be compared against a stored baseline.
+
+Each case is measured cold and warm. For db functions cold is a call with an empty report
+cache, for CLI commands a fresh "python3 src/main.py ..." process (interpreter start, imports,
+init_db and the command). Warm is the same call again, for CLI commands run inside this process.
+Both are the minimum of several calls (--cold-repeat and --repeat): the minimum is the run least
+disturbed by the rest of the machine. How far the median is above it is kept as the noise of
+the case, a slowdown is only reported when it is larger than the noise of both runs compared.
+Each call is preceded by a short calibration (fixed Python and SQLite work). The minimum is also
+kept divided by the median calibration of the case, and a slowdown has to show both in seconds
+and in those calibration units.
+
+The synthetic db (see datagen.py) is built once per size and seed and kept in benchmarks/.data,
+every run works on copies of it: one for the cases, one with the years before ARCHIVE_BEFORE
+archived to shards for the sharded reads, one the archive case moves a year at a time.
+
+Run from the project root:
+    python3 benchmarks/bench_suite.py --rows 100k --output results.json
+    python3 benchmarks/bench_suite.py --rows 100k --baseline results.json --threshold 0.3
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from typing import Callable, NamedTuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+import datagen
+import db.database as db
+import cli.cli as cli
+from db.filters import compile_filter, compile_search
+from internal_libs import analytics, household
+from internal_libs.expense import Expense
+from internal_libs.income import Income
+from internal_libs.category import ExpCategory, IncCategory
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src/main.py")
+IMPORT_ROWS = 10_000 # rows of the import cases
+ARCHIVE_BEFORE = 2010 # years of the synthetic history moved to shards for the sharded read cases
+CALIBRATION_LOOP = 10_000 # with the query, about a millisecond per calibration run
+CALIBRATION_QUERY = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 5000) SELECT SUM(x) FROM n"
+CALIBRATION_REPEAT = 3
+DEFAULT_THRESHOLD = 0.3 # 30% slower than the baseline is a regression, if it is also above the noise
+DEFAULT_MIN_DELTA = 0.001 # seconds, smaller differences are noise whatever the ratio
+
+class Case(NamedTuple):
+    name: str
+    run: Callable[[int], object] # called with the number of the call, 0 is the cold one
+    argv: Callable[[int], list] | None = None # CLI cases, the command line for that call
+    repeat: int | None = None # overrides --repeat (and caps --cold-repeat) for slow cases
+    stdin: str | None = None # CLI cases, the input of the command
+    read_only: bool = False # CLI cases, run with the db opened read-only
+
+def consume(result):
+    """Reads the rows of the lazy listings so their cost is measured, not only the query start."""
+
+    success, value = result
+    if success and not isinstance(value, (list, float, int, str)):
+        for _ in value:
+            pass
+    return result
+
+def db_cases(db_path: str, archived_path: str, archiving_path: str, rows: int) -> list[Case]:
+    first, last = date(2000, 1, 1), date(2024, 12, 31)
+    where = compile_filter("category = food and amount > 20", ExpCategory)
+    archived_where = compile_filter(f"date >= {ARCHIVE_BEFORE - 1}-01-01 and date < {ARCHIVE_BEFORE}-01-01", ExpCategory)
+    read_only = db.ReadOnly(db_path)
+    income_rows = max(rows // datagen.INCOME_RATIO, 1)
+    expenses = lambda i: datagen.generate_expenses(IMPORT_ROWS, seed = 1000 + i)
+    incomes = lambda i: datagen.generate_incomes(IMPORT_ROWS, seed = 1000 + i)
+
+    return [
+        Case("db.init_db", lambda i: db.init_db(db_path)),
+        Case("db.get_balance", lambda i: db.get_balance(db_path)),
+        Case("db.set_balance", lambda i: db.set_balance(1000 + i, db_path)),
+        Case("db.get_expenses", lambda i: db.get_expenses(db_path), repeat = 2),
+        Case("db.get_incomes", lambda i: db.get_incomes(db_path)),
+        Case("db.iter_expenses", lambda i: consume(db.iter_expenses(db_path = db_path)), repeat = 2),
+        Case("db.iter_expenses page", lambda i: consume(db.iter_expenses(100, after_id = rows // 2, db_path = db_path))),
+        Case("db.iter_expenses where", lambda i: consume(db.iter_expenses(where = where, db_path = db_path)), repeat = 2),
+        Case("db.iter_expense_records", lambda i: consume(db.iter_expense_records(db_path = db_path)), repeat = 2),
+        Case("db.iter_incomes", lambda i: consume(db.iter_incomes(db_path = db_path))),
+        Case("db.iter_income_records", lambda i: consume(db.iter_income_records(db_path = db_path))),
+        Case("db.add_expense", lambda i: db.add_expense(Expense(12.5, date(2024, 6, 1), "bench", ExpCategory.FOOD), db_path)),
+        Case("db.edit_expense", lambda i: db.edit_expense(i + 1, new_amount = 20 + i, new_category = ExpCategory.OTHER, db_path = db_path)),
+        Case("db.del_expense", lambda i: db.del_expense(i + 1, db_path)),
+        Case("db.edit_expenses where", lambda i: db.edit_expenses(where = where, new_category = ExpCategory.FOOD, db_path = db_path)),
+        Case("db.del_expenses 1k ids", lambda i: db.del_expenses(range(rows // 2 + 1000 * i, rows // 2 + 1000 * (i + 1)), db_path = db_path)),
+        Case("db.import_expenses", lambda i: db.import_expenses(expenses(i), db_path), repeat = 2),
+        Case("db.add_income", lambda i: db.add_income(Income(100, date(2024, 6, 1), "bench", IncCategory.OTHER), db_path)),
+        Case("db.edit_income", lambda i: db.edit_income(i + 1, new_amount = 200 + i, db_path = db_path)),
+        Case("db.del_income", lambda i: db.del_income(income_rows - i, db_path)),
+        Case("db.import_incomes", lambda i: db.import_incomes(incomes(i), db_path), repeat = 2),
+        Case("db.get_monthly_totals", lambda i: db.get_monthly_totals(db_path = db_path)),
+        Case("db.get_monthly_totals uncached", lambda i: (db.clear_cache(), db.get_monthly_totals(db_path = db_path))),
+        Case("db.rebuild_monthly_totals", lambda i: db.rebuild_monthly_totals(db_path), repeat = 2),
+        Case("db.rebuild_daily_balance", lambda i: db.rebuild_daily_balance(db_path), repeat = 2),
+        Case("db.get_balance_at", lambda i: db.get_balance_at(date(2012, 3, 4), db_path)),
+        Case("db.get_balance_series", lambda i: db.get_balance_series(first, last, db_path)),
+        Case("db.iter_columns", lambda i: consume(db.iter_columns("exp", db_path = db_path)), repeat = 2),
+        Case("db.search", lambda i: db.search(compile_search("lidl"), db_path = db_path)),
+        Case("db.search prefix", lambda i: db.search(compile_search("amaz* \"order\""), offset = 100, db_path = db_path)),
+        Case("db.iter_export csv", lambda i: consume(db.iter_export("exp", "csv", db_path = db_path)), repeat = 2),
+        Case("db.iter_export jsonl where", lambda i: consume(db.iter_export("exp", "jsonl", where = where, db_path = db_path))),
+        Case("db.archive one year", lambda i: db.archive(first.year + 1 + i, archiving_path)),
+        Case("db.iter_expenses sharded", lambda i: consume(db.iter_expenses(db_path = archived_path)), repeat = 2),
+        Case("db.iter_expenses sharded year", lambda i: consume(db.iter_expenses(where = archived_where, db_path = archived_path))),
+        Case("db.iter_export sharded", lambda i: consume(db.iter_export("exp", "csv", db_path = archived_path)), repeat = 2),
+        Case("db.search sharded", lambda i: db.search(compile_search("lidl"), db_path = archived_path)),
+        Case("db.get_balance read-only", lambda i: db.get_balance(read_only)),
+        Case("db.iter_expenses read-only", lambda i: consume(db.iter_expenses(db_path = read_only)), repeat = 2),
+        Case("db.get_monthly_totals read-only", lambda i: (db.clear_cache(), db.get_monthly_totals(db_path = read_only))),
+        Case("household.get_report", lambda i: household.get_report([db_path, archived_path]), repeat = 2),
+    ] + ([Case("analytics.get_report", lambda i: analytics.get_report(db_path = db_path))] if analytics.numpy_available() else [])
+
+def cli_cases(work_dir: str, archived_path: str, rows: int) -> list[Case]:
+    csv_path = os.path.join(work_dir, "import.csv")
+    with open(csv_path, "w") as outf:
+        outf.write("date,description,category,amount\n")
+        for expense in datagen.generate_expenses(IMPORT_ROWS, seed = 7):
+            outf.write(f"{expense.date},{expense.description},{expense.category.value},{expense.amount}\n")
+
+    batch_path = os.path.join(work_dir, "commands.txt")
+    with open(batch_path, "w") as outf:
+        outf.writelines(f"add_exp {i % 50 + 1} --description batch --category food\n" for i in range(100))
+    shell_input = "".join(f"add_inc {i + 1} --description shell\n" for i in range(20)) + "show_balance\nlist_exp --limit 100\nexit\n"
+
+    commands = [
+        ("show_balance", lambda i: ["show_balance"]),
+        ("set_balance", lambda i: ["set_balance", str(1000 + i)]),
+        ("balance_at", lambda i: ["balance_at", "2012-03-04"]),
+        ("balance_series", lambda i: ["balance_series", "2020-01-01", "2020-12-31"]),
+        ("list_exp page", lambda i: ["list_exp", "--limit", "100", "--after-id", str(rows // 2)]),
+        ("list_exp where", lambda i: ["list_exp", "--where", "category = gaming and amount > 50", "--limit", "1000"]),
+        ("list_inc", lambda i: ["list_inc"]),
+        ("categories", lambda i: ["categories"]),
+        ("add_exp", lambda i: ["add_exp", "9.99", "--description", "bench", "--category", "food"]),
+        ("edit_exp", lambda i: ["edit_exp", str(rows // 3 + i), "--amount", "5"]),
+        ("del_exp", lambda i: ["del_exp", str(rows // 4 + i)]),
+        ("add_inc", lambda i: ["add_inc", "100", "--description", "bench"]),
+        ("edit_inc", lambda i: ["edit_inc", str(10 + i), "--amount", "5"]),
+        ("del_inc", lambda i: ["del_inc", str(20 + i)]),
+        ("summary", lambda i: ["summary", "--from", "2010-01", "--to", "2019-12"]),
+        ("search", lambda i: ["search", "rest*", "--limit", "50"]),
+        ("import_csv", lambda i: ["import_csv", csv_path, "--type", "exp"]),
+        ("batch", lambda i: ["batch", batch_path, "--group", "100"]),
+        ("export", lambda i: ["export", os.path.join(work_dir, "export.csv")]),
+        ("export jsonl.gz where", lambda i: ["export", os.path.join(work_dir, "export.jsonl.gz"), "--where", "category = food"]),
+        ("report", lambda i: ["report", "--db", db.DB_DEFAULT_PATH, "--db", archived_path, "--from", "2010-01"]),
+    ]
+    if analytics.numpy_available():
+        commands.append(("stats", lambda i: ["stats", "--from", "2010-01-01", "--to", "2019-12-31"]))
+
+    # reporting processes on the same db, see FINANCES_DB_READ_ONLY
+    read_only_commands = [
+        ("show_balance", lambda i: ["show_balance"]),
+        ("list_exp where", lambda i: ["list_exp", "--where", "category = gaming and amount > 50", "--limit", "1000"]),
+        ("summary", lambda i: ["summary", "--from", "2010-01", "--to", "2019-12"]),
+    ]
+
+    cases = [Case(f"cli.{name}", lambda i, argv = argv: run_cli(argv(i)), argv) for name, argv in commands]
+    cases.append(Case("cli.shell", lambda i: run_cli(["shell"], stdin = shell_input), lambda i: ["shell"], stdin = shell_input))
+    cases.extend(Case(f"cli.{name} read-only", lambda i, argv = argv: run_cli(argv(i), read_only = True), argv, read_only = True)
+                 for name, argv in read_only_commands)
+    return cases
+
+@contextlib.contextmanager
+def redirect_stdin(text: str | None):
+    if text is None:
+        yield
+        return
+
+    stdin = sys.stdin
+    sys.stdin = io.StringIO(text)
+    try:
+        yield
+    finally:
+        sys.stdin = stdin
+
+def run_cli(argv: list, stdin: str | None = None, read_only: bool = False):
+    with contextlib.redirect_stdout(io.StringIO()), redirect_stdin(stdin), \
+         (db.use_read_only() if read_only else contextlib.nullcontext()):
+        cli.dispatch(cli.build_parser().parse_args(argv))
+
+def run_cli_process(case: Case, i: int, work_dir: str) -> float:
+    env = dict(os.environ)
+    if case.read_only:
+        env[db.READ_ONLY_ENV_VAR] = "1"
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, MAIN_PATH] + case.argv(i), cwd = work_dir, input = case.stdin, text = True, env = env,
+                   stdout = subprocess.DEVNULL, check = True)
+    return time.perf_counter() - start
+
+_calibration_db = sqlite3.connect(":memory:")
+
+def calibrate() -> float:
+    """Seconds of a fixed mix of Python and SQLite work, how fast the machine runs right now."""
+
+    best = float("inf")
+    for _ in range(CALIBRATION_REPEAT):
+        start = time.perf_counter()
+        sum(i * i for i in range(CALIBRATION_LOOP))
+        _calibration_db.execute(CALIBRATION_QUERY).fetchone()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def summarize(times: list[float], calibrations: list[float], kind: str) -> dict:
+    """Minimum time of a case, the same in calibration units and how far the median is above the minimum (the noise)."""
+
+    best = min(times)
+    return {kind: best, f"{kind}_score": best / statistics.median(calibrations), f"{kind}_noise": statistics.median(times) / best - 1}
+
+def measure(case: Case, repeat: int, cold_repeat: int, work_dir: str) -> dict:
+    if case.repeat is not None:
+        repeat = case.repeat
+        cold_repeat = min(cold_repeat, case.repeat)
+
+    # every call gets its own number, the cases that change the db change different rows each time
+    cold_times, cold_calibrations = [], []
+    for i in range(cold_repeat):
+        db.clear_cache()
+        cold_calibrations.append(calibrate())
+        if case.argv is not None:
+            cold_times.append(run_cli_process(case, i, work_dir))
+        else:
+            start = time.perf_counter()
+            case.run(i)
+            cold_times.append(time.perf_counter() - start)
+
+    warm_times, warm_calibrations = [], []
+    for i in range(cold_repeat, cold_repeat + repeat):
+        warm_calibrations.append(calibrate())
+        start = time.perf_counter()
+        case.run(i)
+        warm_times.append(time.perf_counter() - start)
+
+    return summarize(cold_times, cold_calibrations, "cold") | summarize(warm_times, warm_calibrations, "warm")
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta: float) -> list[str]:
+    """Prints current against baseline times, returns the names of the regressed cases."""
+
+    if baseline["meta"].get("rows") != results["meta"]["rows"]:
+        print(f"WARNING: the baseline was measured on {baseline['meta'].get('rows'):,} rows, this run on {results['meta']['rows']:,}.")
+
+    regressions = []
+    print(f"\n{'case':<34} {'':>5} {'baseline':>10} {'current':>10} {'change':>8} {'calibrated':>10}")
+    for name, current in results["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        for kind in ("cold", "warm"):
+            change = current[kind] / before[kind] - 1 if before[kind] else 0.0
+            # the change in calibration units, a machine that runs slower for a while slows the calibration as well
+            score = f"{kind}_score"
+            calibrated = current[score] / before[score] - 1 if score in current and score in before else change
+
+            # a slowdown within the spread either run saw between its own repeats is not a regression,
+            # and it has to show both in seconds and in calibration units
+            noise = max(threshold, current.get(f"{kind}_noise", 0.0), before.get(f"{kind}_noise", 0.0))
+            regressed = min(change, calibrated) > noise and current[kind] - before[kind] > min_delta
+            if regressed:
+                regressions.append(f"{name} ({kind})")
+            print(f"{name:<34} {kind:>5} {before[kind] * 1000:>8.2f}ms {current[kind] * 1000:>8.2f}ms {change:>+7.0%} {calibrated:>+10.0%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark suite of the db functions and CLI commands")
+    parser.add_argument("--rows", type = datagen.parse_rows, default = 100_000, help = "Expenses in the synthetic db, 10k to 10m (default: 100k)")
+    parser.add_argument("--seed", type = int, default = datagen.DEFAULT_SEED)
+    parser.add_argument("--repeat", type = int, default = 5, help = "Warm calls per case (default: 5)")
+    parser.add_argument("--cold-repeat", type = int, default = 3, help = "Cold calls (CLI processes) per case (default: 3)")
+    parser.add_argument("--only", help = "Only run the cases whose name contains this text")
+    parser.add_argument("--no-cli", action = "store_true", help = "Skip the CLI commands")
+    parser.add_argument("--data-dir", help = "Where the synthetic dbs are kept (default: benchmarks/.data)")
+    parser.add_argument("--output", help = "Write the results to this JSON file")
+    parser.add_argument("--baseline", help = "Compare against the results in this JSON file, exits with 1 on regressions")
+    parser.add_argument("--threshold", type = float, default = DEFAULT_THRESHOLD, help = f"Slowdown counted as a regression (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--min-delta", type = float, default = DEFAULT_MIN_DELTA, help = f"Seconds below which a slowdown is noise (default: {DEFAULT_MIN_DELTA})")
+    args = parser.parse_args()
+
+    print(f"building / reusing the {args.rows:,} row dataset...")
+    source = datagen.dataset(args.rows, args.seed, args.data_dir)
+
+    results = {
+        "meta": {
+            "rows": args.rows,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "cold_repeat": args.cold_repeat,
+            "profile": db.get_profile(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "created": datetime.now().isoformat(timespec = "seconds"),
+        },
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # the CLI uses finances.db in its working directory
+        db_path = os.path.join(work_dir, db.DB_DEFAULT_PATH)
+        shutil.copy(source, db_path)
+
+        # each copy in its own directory, the shards are written next to the db they were archived from
+        archived_path, archiving_path = (os.path.join(work_dir, name, db.DB_DEFAULT_PATH) for name in ("archived", "archiving"))
+        for path in (archived_path, archiving_path):
+            os.makedirs(os.path.dirname(path))
+            shutil.copy(source, path)
+        db.archive(ARCHIVE_BEFORE, archived_path)
+
+        cases = db_cases(db_path, archived_path, archiving_path, args.rows)
+        if not args.no_cli:
+            cases += cli_cases(work_dir, archived_path, args.rows)
+
+        previous_dir = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            print(f"\n{'case':<34} {'cold':>10} {'warm':>10}")
+            for case in cases:
+                if args.only and args.only not in case.name:
+                    continue
+                timing = measure(case, args.repeat, args.cold_repeat, work_dir)
+                results["results"][case.name] = timing
+                print(f"{case.name:<34} {timing['cold'] * 1000:>8.2f}ms {timing['warm'] * 1000:>8.2f}ms")
+        finally:
+            os.chdir(previous_dir)
+
+    if args.output:
+        with open(args.output, "w") as outf:
+            json.dump(results, outf, indent = 2)
+        print(f"\nresults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as inf:
+            baseline = json.load(inf)
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nno regressions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Insert throughput of concurrent producers, direct add_expense calls against the GroupWriter.
+
+The producer threads share --rows expenses, so every producer count writes the same number of
+rows into a db of the same size (the per-row cost grows while the first few thousand rows fill
+the tables, comparing a small db with a large one would look like contention). Direct calls
+commit (and sync) once per row and queue on the db write lock, the GroupWriter commits the rows
+of all producers together.
+
+Run from the project root:
+    python3 benchmarks/bench_writer.py [--rows 8000] [--profile durable]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+import db.database as db
+from db.writer import GroupWriter
+from internal_libs.expense import Expense
+from internal_libs.category import ExpCategory
+
+EXPENSE = Expense(1.5, date(2024, 1, 1), "bench", ExpCategory.FOOD)
+
+def run_producers(producers: int, produce) -> float:
+    threads = [threading.Thread(target = produce) for _ in range(producers)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+def bench_direct(db_path: str, producers: int, rows: int) -> float:
+    def produce():
+        with db.Session(db_path) as session:
+            for _ in range(rows):
+                db.add_expense(EXPENSE, session)
+
+    return producers * rows / run_producers(producers, produce)
+
+def bench_group_writer(db_path: str, producers: int, rows: int) -> float:
+    with GroupWriter(db_path) as writer:
+        def produce():
+            futures = [writer.add_expense(EXPENSE) for _ in range(rows)]
+            for future in futures:
+                future.result()
+
+        return producers * rows / run_producers(producers, produce)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Group commit writer benchmark")
+    parser.add_argument("--rows", type = int, default = 8000, help = "Rows inserted by all producers together")
+    parser.add_argument("--profile", choices = list(db.PROFILES), default = "durable")
+    args = parser.parse_args()
+
+    db.set_profile(args.profile)
+    print(f"profile {args.profile}, {args.rows} rows split between the producers\n")
+    print(f"{'producers':>9} {'direct rows/s':>14} {'group writer rows/s':>20}")
+
+    for producers in (1, 2, 4, 8, 16):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "bench.db")
+            db.init_db(db_path)
+            direct = bench_direct(db_path, producers, args.rows // producers)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "bench.db")
+            db.init_db(db_path)
+            grouped = bench_group_writer(db_path, producers, args.rows // producers)
+
+        print(f"{producers:>9} {direct:>14,.0f} {grouped:>20,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Deterministic synthetic finance histories for the benchmarks.
+
+The same (rows, seed) always gives the same entries. Expenses follow a personal budget: many
+small food and transport payments, monthly bills and rent, the odd large purchase. Amounts are
+log-normal around a typical price per merchant, entries are spread evenly over the period in
+date order (as a real history is written) and about one in ten descriptions carries a reference
+number, so the descriptions table and the search index grow with the history.
+
+Build a db from the command line:
+    python3 benchmarks/datagen.py bench.db --rows 1m
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+from datetime import date, timedelta
+from typing import Iterator
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+import db.database as db
+from internal_libs.expense import Expense
+from internal_libs.income import Income
+from internal_libs.category import ExpCategory, IncCategory
+
+DEFAULT_SEED = 42
+DEFAULT_START = date(2000, 1, 1)
+DEFAULT_YEARS = 25
+INCOME_RATIO = 20 # one income for every 20 expenses
+UNIQUE_DESCRIPTION_RATE = 0.1
+
+# category -> (share of the entries, [(merchant, typical amount, spread)])
+EXPENSE_PROFILES = {
+    ExpCategory.FOOD: (0.45, [("Lidl", 35, 0.6), ("Continente", 45, 0.6), ("Bakery", 4, 0.4), ("Coffee", 2, 0.3),
+                              ("Restaurant", 25, 0.5), ("Pizza delivery", 18, 0.3)]),
+    ExpCategory.TRANSPORT: (0.2, [("Fuel", 50, 0.3), ("Train ticket", 8, 0.5), ("Metro card", 40, 0.1),
+                                  ("Taxi", 12, 0.6), ("Parking", 3, 0.5)]),
+    ExpCategory.UTILITIES: (0.1, [("Rent", 850, 0.05), ("Electricity bill", 60, 0.3), ("Water bill", 25, 0.3),
+                                  ("Internet", 35, 0.05), ("Phone", 15, 0.1)]),
+    ExpCategory.GAMING: (0.05, [("Steam", 20, 0.7), ("PlayStation Store", 40, 0.5), ("Nintendo eShop", 30, 0.5)]),
+    ExpCategory.OTHER: (0.2, [("Pharmacy", 15, 0.6), ("Clothes", 45, 0.7), ("Cinema", 9, 0.2), ("Gift", 30, 0.8),
+                              ("Haircut", 15, 0.2), ("Amazon order", 30, 1.0)]),
+}
+
+INCOME_PROFILES = {
+    IncCategory.SALARY: (0.6, [("Salary", 2200, 0.05), ("Bonus", 800, 0.5)]),
+    IncCategory.INVESTMENT: (0.25, [("Dividends", 120, 0.8), ("Interest", 15, 0.6)]),
+    IncCategory.OTHER: (0.15, [("Refund", 40, 0.9), ("Sold item", 60, 0.8), ("Gift", 50, 0.6)]),
+}
+
+def parse_rows(text: str) -> int:
+    """Row counts like 10000, 10k or 1m."""
+
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    text = text.strip().lower().replace("_", "")
+    try:
+        if text[-1:] in multipliers:
+            return int(float(text[:-1]) * multipliers[text[-1]])
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid row count: \"{text}\". Examples: 10000, 10k, 1m.")
+
+def _records(record_class, profiles: dict, rows: int, rng: random.Random, start: date, days: int) -> Iterator:
+    categories = list(profiles)
+    weights = [profiles[category][0] for category in categories]
+
+    for i in range(rows):
+        category = rng.choices(categories, weights)[0]
+        merchant, typical, spread = rng.choice(profiles[category][1])
+        amount = max(round(rng.lognormvariate(math.log(typical), spread), 2), 0.01)
+
+        description = merchant
+        if rng.random() < UNIQUE_DESCRIPTION_RATE:
+            description = f"{merchant} #{rng.randrange(1_000_000)}"
+
+        yield record_class(amount, start + timedelta(days = i * days // rows), description, category)
+
+def generate_expenses(rows: int, seed: int = DEFAULT_SEED, start: date = DEFAULT_START, years: int = DEFAULT_YEARS) -> Iterator[Expense]:
+    return _records(Expense, EXPENSE_PROFILES, rows, random.Random(f"exp-{seed}"), start, years * 365)
+
+def generate_incomes(rows: int, seed: int = DEFAULT_SEED, start: date = DEFAULT_START, years: int = DEFAULT_YEARS) -> Iterator[Income]:
+    return _records(Income, INCOME_PROFILES, rows, random.Random(f"inc-{seed}"), start, years * 365)
+
+def populate(db_path: str, rows: int, seed: int = DEFAULT_SEED, opening_balance: float = 1000):
+    """Creates the db at db_path with rows expenses and rows / INCOME_RATIO incomes."""
+
+    if not db.init_db(db_path):
+        raise RuntimeError(f"Can not create {db_path}")
+
+    db.set_balance(opening_balance, db_path)
+    for success, value in (db.import_expenses(generate_expenses(rows, seed), db_path),
+                           db.import_incomes(generate_incomes(max(rows // INCOME_RATIO, 1), seed), db_path)):
+        if not success:
+            raise RuntimeError(f"Import into {db_path} failed: {value}")
+
+def dataset(rows: int, seed: int = DEFAULT_SEED, directory: str | None = None) -> str:
+    """Path of a db with the synthetic history, built once per (rows, seed) and reused by later runs."""
+
+    directory = directory or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data")
+    os.makedirs(directory, exist_ok = True)
+
+    # the schema version is part of the name so dbs built by an older release are not reused
+    path = os.path.join(directory, f"finances-{rows}-{seed}-v{db.SCHEMA_VERSION}.db")
+    if not os.path.exists(path):
+        building = path + ".building"
+        if os.path.exists(building):
+            os.remove(building)
+        populate(building, rows, seed)
+        os.replace(building, path)
+
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description = "Synthetic finances db generator")
+    parser.add_argument("db_path", help = "Db file to create")
+    parser.add_argument("--rows", type = parse_rows, default = 100_000, help = "Number of expenses, e.g. 10k or 10m (default: 100k)")
+    parser.add_argument("--seed", type = int, default = DEFAULT_SEED)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db_path):
+        print(f"{args.db_path} already exists.")
+        return
+
+    populate(args.db_path, args.rows, args.seed)
+    print(f"{args.db_path}: {args.rows:,} expenses, {max(args.rows // INCOME_RATIO, 1):,} incomes")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,24 @@
 import argparse
+import csv
+import gzip
+import io
+import math
+import os
+import shlex
+import sys
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
+from functools import lru_cache
 
 from internal_libs.category import ExpCategory
 from internal_libs.category import IncCategory
 from internal_libs.expense import Expense
 from internal_libs.income import Income
+from internal_libs import analytics
+from internal_libs import household
 import db.database as db
+from db import tracing
+from db.filters import FilterError, compile_filter, compile_search
 
 def handle_categories_command():
     print(f"Possible categories for Expenses: {Expense.list_categories()}")
@@ -28,22 +41,43 @@ def handle_show_balance():
 def handle_set_balance(args):
     print("SUCCESS: New balance set." if db.set_balance(args.balance) else "ERROR: Error while trying to change the balance value.")
 
+def handle_balance_at(args):
+    success, value = db.get_balance_at(args.date)
+
+    if success:
+        print(f"Balance on {args.date}: {value:.2f}€")
+    else:
+        print(f"ERROR: {value}.")
+
+def handle_balance_series(args):
+    if args.end < args.start:
+        print("ERROR: The end date needs to be after the start date.")
+        return
+
+    success, value = db.get_balance_series(args.start, args.end)
+
+    if not success:
+        print(f"ERROR: {value}.")
+        return
+
+    for day, balance in value:
+        print(f"{day}: {balance:.2f}€")
+
 # EXPENSES CLI LOGIC _______________________________________________
 
-def handle_exp_list_command():
-    success, value = db.get_expenses()
+def handle_exp_list_command(args):
+    if args.limit is not None and args.limit <= 0:
+        print("ERROR: Limit needs to be positive (> 0).")
+        return
+
+    success, value = db.iter_expense_records(args.limit, args.after_id, args.before_date, args.order, args.where)
 
     if not success:
         print(f"ERROR: {value}.")
         return
 
-    for exp in value:
-        id = exp[0]
-        exp_class = Expense(exp[4],                           # exp[4] = amount
-                            exp[1],                           # exp[1] = date
-                            exp[2],                           # exp[2] = description
-                            ExpCategory(exp[3].capitalize())) # exp[3] = category
-        print(f"(id:{id}) {exp_class}")
+    for expense in value:
+        print(f"(id:{expense.id}) {expense}")
 
 def handle_add_exp_command(args):
     if args.amount <= 0:
@@ -66,33 +100,56 @@ def handle_edit_exp_command(args):
         print("ERROR: Amount needs to be positive (> 0).")
         return
     
-    print("SUCCESS: Edit successful." if db.edit_expense(args.id, args.date, args.description, args.category, args.amount)
-          else "ERROR: Edit failed.")
+    elif not args.ids and args.where is None:
+        print("ERROR: Choose the expenses to edit by id or with --where.")
+        return
+
+    if len(args.ids) == 1 and args.where is None:
+        print("SUCCESS: Edit successful." if db.edit_expense(args.ids[0], args.date, args.description, args.category, args.amount)
+              else "ERROR: Edit failed.")
+        return
+
+    success, value = db.edit_expenses(args.ids or None, args.where, args.date, args.description, args.category, args.amount)
+    print(f"SUCCESS: Edited {value} expenses." if success else f"ERROR: {value}.")
 
 def handle_del_exp_command(args):
-    print("SUCCESS: Deletion successful." if db.del_expense(args.id) else "ERROR: Deletion failed.")
+    if not args.ids and args.where is None:
+        print("ERROR: Choose the expenses to delete by id or with --where.")
+        return
+
+    if len(args.ids) == 1 and args.where is None:
+        print("SUCCESS: Deletion successful." if db.del_expense(args.ids[0]) else "ERROR: Deletion failed.")
+        return
+
+    success, value = db.del_expenses(args.ids or None, args.where)
+    print(f"SUCCESS: Deleted {value} expenses." if success else f"ERROR: {value}.")
     
 def validate_expense_category(category: str):
     if category.capitalize() not in [category.value for category in ExpCategory]:
         raise argparse.ArgumentTypeError(f"Invalid category: \"{category}\". Choose from {[category.value for category in ExpCategory]}.")
     return ExpCategory(category.capitalize())
 
+def validate_expense_filter(text: str):
+    try:
+        return compile_filter(text, ExpCategory)
+    except FilterError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
 # INCOMES CLI LOGIC ________________________________________________
 
-def handle_inc_list_command():
-    success, value = db.get_incomes()
+def handle_inc_list_command(args):
+    if args.limit is not None and args.limit <= 0:
+        print("ERROR: Limit needs to be positive (> 0).")
+        return
+
+    success, value = db.iter_income_records(args.limit, args.after_id, args.before_date, args.order, args.where)
 
     if not success:
         print(f"ERROR: {value}.")
         return
 
-    for inc in value:
-        id = inc[0]
-        inc_class = Income(inc[4],                           # inc[4] = amount
-                           inc[1],                           # inc[1] = date
-                           inc[2],                           # inc[2] = description
-                           IncCategory(inc[3].capitalize())) # inc[3] = category
-        print(f"(id:{id}) {inc_class}")
+    for income in value:
+        print(f"(id:{income.id}) {income}")
 
 def handle_add_inc_command(args):
     if args.amount <= 0:
@@ -115,29 +172,466 @@ def handle_edit_inc_command(args):
         print("ERROR: Amount needs to be positive (> 0).")
         return
     
-    print("SUCCESS: Edit successful." if db.edit_income(args.id, args.date, args.description, args.category, args.amount)
-          else "ERROR: Edit failed.")
+    elif not args.ids and args.where is None:
+        print("ERROR: Choose the incomes to edit by id or with --where.")
+        return
+
+    if len(args.ids) == 1 and args.where is None:
+        print("SUCCESS: Edit successful." if db.edit_income(args.ids[0], args.date, args.description, args.category, args.amount)
+              else "ERROR: Edit failed.")
+        return
+
+    success, value = db.edit_incomes(args.ids or None, args.where, args.date, args.description, args.category, args.amount)
+    print(f"SUCCESS: Edited {value} incomes." if success else f"ERROR: {value}.")
 
 def handle_del_inc_command(args):
-    print("SUCCESS: Deletion successful." if db.del_income(args.id) else "ERROR: Deletion failed.")
+    if not args.ids and args.where is None:
+        print("ERROR: Choose the incomes to delete by id or with --where.")
+        return
+
+    if len(args.ids) == 1 and args.where is None:
+        print("SUCCESS: Deletion successful." if db.del_income(args.ids[0]) else "ERROR: Deletion failed.")
+        return
+
+    success, value = db.del_incomes(args.ids or None, args.where)
+    print(f"SUCCESS: Deleted {value} incomes." if success else f"ERROR: {value}.")
 
 def validate_income_category(category: str):
     if category.capitalize() not in [category.value for category in IncCategory]:
         raise argparse.ArgumentTypeError(f"Invalid category: \"{category}\". Choose from {[category.value for category in IncCategory]}.")
     return IncCategory(category.capitalize())
 
+def validate_income_filter(text: str):
+    try:
+        return compile_filter(text, IncCategory)
+    except FilterError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+# SUMMARY CLI LOGIC ________________________________________________
+
+SUMMARY_KIND_NAMES = {"exp": "Expenses", "inc": "Incomes"}
+
+def validate_month(month: str):
+    try:
+        return datetime.strptime(month, "%Y-%m").strftime("%Y-%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid month format: \"{month}\". Expected YYYY-MM.")
+
+def handle_summary_command(args):
+    if args.rebuild and not db.rebuild_monthly_totals():
+        print("ERROR: Error while trying to rebuild the summary.")
+        return
+
+    success, value = db.get_monthly_totals(args.type, args.start, args.end)
+
+    if not success:
+        print(f"ERROR: {value}.")
+        return
+
+    if not value:
+        print("No entries for this period.")
+
+    for kind, month, category, total, count in value:
+        print(f"{month} {SUMMARY_KIND_NAMES[kind]:<8} {category.capitalize():<10} {total:>10.2f}€ ({count} entries)")
+
+# STATS CLI LOGIC __________________________________________________
+
+def format_amount(value: float) -> str:
+    return "-" if value != value else f"{value:.2f}€" # NaN when there is nothing to compute
+
+def format_rate(value: float) -> str:
+    return "-" if value != value else f"{value * 100:.1f}%"
+
+def handle_stats_command(args):
+    if args.window <= 0:
+        print("ERROR: Window needs to be positive (> 0).")
+        return
+    if args.start is not None and args.end is not None and args.end < args.start:
+        print("ERROR: The end date needs to be after the start date.")
+        return
+    if not analytics.numpy_available():
+        print("ERROR: The stats command needs NumPy (pip install numpy).")
+        return
+
+    success, report = analytics.get_report(args.start, args.end, args.window)
+    if not success:
+        print(f"ERROR: {report}.")
+        return
+
+    if not report.months:
+        print("No entries for this period.")
+        return
+
+    print("Expenses by category:")
+    for category, total in report.expense_categories.items():
+        print(f"  {category.value:<10} {format_amount(total):>12}")
+    print("Incomes by category:")
+    for category, total in report.income_categories.items():
+        print(f"  {category.value:<10} {format_amount(total):>12}")
+
+    print(f"\n{'Month':<8} {'Expenses':>12} {'Incomes':>12} {'Saved':>7} {f'{args.window}m avg exp':>12}")
+    for i, month in enumerate(report.months):
+        print(f"{month:<8} {format_amount(report.monthly_expenses[i]):>12} {format_amount(report.monthly_incomes[i]):>12} "
+              f"{format_rate(report.monthly_savings_rate[i]):>7} {format_amount(report.moving_average[i]):>12}")
+
+    if report.percentiles:
+        print("\nExpense amounts: " + ", ".join(f"p{quantile} {format_amount(value)}" for quantile, value in report.percentiles.items()))
+    print(f"Savings rate: {format_rate(report.savings_rate)}")
+
+# HOUSEHOLD REPORT CLI LOGIC _______________________________________
+
+def handle_report_command(args):
+    if args.workers is not None and args.workers <= 0:
+        print("ERROR: Workers needs to be positive (> 0).")
+        return
+    if args.start is not None and args.end is not None and args.end < args.start:
+        print("ERROR: The end month needs to be after the start month.")
+        return
+
+    success, report = household.get_report(args.db or [db.DB_DEFAULT_PATH], args.start, args.end, args.workers)
+    if not success:
+        print(f"ERROR: {report}.")
+        return
+
+    print(f"Databases: {', '.join(report.files)}")
+    print(f"Current balance: {report.balance:.2f}€")
+
+    if not report.months:
+        print("No entries for this period.")
+        return
+
+    for kind, (total, count) in report.totals.items():
+        print(f"{SUMMARY_KIND_NAMES[kind]}: {total:.2f}€ ({count} entries)")
+
+    print("\nBy category:")
+    for (kind, category), (total, count) in report.categories.items():
+        print(f"  {SUMMARY_KIND_NAMES[kind]:<8} {category.capitalize():<10} {total:>12.2f}€ ({count} entries)")
+
+    print(f"\n{'Month':<8} {'Expenses':>12} {'Incomes':>12} {'Net':>12}")
+    for month in report.months:
+        expenses = report.monthly.get(("exp", month), 0)
+        incomes = report.monthly.get(("inc", month), 0)
+        print(f"{month:<8} {format_amount(expenses):>12} {format_amount(incomes):>12} {format_amount(incomes - expenses):>12}")
+
+# SEARCH CLI LOGIC _________________________________________________
+
+def validate_search(text: str):
+    try:
+        return compile_search(text)
+    except FilterError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def handle_search_command(args):
+    if args.limit <= 0:
+        print("ERROR: Limit needs to be positive (> 0).")
+        return
+    if args.page <= 0:
+        print("ERROR: Page needs to be positive (> 0).")
+        return
+
+    success, value = db.search(args.query, args.type, args.limit, (args.page - 1) * args.limit)
+
+    if not success:
+        print(f"ERROR: {value}.")
+        return
+
+    if not value:
+        print("No matches." if args.page == 1 else "No more matches.")
+
+    for record in value:
+        print(f"(id:{record.id}) {record}")
+
+# IMPORT CLI LOGIC _________________________________________________
+
+def read_csv_records(file, record_class, validate_category, default_category):
+    """Lazily turns the rows of a csv file into Expense/Income objects, raises ValueError on the first invalid row.
+
+    The header must have an "amount" column, "date", "description" and "category" are optional.
+    """
+
+    reader = csv.DictReader(file)
+    if reader.fieldnames is None or "amount" not in reader.fieldnames:
+        raise ValueError("CSV header needs at least an \"amount\" column")
+
+    # bank exports repeat the same dates and categories a lot, no need to parse them again
+    parse_date = lru_cache(maxsize = 4096)(validate_date)
+    parse_category = lru_cache(maxsize = None)(validate_category)
+    today = datetime.today().date()
+
+    for row in reader:
+        try:
+            amount = float(row["amount"])
+            if not math.isfinite(amount): # float() also parses "nan" and "inf"
+                raise ValueError(f"Invalid amount: \"{row['amount']}\".")
+            if amount <= 0:
+                raise ValueError("Amount needs to be positive (> 0).")
+
+            record = record_class(amount,
+                                  parse_date(row["date"]) if row.get("date") else today,
+                                  row.get("description") or "",
+                                  parse_category(row["category"]) if row.get("category") else default_category)
+
+        except (ValueError, argparse.ArgumentTypeError) as e:
+            raise ValueError(f"Line {reader.line_num}: {e}")
+
+        yield record
+
+def handle_import_csv_command(args):
+    if args.type == "exp":
+        name, import_records = "expenses", db.import_expenses
+        record_args = (Expense, validate_expense_category, ExpCategory.OTHER)
+    else:
+        name, import_records = "incomes", db.import_incomes
+        record_args = (Income, validate_income_category, IncCategory.OTHER)
+
+    try:
+        with open(args.file, newline = "") as inf:
+            success, value = import_records(read_csv_records(inf, *record_args))
+    except OSError:
+        print(f"ERROR: Could not read file \"{args.file}\".")
+        return
+
+    print(f"SUCCESS: Imported {value} {name}." if success else f"ERROR: {value.rstrip('.')}. Nothing was imported.")
+
+# EXPORT CLI LOGIC _________________________________________________
+
+EXPORT_TYPES = {"exp": ("exp",), "inc": ("inc",), "all": ("exp", "inc")}
+EXPORT_CATEGORIES = {"exp": ExpCategory, "inc": IncCategory, "all": None} # None: category names are not checked
+EXPORT_BUFFER_SIZE = 1 << 20
+EXPORT_GZIP_LEVEL = 1 # exports are hand-offs, compressing fast matters more than the last few percent of size
+
+def export_format(path: str, format: str | None) -> str:
+    """The requested format, otherwise the one of the file extension (.jsonl, .jsonl.gz, ...), csv by default."""
+
+    if format is not None:
+        return format
+    name = path[:-3] if path.endswith(".gz") else path
+    return "jsonl" if name.endswith((".jsonl", ".json")) else "csv"
+
+@contextmanager
+def open_export(path: str, compress: bool):
+    """Buffered text stream writing to path ("-" for stdout, left open on close), gzip compressed if asked.
+
+    Every layer is closed on exit, the file last, so a failed write of the buffered data raises OSError.
+    """
+
+    with ExitStack() as stack:
+        raw = stack.enter_context(open(sys.stdout.fileno() if path == "-" else path, "wb", buffering = EXPORT_BUFFER_SIZE, closefd = path != "-"))
+        if compress:
+            # GzipFile compresses every write, batch the small writes of the text layer first. Closing
+            # it only writes the trailer to raw, raw is closed (and flushed) after it.
+            raw = stack.enter_context(io.BufferedWriter(gzip.GzipFile(fileobj = raw, mode = "wb", compresslevel = EXPORT_GZIP_LEVEL), EXPORT_BUFFER_SIZE))
+        yield stack.enter_context(io.TextIOWrapper(raw, encoding = "utf-8", newline = ""))
+
+def write_export(output, chunks, format: str) -> int:
+    """Writes the chunks of db.iter_export to output, returns the number of rows."""
+
+    rows = 0
+    if format == "csv":
+        writer = csv.writer(output)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            rows += len(chunk)
+    else:
+        for chunk in chunks:
+            output.write("\n".join([row[0] for row in chunk]))
+            output.write("\n")
+            rows += len(chunk)
+    return rows
+
+def handle_export_command(args):
+    if args.start is not None and args.end is not None and args.end < args.start:
+        print("ERROR: The end date needs to be after the start date.")
+        return
+
+    try:
+        where = compile_filter(args.where, EXPORT_CATEGORIES[args.type]) if args.where else None
+    except FilterError as e:
+        print(f"ERROR: {e}")
+        return
+
+    format = export_format(args.file, args.format)
+    error = None
+    rows = 0
+
+    try:
+        with open_export(args.file, args.gzip or args.file.endswith(".gz")) as output:
+            if format == "csv":
+                csv.writer(output).writerow(db.EXPORT_COLUMNS)
+
+            for kind in EXPORT_TYPES[args.type]:
+                success, value = db.iter_export(kind, format, args.start, args.end, where)
+                if not success:
+                    error = value
+                    break
+                rows += write_export(output, value, format)
+
+    except OSError:
+        error = f"Could not write file \"{args.file}\""
+
+    if error is None:
+        if args.file != "-": # the data is the output otherwise
+            print(f"SUCCESS: Exported {rows} rows to {args.file}.")
+        return
+
+    if args.file != "-" and os.path.exists(args.file):
+        os.remove(args.file) # no half written exports
+    print(f"ERROR: {error}.")
+
+# ARCHIVE CLI LOGIC ________________________________________________
+
+def validate_year(year: str):
+    try:
+        return datetime.strptime(year, "%Y").year
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid year: \"{year}\". Expected YYYY.")
+
+def handle_archive_command(args):
+    success, value = db.archive(args.before)
+
+    if not success:
+        print(f"ERROR: {value}.")
+        return
+
+    expenses, incomes = value
+    if not expenses and not incomes:
+        print(f"Nothing to archive before {args.before}.")
+        return
+
+    print(f"SUCCESS: Archived {expenses} expenses and {incomes} incomes dated before {args.before}.")
+
+# BATCH / SHELL CLI LOGIC __________________________________________
+
+SHELL_PROMPT = "finances> "
+SHELL_EXIT_COMMANDS = ("exit", "quit")
+
+def run_command_line(parser, line: str) -> bool:
+    """Parses one line with the same grammar as the command line and runs it, returns False if it is not a valid command."""
+
+    try:
+        words = shlex.split(line, comments = True)
+    except ValueError as e:
+        print(f"ERROR: {str(e).capitalize()}.")
+        return False
+
+    if not words:
+        return True
+
+    try:
+        args = parser.parse_args(words)
+    except SystemExit: # argparse already printed the usage error (or the help)
+        return False
+
+    if args.command in ("batch", "shell"):
+        print(f"ERROR: {args.command} can not be used inside a batch or shell.")
+        return False
+
+    # the profile and the tracing are set once for the whole session, by the options of the batch or shell command
+    if args.profile is not None or args.trace is not None:
+        option = "--profile" if args.profile is not None else "--trace" if args.trace == tracing.SUMMARY_DESTINATION else "--trace-file"
+        print(f"ERROR: {option} can not be used inside a batch or shell, give it to the batch or shell command itself.")
+        return False
+
+    dispatch(args)
+    return True
+
+def run_commands(parser, lines, group: int, db_path: str = db.DB_DEFAULT_PATH):
+    """Runs every line through one parser and one db session, committing group commands at a time."""
+
+    with db.Session(db_path) as session, db.use_session(session):
+        pending = 0
+        try:
+            for line in lines:
+                if group > 1 and not session.grouped:
+                    session.begin_group()
+                    pending = 0
+
+                run_command_line(parser, line)
+
+                pending += 1
+                if session.grouped and pending == group:
+                    session.end_group()
+        finally:
+            # every finished command is kept, an interrupted one was already undone by its savepoint
+            if session.grouped:
+                session.end_group()
+
+def read_shell_lines():
+    while True:
+        try:
+            line = input(SHELL_PROMPT)
+        except EOFError:
+            print()
+            return
+        except KeyboardInterrupt:
+            print()
+            continue
+
+        if line.strip().lower() in SHELL_EXIT_COMMANDS:
+            return
+        yield line
+
+def handle_batch_command(args):
+    if args.group <= 0:
+        print("ERROR: Group size needs to be positive (> 0).")
+        return
+
+    parser = build_parser()
+
+    if args.file == "-":
+        run_commands(parser, sys.stdin, args.group)
+        return
+
+    try:
+        with open(args.file) as inf:
+            run_commands(parser, inf, args.group)
+    except OSError:
+        print(f"ERROR: Could not read file \"{args.file}\".")
+
+def handle_shell_command(args):
+    if args.group <= 0:
+        print("ERROR: Group size needs to be positive (> 0).")
+        return
+
+    print(f"Type a command (e.g. show_balance, -h for the list) or {' / '.join(SHELL_EXIT_COMMANDS)} to leave.")
+    run_commands(build_parser(), read_shell_lines(), args.group)
+
 # __________________________________________________________________
 
-def main():
+def add_list_arguments(list_parser, name: str, validate_filter):
+    list_parser.add_argument("--limit", type = int, help = f"Maximum number of {name} to list", metavar = "")
+    list_parser.add_argument("--after-id", type = int, help = f"Only list {name} after this id (in listing order), to continue a previous page", metavar = "")
+    list_parser.add_argument("--before-date", type = validate_date, help = f"Only list {name} dated before this day (YYYY-MM-DD)", metavar = "")
+    list_parser.add_argument("--order", choices = ["asc", "desc"], default = "asc", help = "List by ascending or descending id (default: asc)")
+    list_parser.add_argument("--where", type = validate_filter, help = f"Only list {name} matching a filter, e.g. \"date >= 2024-01-01 and (category = food or amount > 50)\"", metavar = "")
+
+def add_selection_arguments(parser, name: str, validate_filter):
+    parser.add_argument("ids", nargs = "*", type = int, help = f"IDs of the {name}", metavar = "id")
+    parser.add_argument("--where", type = validate_filter, help = f"The {name} matching a filter, as in list_exp (and one of the ids if given)", metavar = "")
+
+def build_parser():
     parser = argparse.ArgumentParser(description = "Personal Finances Tracker CLI")
+    parser.add_argument("--profile", choices = list(db.PROFILES), help = f"Db performance profile for this command (default: ${db.PROFILE_ENV_VAR} or {db.DEFAULT_PROFILE})")
+    parser.add_argument("--trace", action = "store_const", const = tracing.SUMMARY_DESTINATION,
+                        help = f"Time the db operations and the command and print a summary on stderr (also ${tracing.TRACE_ENV_VAR}=1)")
+    parser.add_argument("--trace-file", dest = "trace", metavar = "FILE",
+                        help = f"Like --trace, but writes the metrics to FILE in the Prometheus text format (also ${tracing.TRACE_ENV_VAR}=FILE)")
     subparsers = parser.add_subparsers(dest = "command", required = True)
 
     get_balance_parser = subparsers.add_parser("show_balance", help = "Displays the current balance")
     set_balance_parser = subparsers.add_parser("set_balance", help = "Set the balance value")
     set_balance_parser.add_argument("balance", type = float, help = "Balance value to set")
 
+    balance_at_parser = subparsers.add_parser("balance_at", help = "Displays the balance at the end of a past day")
+    balance_at_parser.add_argument("date", type = validate_date, help = "Day of the balance (YYYY-MM-DD)")
+    balance_series_parser = subparsers.add_parser("balance_series", help = "Displays the balance on every day it changed within a period")
+    balance_series_parser.add_argument("start", type = validate_date, help = "First day of the period (YYYY-MM-DD)")
+    balance_series_parser.add_argument("end", type = validate_date, help = "Last day of the period (YYYY-MM-DD)")
+
     exp_list_parser = subparsers.add_parser("list_exp", help = "Lists all expenses")
     inc_list_parser = subparsers.add_parser("list_inc", help = "Lists all incomes")
+    add_list_arguments(exp_list_parser, "expenses", validate_expense_filter)
+    add_list_arguments(inc_list_parser, "incomes", validate_income_filter)
 
     category_parser = subparsers.add_parser("categories", help = "Lists all expense and income categories")
 
@@ -153,35 +647,87 @@ def main():
     add_inc_parser.add_argument("--date", type = validate_date, help = "Date of the income (YYYY-MM-DD)", metavar = "")
     add_inc_parser.add_argument("--category", type = validate_income_category, help = "Category of the income", metavar = "")
 
-    edit_exp_parser = subparsers.add_parser("edit_exp", help = "Edit a expense")
-    edit_exp_parser.add_argument("id", type = int, help = "ID of the expense")
+    edit_exp_parser = subparsers.add_parser("edit_exp", help = "Edits expenses")
+    add_selection_arguments(edit_exp_parser, "expenses", validate_expense_filter)
     edit_exp_parser.add_argument("--amount", type = float, help = "New amount of the expense")
     edit_exp_parser.add_argument("--description", help = "New description of the expense", metavar = "")
     edit_exp_parser.add_argument("--date", type = validate_date, help = "New date of the expense (YYYY-MM-DD)", metavar = "")
     edit_exp_parser.add_argument("--category", type = validate_expense_category, help = "New category of the expense", metavar = "")
 
-    edit_inc_parser = subparsers.add_parser("edit_inc", help = "Edit a income")
-    edit_inc_parser.add_argument("id", type = int, help = "ID of the income")
+    edit_inc_parser = subparsers.add_parser("edit_inc", help = "Edits incomes")
+    add_selection_arguments(edit_inc_parser, "incomes", validate_income_filter)
     edit_inc_parser.add_argument("--amount", type = float, help = "New amount of the income")
     edit_inc_parser.add_argument("--description", help = "New description of the income", metavar = "")
     edit_inc_parser.add_argument("--date", type = validate_date, help = "New date of the income (YYYY-MM-DD)", metavar = "")
     edit_inc_parser.add_argument("--category", type = validate_income_category, help = "New category of the income", metavar = "")
 
-    del_exp_parser = subparsers.add_parser("del_exp", help = "Deletes the expense")
-    del_exp_parser.add_argument("id", type = int, help = "ID of the expense")
-
-    del_inc_parser = subparsers.add_parser("del_inc", help = "Deletes the income")
-    del_inc_parser.add_argument("id", type = int, help = "ID of the income")
-
-    args = parser.parse_args()
+    del_exp_parser = subparsers.add_parser("del_exp", help = "Deletes expenses")
+    add_selection_arguments(del_exp_parser, "expenses", validate_expense_filter)
+
+    del_inc_parser = subparsers.add_parser("del_inc", help = "Deletes incomes")
+    add_selection_arguments(del_inc_parser, "incomes", validate_income_filter)
+
+    import_csv_parser = subparsers.add_parser("import_csv", help = "Imports expenses or incomes from a csv file")
+    import_csv_parser.add_argument("file", help = "Path of the csv file (header: date,description,category,amount)")
+    import_csv_parser.add_argument("--type", choices = ["exp", "inc"], required = True, help = "Import the rows as expenses or incomes")
+
+    summary_parser = subparsers.add_parser("summary", help = "Shows monthly totals per category")
+    summary_parser.add_argument("--type", choices = ["exp", "inc"], help = "Only show expenses or incomes")
+    summary_parser.add_argument("--from", dest = "start", type = validate_month, help = "First month to show (YYYY-MM)", metavar = "")
+    summary_parser.add_argument("--to", dest = "end", type = validate_month, help = "Last month to show (YYYY-MM)", metavar = "")
+    summary_parser.add_argument("--rebuild", action = "store_true", help = "Recompute the monthly totals from all entries first")
+
+    stats_parser = subparsers.add_parser("stats", help = "Shows category totals, monthly series, percentiles and savings rate (needs NumPy)")
+    stats_parser.add_argument("--from", dest = "start", type = validate_date, help = "First day to include (YYYY-MM-DD)", metavar = "")
+    stats_parser.add_argument("--to", dest = "end", type = validate_date, help = "Last day to include (YYYY-MM-DD)", metavar = "")
+    stats_parser.add_argument("--window", type = int, default = analytics.DEFAULT_WINDOW, help = f"Months of the moving average (default: {analytics.DEFAULT_WINDOW})", metavar = "")
+
+    report_parser = subparsers.add_parser("report", help = "Shows totals per category and month over one or more dbs")
+    report_parser.add_argument("--db", action = "append", help = "Db file to include, repeat for several (default: the app db)", metavar = "FILE")
+    report_parser.add_argument("--from", dest = "start", type = validate_month, help = "First month to include (YYYY-MM)", metavar = "")
+    report_parser.add_argument("--to", dest = "end", type = validate_month, help = "Last month to include (YYYY-MM)", metavar = "")
+    report_parser.add_argument("--workers", type = int, help = "Processes reading the dbs (default: one per db, at most one per core)", metavar = "")
+
+    search_parser = subparsers.add_parser("search", help = "Finds expenses and incomes by description, best matches first")
+    search_parser.add_argument("query", type = validate_search, help = "Words to look for, word* for words starting with word, \"several words\" for a phrase")
+    search_parser.add_argument("--type", choices = ["exp", "inc"], help = "Only search expenses or incomes")
+    search_parser.add_argument("--limit", type = int, default = db.SEARCH_DEFAULT_LIMIT, help = f"Matches per page (default: {db.SEARCH_DEFAULT_LIMIT})", metavar = "")
+    search_parser.add_argument("--page", type = int, default = 1, help = "Page of matches to show (default: 1)", metavar = "")
+
+    export_parser = subparsers.add_parser("export", help = "Writes expenses and/or incomes to a CSV or JSON Lines file")
+    export_parser.add_argument("file", help = "File to write (\"-\" for stdout), a .gz name compresses it")
+    export_parser.add_argument("--type", choices = list(EXPORT_TYPES), default = "all", help = "Export expenses, incomes or both (default: all)")
+    export_parser.add_argument("--format", choices = list(db.EXPORT_FORMATS), help = "csv or jsonl (default: from the file name, otherwise csv)")
+    export_parser.add_argument("--gzip", action = "store_true", help = "Compress with gzip (default: when the file name ends with .gz)")
+    export_parser.add_argument("--from", dest = "start", type = validate_date, help = "First day to export (YYYY-MM-DD)", metavar = "")
+    export_parser.add_argument("--to", dest = "end", type = validate_date, help = "Last day to export (YYYY-MM-DD)", metavar = "")
+    export_parser.add_argument("--where", help = "Only export entries matching a filter, as in list_exp", metavar = "")
+
+    archive_parser = subparsers.add_parser("archive", help = "Moves old entries to one archive file per year")
+    archive_parser.add_argument("--before", type = validate_year, required = True, help = "Archive the entries dated before this year (YYYY)", metavar = "")
+
+    batch_parser = subparsers.add_parser("batch", help = "Runs the commands of a file (one per line) in one process")
+    batch_parser.add_argument("file", nargs = "?", default = "-", help = "File with the commands, reads stdin when missing or \"-\"")
+    batch_parser.add_argument("--group", type = int, default = 1, help = "Number of commands committed together in one transaction (default: 1)", metavar = "")
+
+    shell_parser = subparsers.add_parser("shell", help = "Interactive mode, type commands without the \"python3 src/main.py\" prefix")
+    shell_parser.add_argument("--group", type = int, default = 1, help = "Number of commands committed together in one transaction (default: 1)", metavar = "")
+
+    return parser
+
+def dispatch(args):
     if args.command == "show_balance":
         handle_show_balance()
     elif args.command == "set_balance":
         handle_set_balance(args)
+    elif args.command == "balance_at":
+        handle_balance_at(args)
+    elif args.command == "balance_series":
+        handle_balance_series(args)
     elif args.command == "list_exp":
-        handle_exp_list_command()
+        handle_exp_list_command(args)
     elif args.command == "list_inc":
-        handle_inc_list_command()
+        handle_inc_list_command(args)
     elif args.command == "categories":
         handle_categories_command()
     elif args.command == "add_exp":
@@ -196,8 +742,51 @@ def main():
         handle_edit_inc_command(args)
     elif args.command == "del_inc":
         handle_del_inc_command(args)
+    elif args.command == "import_csv":
+        handle_import_csv_command(args)
+    elif args.command == "summary":
+        handle_summary_command(args)
+    elif args.command == "stats":
+        handle_stats_command(args)
+    elif args.command == "report":
+        handle_report_command(args)
+    elif args.command == "search":
+        handle_search_command(args)
+    elif args.command == "export":
+        handle_export_command(args)
+    elif args.command == "archive":
+        handle_archive_command(args)
+    elif args.command == "batch":
+        handle_batch_command(args)
+    elif args.command == "shell":
+        handle_shell_command(args)
     else:
         print("ERROR: Unknown command.") # should never happen
 
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parses the command line and applies its --profile and --trace options, before the db is opened."""
+
+    args = build_parser().parse_args(argv)
+    if args.profile is not None:
+        db.set_profile(args.profile)
+    if args.trace is not None:
+        tracing.enable(args.trace)
+    return args
+
+def main(args: argparse.Namespace | None = None):
+    if args is None:
+        args = parse_args()
+
+    if not tracing.enabled():
+        dispatch(args)
+        return
+
+    # the handler time left after the db operations it called is parsing and printing
+    tracing.instrument(sys.modules[__name__], "cli.", lambda name: name.startswith("handle_"))
+    try:
+        dispatch(args)
+    finally:
+        tracing.report()
+
 if __name__ == "__main__":
     main()
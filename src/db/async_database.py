@@ -0,0 +1,218 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from functools import partial
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator
+
+import db.database as db
+from db.database import DB_DEFAULT_PATH, FETCH_CHUNK_SIZE, IMPORT_BATCH_SIZE, POOL_DEFAULT_SIZE, SEARCH_DEFAULT_LIMIT, Session, SessionPool
+from db.filters import Filter
+from internal_libs.expense import Expense
+from internal_libs.income import Income
+
+# asyncio counterpart of db.database for services that can not block their event loop.
+# Every call runs the matching db.database function in a worker thread, so results and error
+# returns are exactly the same. All writes go through one writer thread and connection, so
+# concurrent coroutines queue up on it instead of fighting for the db write lock. Reads use a
+# small pool of their own connections (the db is in WAL mode, they do not wait for the writer).
+
+class AsyncDatabase:
+    """Async access to one db file, use as "async with AsyncDatabase(path) as adb" or call close()."""
+
+    def __init__(self, db_path: str = DB_DEFAULT_PATH, readers: int = POOL_DEFAULT_SIZE):
+        self.db_path = db_path
+        self._writer = None # created by the writer thread on its first call
+        self._writer_executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "db-writer")
+        self._reader_pool = SessionPool(db_path, size = readers)
+        self._reader_executor = ThreadPoolExecutor(max_workers = readers, thread_name_prefix = "db-reader")
+
+    async def _write(self, function, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._writer_executor, partial(self._call_writer, function, *args, **kwargs))
+
+    async def _read(self, function, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._reader_executor, partial(self._call_reader, function, *args, **kwargs))
+
+    # the db functions report their own errors, only opening a session can raise here. In that case
+    # the function is called with the db path so it fails (and returns) exactly like the sync call.
+
+    def _call_writer(self, function, *args, **kwargs):
+        try:
+            if self._writer is None:
+                self._writer = Session(self.db_path)
+        except sqlite3.Error:
+            return function(*args, db_path = self.db_path, **kwargs)
+
+        return function(*args, db_path = self._writer, **kwargs)
+
+    def _call_reader(self, function, *args, **kwargs):
+        try:
+            with self._reader_pool.session() as session:
+                return function(*args, db_path = session, **kwargs)
+        except sqlite3.Error:
+            return function(*args, db_path = self.db_path, **kwargs)
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer_executor, self._close_writer)
+        await loop.run_in_executor(self._reader_executor, self._reader_pool.close)
+        self._writer_executor.shutdown()
+        self._reader_executor.shutdown()
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # BALANCE _____________________________________________________
+
+    async def init_db(self) -> bool:
+        return await self._write(db.init_db)
+
+    async def get_balance(self) -> tuple[bool, float | str]:
+        return await self._read(db.get_balance)
+
+    async def set_balance(self, balance: float) -> bool:
+        return await self._write(db.set_balance, balance)
+
+    async def get_balance_at(self, day: date) -> tuple[bool, float | str]:
+        return await self._read(db.get_balance_at, day)
+
+    async def get_balance_series(self, start: date, end: date) -> tuple[bool, list | str]:
+        return await self._read(db.get_balance_series, start, end)
+
+    async def rebuild_daily_balance(self) -> bool:
+        return await self._write(db.rebuild_daily_balance)
+
+    # EXPENSES ____________________________________________________
+
+    async def get_expenses(self) -> tuple[bool, list | str]:
+        return await self._read(db.get_expenses)
+
+    async def iter_expenses(self, limit: int | None = None, after_id: int | None = None, before_date: date | None = None,
+                            order: str = "asc", where: Filter | None = None,
+                            chunk_size: int = FETCH_CHUNK_SIZE) -> tuple[bool, AsyncIterator[tuple] | str]:
+        return await self._iter_rows(db.iter_expenses, (limit, after_id, before_date, order, where), chunk_size)
+
+    async def iter_expense_records(self, limit: int | None = None, after_id: int | None = None, before_date: date | None = None,
+                                   order: str = "asc", where: Filter | None = None,
+                                   chunk_size: int = FETCH_CHUNK_SIZE) -> tuple[bool, AsyncIterator[Expense] | str]:
+        return await self._iter_rows(db.iter_expense_records, (limit, after_id, before_date, order, where), chunk_size)
+
+    async def add_expense(self, expense: Expense) -> bool:
+        return await self._write(db.add_expense, expense)
+
+    async def edit_expense(self, id: int, new_date = None, new_description = None, new_category = None, new_amount = None) -> bool:
+        return await self._write(db.edit_expense, id, new_date, new_description, new_category, new_amount)
+
+    async def del_expense(self, id: int) -> bool:
+        return await self._write(db.del_expense, id)
+
+    async def edit_expenses(self, ids: Iterable[int] | None = None, where: Filter | None = None, new_date = None, new_description = None,
+                          new_category = None, new_amount = None) -> tuple[bool, int | str]:
+        return await self._write(db.edit_expenses, ids, where, new_date, new_description, new_category, new_amount)
+
+    async def del_expenses(self, ids: Iterable[int] | None = None, where: Filter | None = None) -> tuple[bool, int | str]:
+        return await self._write(db.del_expenses, ids, where)
+
+    async def import_expenses(self, expenses: Iterable[Expense], batch_size: int = IMPORT_BATCH_SIZE) -> tuple[bool, int | str]:
+        return await self._write(db.import_expenses, expenses, batch_size = batch_size)
+
+    # INCOMES _____________________________________________________
+
+    async def get_incomes(self) -> tuple[bool, list | str]:
+        return await self._read(db.get_incomes)
+
+    async def iter_incomes(self, limit: int | None = None, after_id: int | None = None, before_date: date | None = None,
+                           order: str = "asc", where: Filter | None = None,
+                           chunk_size: int = FETCH_CHUNK_SIZE) -> tuple[bool, AsyncIterator[tuple] | str]:
+        return await self._iter_rows(db.iter_incomes, (limit, after_id, before_date, order, where), chunk_size)
+
+    async def iter_income_records(self, limit: int | None = None, after_id: int | None = None, before_date: date | None = None,
+                                  order: str = "asc", where: Filter | None = None,
+                                  chunk_size: int = FETCH_CHUNK_SIZE) -> tuple[bool, AsyncIterator[Income] | str]:
+        return await self._iter_rows(db.iter_income_records, (limit, after_id, before_date, order, where), chunk_size)
+
+    async def add_income(self, income: Income) -> bool:
+        return await self._write(db.add_income, income)
+
+    async def edit_income(self, id: int, new_date = None, new_description = None, new_category = None, new_amount = None) -> bool:
+        return await self._write(db.edit_income, id, new_date, new_description, new_category, new_amount)
+
+    async def del_income(self, id: int) -> bool:
+        return await self._write(db.del_income, id)
+
+    async def edit_incomes(self, ids: Iterable[int] | None = None, where: Filter | None = None, new_date = None, new_description = None,
+                          new_category = None, new_amount = None) -> tuple[bool, int | str]:
+        return await self._write(db.edit_incomes, ids, where, new_date, new_description, new_category, new_amount)
+
+    async def del_incomes(self, ids: Iterable[int] | None = None, where: Filter | None = None) -> tuple[bool, int | str]:
+        return await self._write(db.del_incomes, ids, where)
+
+    async def import_incomes(self, incomes: Iterable[Income], batch_size: int = IMPORT_BATCH_SIZE) -> tuple[bool, int | str]:
+        return await self._write(db.import_incomes, incomes, batch_size = batch_size)
+
+    # SUMMARY _____________________________________________________
+
+    async def get_monthly_totals(self, kind: str | None = None, start_month: str | None = None,
+                                 end_month: str | None = None) -> tuple[bool, list | str]:
+        return await self._read(db.get_monthly_totals, kind, start_month, end_month)
+
+    async def rebuild_monthly_totals(self) -> bool:
+        return await self._write(db.rebuild_monthly_totals)
+
+    # SEARCH ______________________________________________________
+
+    async def search(self, match: str, kind: str | None = None, limit: int = SEARCH_DEFAULT_LIMIT,
+                     offset: int = 0) -> tuple[bool, list[Expense | Income] | str]:
+        return await self._read(db.search, match, kind, limit, offset)
+
+    # LISTINGS ____________________________________________________
+
+    async def _iter_rows(self, iter_function, args: tuple, chunk_size: int) -> tuple[bool, AsyncIterator[tuple] | str]:
+        """Runs the listing query in a reader thread and returns an async iterator that fetches the rows chunk by chunk.
+
+        Each listing gets its own session so a slow consumer never holds one of the pooled readers.
+        """
+
+        success, rows, session = await asyncio.get_running_loop().run_in_executor(
+            self._reader_executor, _open_rows, iter_function, args, self.db_path, chunk_size)
+
+        if not success:
+            return False, rows
+        return True, self._stream_rows(rows, session, chunk_size)
+
+    async def _stream_rows(self, rows: Iterator[tuple], session: Session, chunk_size: int) -> AsyncIterator[tuple]:
+        loop = asyncio.get_running_loop()
+        try:
+            while chunk := await loop.run_in_executor(self._reader_executor, _take, rows, chunk_size):
+                for row in chunk:
+                    yield row
+        finally:
+            await loop.run_in_executor(self._reader_executor, _close_rows, rows, session)
+
+def _open_rows(iter_function, args: tuple, db_path: str, chunk_size: int) -> tuple[bool, Iterator[tuple] | str, Session | None]:
+    try:
+        session = Session(db_path)
+    except sqlite3.Error as e:
+        return False, "Database error", None
+
+    success, rows = iter_function(*args, db_path = session, chunk_size = chunk_size)
+    if not success:
+        session.close()
+        return False, rows, None
+    return True, rows, session
+
+def _take(rows: Iterator[tuple], count: int) -> list[tuple]:
+    return list(islice(rows, count))
+
+def _close_rows(rows: Iterator[tuple], session: Session):
+    rows.close()
+    session.close()
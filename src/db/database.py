@@ -1,13 +1,475 @@
+import heapq
+import inspect
+import json
+import os
+import queue
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing, contextmanager, nullcontext
 from datetime import date
+from functools import lru_cache, wraps
+from itertools import islice
+from operator import attrgetter, itemgetter
 from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
 
+from db import tracing
+from db.encoding import from_cents, from_day, to_cents, to_day
+from db.filters import Filter
+from db.migrations import get_user_version, is_v1_format, migrate_v1_to_v2, run_migrations, split_script
+from internal_libs.category import ExpCategory, IncCategory
 from internal_libs.expense import Expense
 from internal_libs.income import Income
 
 SCHEMA_PATH = Path(__file__).parent / "schema.sql"
 DB_DEFAULT_PATH = "finances.db"
 
+STATEMENT_CACHE_SIZE = 128 # max number of prepared statements kept per session connection
+POOL_DEFAULT_SIZE = 4
+REPORT_CACHE_SIZE = 256 # report results kept in memory, see ReportCache
+IMPORT_BATCH_SIZE = 5000 # rows sent to executemany at once during bulk imports
+FETCH_CHUNK_SIZE = 500 # rows pulled from the cursor at once when streaming listings
+
+# PROFILES ________________________________________________________
+
+PROFILE_ENV_VAR = "FINANCES_DB_PROFILE"
+DEFAULT_PROFILE = "balanced"
+
+# PRAGMAs applied to every connection this module opens. All profiles use WAL, so readers never block
+# the writer and switching profiles between runs is free (the journal mode is stored in the db file).
+#   durable:   every commit is synced to disk, nothing is lost even on power loss.
+#   balanced:  the WAL is only synced at checkpoints, a power loss can lose the last commits
+#              but never corrupts the db. An application crash loses nothing.
+#   bulk-load: never syncs and uses large caches, for big imports. A power loss can corrupt the db.
+PROFILES = {
+    "durable": {"journal_mode": "WAL", "synchronous": "FULL", "cache_size": -2000, "mmap_size": 0, "temp_store": "DEFAULT"},
+    "balanced": {"journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -16000, "mmap_size": 64 * 2**20, "temp_store": "MEMORY"},
+    "bulk-load": {"journal_mode": "WAL", "synchronous": "OFF", "cache_size": -128000, "mmap_size": 256 * 2**20, "temp_store": "MEMORY"},
+}
+
+_profile_statements = {name: [f"PRAGMA {pragma} = {value}" for pragma, value in pragmas.items()]
+                       for name, pragmas in PROFILES.items()}
+_profile = DEFAULT_PROFILE
+
+def set_profile(name: str) -> bool:
+    """Selects the profile used by the connections opened from now on, returns False if it does not exist."""
+
+    global _profile
+    if name not in PROFILES:
+        return False
+    _profile = name
+    return True
+
+def get_profile() -> str:
+    return _profile
+
+# READ-ONLY MODE __________________________________________________
+
+READ_ONLY_ENV_VAR = "FINANCES_DB_READ_ONLY"
+READ_ONLY_MMAP_SIZE = 2**30 # bytes of the file read straight from the OS page cache instead of copied into SQLite's
+
+class ReadOnly(NamedTuple):
+    """Db path that opens the file read-only, can be passed to the read functions instead of a path.
+
+    Connections go through a file: URI with mode=ro: they never create the file, take a write lock
+    or change its journal mode, so reporting processes can read next to a writer (WAL). Pages are
+    read through a memory map of up to mmap_size bytes. immutable=True also skips all locking and
+    change detection, only for files nothing writes to anymore: it does not see a WAL that was not
+    checkpointed yet.
+    """
+
+    path: str = DB_DEFAULT_PATH
+    immutable: bool = False
+    mmap_size: int = READ_ONLY_MMAP_SIZE
+
+    def uri(self) -> str:
+        options = "mode=ro&immutable=1" if self.immutable else "mode=ro"
+        return f"{Path(self.path).resolve().as_uri()}?{options}"
+
+def _read_only_statements(db_path: ReadOnly) -> list[str]:
+    # only PRAGMAs that do not write to the file, unlike journal_mode
+    return [f"PRAGMA mmap_size = {db_path.mmap_size}", "PRAGMA temp_store = MEMORY", "PRAGMA query_only = ON"]
+
+def _new_connection(db_path: str | ReadOnly, **kwargs) -> sqlite3.Connection:
+    """Connection to db_path configured by the current profile, or for reading only."""
+
+    if isinstance(db_path, ReadOnly):
+        connection = sqlite3.connect(db_path.uri(), uri = True, **kwargs)
+        statements = _read_only_statements(db_path)
+    else:
+        connection = sqlite3.connect(db_path, **kwargs)
+        statements = _profile_statements[_profile]
+
+    try:
+        for statement in statements:
+            connection.execute(statement)
+    except BaseException:
+        connection.close()
+        raise
+    return connection
+
+# SESSIONS ________________________________________________________
+
+class Session:
+    """Long lived connection that can be passed to any db function instead of a db path.
+
+    Statements are prepared once and reused through the sqlite3 statement cache,
+    so repeated calls skip both the connect and the parse cost.
+    """
+
+    def __init__(self, db_path: str | ReadOnly = DB_DEFAULT_PATH, cached_statements: int = STATEMENT_CACHE_SIZE):
+        self.db_path = db_path
+        # sessions opened on a path that use_read_only routes are read-only as well
+        routed = _default_sessions.get(db_path) if isinstance(db_path, str) else None
+        self.connection = _new_connection(routed if isinstance(routed, ReadOnly) else db_path,
+                                          cached_statements = cached_statements, check_same_thread = False)
+        self.lock = threading.RLock() # a connection must only be used by one thread at a time
+        self.grouped = False
+
+    def begin_group(self):
+        """Starts running the calls made with this session in one transaction, until end_group.
+
+        Each call gets its own savepoint, so a failing call only undoes its own changes.
+        """
+
+        with self.lock:
+            self.connection.commit()
+            self.connection.execute("BEGIN")
+            self.grouped = True
+
+    def end_group(self, commit: bool = True):
+        with self.lock:
+            self.grouped = False
+            if commit:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+
+    @contextmanager
+    def group(self):
+        """Commits the calls made inside the block together, or none of them if the block raises."""
+
+        self.begin_group()
+        try:
+            yield self
+        except BaseException:
+            self.end_group(commit = False)
+            raise
+        self.end_group()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SessionPool:
+    """Small pool of sessions for multi-threaded callers, each thread borrows its own connection."""
+
+    def __init__(self, db_path: str = DB_DEFAULT_PATH, size: int = POOL_DEFAULT_SIZE, cached_statements: int = STATEMENT_CACHE_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self):
+        session = self._acquire()
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+    def _acquire(self) -> Session:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        # open a new connection if the pool is not full yet, otherwise wait for one to be released
+        with self._lock:
+            if self._created < self.size:
+                session = Session(self.db_path, self.cached_statements)
+                self._created += 1
+                return session
+        return self._idle.get()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class _GroupedConnection:
+    """Connection handed out while a session groups calls, their commits wait for the end of the group."""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    def commit(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+_default_sessions: dict[str, Session | ReadOnly] = {}
+
+@contextmanager
+def use_session(session: Session):
+    """Routes the calls made with session.db_path (e.g. the default path the CLI uses) through session."""
+
+    previous = _default_sessions.get(session.db_path)
+    _default_sessions[session.db_path] = session
+    try:
+        yield session
+    finally:
+        _restore_route(session.db_path, previous)
+
+@contextmanager
+def use_read_only(db_path: str = DB_DEFAULT_PATH, immutable: bool = False):
+    """Opens db_path (e.g. the default path the CLI uses) read-only for the calls made with it, see ReadOnly."""
+
+    previous = _default_sessions.get(db_path)
+    _default_sessions[db_path] = ReadOnly(db_path, immutable)
+    try:
+        yield _default_sessions[db_path]
+    finally:
+        _restore_route(db_path, previous)
+
+def _restore_route(db_path: str, previous: Session | ReadOnly | None):
+    if previous is None:
+        del _default_sessions[db_path]
+    else:
+        _default_sessions[db_path] = previous
+
+def _open_connection(db_path: str | ReadOnly, **kwargs) -> sqlite3.Connection:
+    """New connection with the profile applied, timed as db.connect while tracing."""
+
+    with tracing.span("db.connect"):
+        connection = _new_connection(db_path, **kwargs)
+
+    if tracing.tracer.enabled:
+        tracing.attach(connection)
+    return connection
+
+@contextmanager
+def _count_rows(connection: sqlite3.Connection):
+    tracing.attach(connection)
+    changes = connection.total_changes
+    try:
+        yield tracing.count_reads(connection)
+    finally:
+        tracing.tracer.add_rows_written(connection.total_changes - changes)
+
+def _traced(connection: sqlite3.Connection):
+    """Yields connection, adding the statements, rows written and rows fetched through it to the traced operation."""
+
+    return _count_rows(connection) if tracing.tracer.enabled else nullcontext(connection)
+
+@contextmanager
+def _connect(db_path: str | Session):
+    """Yields a connection for db_path. Sessions are reused and rolled back on error, paths get a fresh connection."""
+
+    db_path = _default_sessions.get(db_path, db_path)
+
+    if isinstance(db_path, Session) and db_path.grouped:
+        with db_path.lock:
+            connection = db_path.connection
+            connection.execute("SAVEPOINT call")
+            try:
+                with _traced(connection) as traced:
+                    yield _GroupedConnection(traced)
+            except BaseException:
+                connection.execute("ROLLBACK TO call")
+                connection.execute("RELEASE call")
+                raise
+            connection.execute("RELEASE call")
+        return
+
+    if isinstance(db_path, Session):
+        with db_path.lock:
+            try:
+                with _traced(db_path.connection) as traced:
+                    yield traced
+            except BaseException:
+                db_path.connection.rollback()
+                raise
+        return
+
+    connection = _open_connection(db_path)
+    try:
+        with _traced(connection) as traced:
+            yield traced
+    finally:
+        connection.close()
+
+@contextmanager
+def _read_transaction(connection: sqlite3.Connection):
+    """Runs the reads inside the block on one snapshot of the db, a connection already in a transaction keeps its own."""
+
+    if connection.in_transaction:
+        yield
+        return
+
+    connection.execute("BEGIN")
+    try:
+        yield
+    finally:
+        connection.commit() # nothing was written, this only ends the read transaction
+
+# REPORT CACHE ____________________________________________________
+
+DB_WRITE_VERSION_COMMAND = """
+    SELECT db_id, value FROM write_counter WHERE id = 1
+"""
+
+DB_BUMP_WRITE_COUNTER_COMMAND = """
+    UPDATE write_counter SET value = value + 1 WHERE id = 1
+"""
+
+class ReportCache:
+    """LRU cache of report results keyed by (function, db file, arguments).
+
+    Every entry remembers the write counter of the db it was computed from (see schema.sql) and is
+    only returned while the counter is unchanged, so writes made by any connection or process
+    invalidate it without the cache ever being told.
+    """
+
+    def __init__(self, size: int = REPORT_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (version, result)
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, version: tuple) -> tuple | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, version: tuple, result: tuple):
+        with self._lock:
+            if self.size <= 0:
+                return
+            self._entries[key] = (version, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last = False)
+
+    def resize(self, size: int):
+        with self._lock:
+            self.size = size
+            while len(self._entries) > max(size, 0):
+                self._entries.popitem(last = False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "size": self.size}
+
+report_cache = ReportCache()
+
+def _write_version(db_path: str | Session) -> tuple | None:
+    """(db id, write counter) of the db, None when its results can not be cached right now."""
+
+    with _connect(db_path) as connection:
+        # results that include uncommitted writes (a grouped session) could outlive a rollback
+        if connection.in_transaction:
+            return None
+        return connection.execute(DB_WRITE_VERSION_COMMAND).fetchone()
+
+def _cache_file(db_path: str | Session) -> str:
+    db_path = _default_sessions.get(db_path, db_path)
+    if isinstance(db_path, Session):
+        db_path = db_path.db_path
+    if isinstance(db_path, ReadOnly): # same file, same results
+        db_path = db_path.path
+    return os.path.abspath(os.fspath(db_path))
+
+def cached_report(function):
+    """Serves the (True, result) returns of a read function taking a db_path argument from report_cache.
+
+    A hit costs one read of the write counter, failed calls are never cached. Cached results are
+    shared between callers, they must not be modified.
+    """
+
+    signature = inspect.signature(function)
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if report_cache.size <= 0:
+            return function(*args, **kwargs)
+
+        try:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            db_path = arguments.pop("db_path")
+            if db_path == ":memory:":
+                return function(*args, **kwargs)
+
+            key = (function.__qualname__, _cache_file(db_path), tuple(arguments.items()))
+            hash(key)
+            version = _write_version(db_path)
+        except Exception as e: # unhashable arguments or a db that can not be read, the call reports its own errors
+            return function(*args, **kwargs)
+
+        if version is None:
+            return function(*args, **kwargs)
+
+        result = report_cache.get(key, version)
+        if result is None:
+            result = function(*args, **kwargs)
+            if result[0] is True:
+                report_cache.put(key, version, result)
+        return result
+
+    return wrapper
+
+def cache_stats() -> dict:
+    """Hits, misses, entries and size of the report cache."""
+
+    return report_cache.stats()
+
+def set_cache_size(size: int):
+    """Number of report results kept in memory, 0 turns the cache off."""
+
+    report_cache.resize(size)
+
+def clear_cache():
+    report_cache.clear()
+
+def _category_key(category: ExpCategory | IncCategory | str) -> str:
+    """Categories are stored by enum name (as add_expense/add_income do) so the category indexes can be used."""
+
+    return category.name if isinstance(category, (ExpCategory, IncCategory)) else category
+
+# BALANCE DB LOGIC ________________________________________________
+
 DB_GET_BALANCE_COMMAND = """
     SELECT * FROM balance
 """
@@ -16,22 +478,102 @@ DB_SET_BALANCE_COMMAND = """
     UPDATE balance SET curr_balance = ? WHERE id = 1
 """
 
-def init_db(db_path: str = DB_DEFAULT_PATH) -> bool:
-    try:
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
+DB_DERIVED_TABLE_MISSING_COMMAND = """
+    SELECT NOT EXISTS (SELECT 1 FROM {table})
+           AND (EXISTS (SELECT 1 FROM expenses) OR EXISTS (SELECT 1 FROM incomes))
+"""
 
-        with open(SCHEMA_PATH) as inf:
-            schema = inf.read()
-        cursor.executescript(schema)
+def _read_schema() -> str:
+    with open(SCHEMA_PATH) as inf:
+        return inf.read()
 
-        # check if balance already exists, if not initialize it to 0
-        cursor.execute("SELECT COUNT(*) FROM balance")
-        if cursor.fetchone()[0] == 0:
-            cursor.execute("INSERT INTO balance (id, curr_balance) VALUES (1, 0)")
+def _apply_schema(connection: sqlite3.Connection):
+    """Brings an unversioned db (new, storage format v1 or created by an older release) to the current schema."""
 
-        connection.commit()
-        connection.close()
+    cursor = connection.cursor()
+    schema = _read_schema()
+
+    # files written with storage format v1 are converted before the v2 schema is applied
+    if is_v1_format(connection):
+        migrate_v1_to_v2(connection, schema, _rebuild_derived_tables)
+
+    cursor.executescript(schema)
+
+    # check if balance already exists, if not initialize it to 0
+    cursor.execute("SELECT COUNT(*) FROM balance")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("INSERT INTO balance (id, curr_balance) VALUES (1, 0)")
+
+    # dbs created before a derived table existed have rows that were never added to it
+    for table, rebuild in (("monthly_totals", _rebuild_monthly_totals), ("daily_balance", _rebuild_daily_balance)):
+        cursor.execute(DB_DERIVED_TABLE_MISSING_COMMAND.format(table = table))
+        if cursor.fetchone()[0]:
+            rebuild(cursor)
+
+DB_REBUILD_SEARCH_COMMAND = """
+    INSERT INTO descriptions_search (descriptions_search) VALUES ('rebuild')
+"""
+
+def _add_description_search(connection: sqlite3.Connection):
+    """Version 2: full text search over the descriptions, indexed from the ones already stored."""
+
+    connection.executescript(_read_schema())
+    connection.execute(DB_REBUILD_SEARCH_COMMAND)
+
+def _add_write_counter(connection: sqlite3.Connection):
+    """Version 3: write counter behind the report cache."""
+
+    connection.executescript(_read_schema())
+
+# delete triggers that skip the entries archive moves, recreated by version 4
+ARCHIVE_GUARDED_TRIGGERS = tuple(f"{table}_{name}_delete" for table in ("expenses", "incomes") for name in ("rollup", "balance", "daily"))
+
+def _recreate_triggers(connection: sqlite3.Connection, triggers: tuple[str, ...]):
+    """Drops triggers and creates them again from schema.sql.
+
+    Runs in a transaction of its own that run_migrations commits together with the new user_version,
+    so no connection ever writes while the triggers are missing and a crash leaves the old ones.
+    """
+
+    connection.execute("BEGIN IMMEDIATE")
+    for trigger in triggers:
+        connection.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    for statement in split_script(_read_schema()):
+        connection.execute(statement)
+
+def _add_archives(connection: sqlite3.Connection):
+    """Version 4: yearly archive shards."""
+
+    _recreate_triggers(connection, ARCHIVE_GUARDED_TRIGGERS)
+
+# update and delete triggers that skip the rows of bulk edits and deletes, recreated by version 5
+BULK_GUARDED_TRIGGERS = tuple(f"{table}_{name}_{event}" for table in ("expenses", "incomes")
+                              for name in ("rollup", "balance", "daily") for event in ("update", "delete"))
+
+def _add_bulk_writes(connection: sqlite3.Connection):
+    """Version 5: set-based bulk edits and deletes."""
+
+    _recreate_triggers(connection, BULK_GUARDED_TRIGGERS)
+
+# (user_version, migration) pairs in order. To change the schema, update schema.sql and append a pair
+# that upgrades existing dbs. New dbs run every migration too, after _apply_schema already created the
+# latest schema, so later migrations have to be no-ops on a db that is already up to date.
+SCHEMA_MIGRATIONS = (
+    (1, _apply_schema),
+    (2, _add_description_search),
+    (3, _add_write_counter),
+    (4, _add_archives),
+    (5, _add_bulk_writes),
+)
+
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+def init_db(db_path: str | Session = DB_DEFAULT_PATH) -> bool:
+    try:
+        with _connect(db_path) as connection:
+            # a db that is already current only costs this read of the file header
+            if get_user_version(connection) != SCHEMA_VERSION:
+                run_migrations(connection, SCHEMA_MIGRATIONS)
 
         return True
     
@@ -41,14 +583,13 @@ def init_db(db_path: str = DB_DEFAULT_PATH) -> bool:
     except Exception as e:
         return False
 
-def get_balance(db_path: str = DB_DEFAULT_PATH) -> tuple[bool, float | str]:
+def get_balance(db_path: str | Session = DB_DEFAULT_PATH) -> tuple[bool, float | str]:
     try:
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
+        with _connect(db_path) as connection:
+            cursor = connection.cursor()
 
-        cursor.execute(DB_GET_BALANCE_COMMAND)
-        balance = cursor.fetchone()[1] # index 0 is id, index 1 is balance
-        connection.close()
+            cursor.execute(DB_GET_BALANCE_COMMAND)
+            balance = from_cents(cursor.fetchone()[1]) # index 0 is id, index 1 is balance
         
         return True, balance
     
@@ -58,46 +599,543 @@ def get_balance(db_path: str = DB_DEFAULT_PATH) -> tuple[bool, float | str]:
     except Exception as e:
         return False, "Unexpected error"
 
-def set_balance(balance: int, db_path: str = DB_DEFAULT_PATH) -> bool:
+def set_balance(balance: int, db_path: str | Session = DB_DEFAULT_PATH) -> bool:
     try:
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
+        with _connect(db_path) as connection:
+            cursor = connection.cursor()
 
-        cursor.execute(DB_SET_BALANCE_COMMAND, (balance,))
-        connection.commit()
-        connection.close()
+            cursor.execute(DB_SET_BALANCE_COMMAND, (to_cents(balance),))
+            connection.commit()
 
         return cursor.rowcount == 1
     
     except sqlite3.Error as e:
-        return False
-    
+        return False
+    
+    except Exception as e:
+        return False
+
+DB_INSERT_DESCRIPTION_COMMAND = """
+    INSERT INTO descriptions (text) VALUES (?) ON CONFLICT (text) DO NOTHING
+"""
+
+DB_INDEX_NEW_DESCRIPTIONS_COMMAND = """
+    INSERT INTO descriptions_search (rowid, text) SELECT id, text FROM descriptions WHERE id > ?
+"""
+
+def _record_values(record: Expense | Income) -> tuple:
+    """Values of a record in storage format v2, in the column order of the insert commands."""
+
+    return (to_day(record.date), record.description, record.category.name, to_cents(record.amount))
+
+def _select_columns(table: str) -> str:
+    """Select list that turns a v2 row back into (id, YYYY-MM-DD, description, category, amount)."""
+
+    return f"""id, date(day * 86400, 'unixepoch'),
+               (SELECT text FROM descriptions WHERE descriptions.id = {table}.description_id),
+               category, cents / 100.0"""
+
+def _record_columns(table: str) -> str:
+    """Select list of the raw (id, day, description, category, cents) columns, decoded by the row factories below."""
+
+    return f"""id, day,
+               (SELECT text FROM descriptions WHERE descriptions.id = {table}.description_id),
+               category, cents"""
+
+# category names as stored (and the values, as written by older releases) -> enum, unknown ones read as OTHER
+_EXPENSE_CATEGORIES = {key: category for category in ExpCategory for key in (category.value, category.name)}
+_INCOME_CATEGORIES = {key: category for category in IncCategory for key in (category.value, category.name)}
+
+_cached_from_day = lru_cache(maxsize = 4096)(from_day) # listings repeat the same days a lot
+
+def expense_row_factory(cursor: sqlite3.Cursor, row: tuple) -> Expense:
+    """sqlite3 row factory that turns _record_columns("expenses") rows into Expense records."""
+
+    return Expense(row[4] / 100, _cached_from_day(row[1]), row[2], _EXPENSE_CATEGORIES.get(row[3], ExpCategory.OTHER), row[0])
+
+def income_row_factory(cursor: sqlite3.Cursor, row: tuple) -> Income:
+    """sqlite3 row factory that turns _record_columns("incomes") rows into Income records."""
+
+    return Income(row[4] / 100, _cached_from_day(row[1]), row[2], _INCOME_CATEGORIES.get(row[3], IncCategory.OTHER), row[0])
+
+# insert triggers an import drops for the length of its transaction, as any row trigger slows every
+# insert down (even one with nothing to do). The import adds each batch to the balance and rollups in
+# one statement instead.
+IMPORT_SUSPENDED_TRIGGERS = ("rollup", "balance", "daily")
+
+DB_GET_TRIGGERS_COMMAND = """
+    SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN ({names})
+"""
+
+DB_ADD_BATCH_TO_BALANCE_COMMAND = """
+    UPDATE balance SET curr_balance = curr_balance {sign} (SELECT IFNULL(SUM(cents), 0) FROM {table} WHERE id > ?) WHERE id = 1
+"""
+
+DB_ADD_BATCH_TO_ROLLUP_COMMAND = """
+    INSERT INTO monthly_totals (kind, month, category, total, count)
+    SELECT '{kind}', strftime('%Y-%m', day * 86400, 'unixepoch'), COALESCE(category, ''), SUM(cents), COUNT(*)
+    FROM {table} WHERE id > ? GROUP BY 2, 3
+    ON CONFLICT (kind, month, category) DO UPDATE SET total = total + excluded.total, count = count + excluded.count
+"""
+
+def _suspend_insert_triggers(cursor: sqlite3.Cursor, table: str) -> list[str]:
+    """Drops the insert triggers of table inside the current transaction, returns the statements that recreate them."""
+
+    names = [f"{table}_{name}_insert" for name in IMPORT_SUSPENDED_TRIGGERS]
+    triggers = cursor.execute(DB_GET_TRIGGERS_COMMAND.format(names = ", ".join("?" * len(names))), names).fetchall()
+    for name, _ in triggers:
+        cursor.execute(f"DROP TRIGGER {name}")
+    return [sql for _, sql in triggers]
+
+def _add_imported_batch(cursor: sqlite3.Cursor, table: str, last_id: int):
+    """Adds the rows of table with an id above last_id to the balance (one SUM) and the rollups (one GROUP BY)."""
+
+    cursor.execute(DB_ADD_BATCH_TO_BALANCE_COMMAND.format(sign = "-" if table == "expenses" else "+", table = table), (last_id,))
+    cursor.execute(DB_ADD_BATCH_TO_ROLLUP_COMMAND.format(kind = "exp" if table == "expenses" else "inc", table = table), (last_id,))
+
+def _import_records(records: Iterable[Expense | Income], table: str, insert_command: str, db_path: str | Session,
+                    batch_size: int) -> tuple[bool, int | str]:
+    """Streams records into the db in batches of batch_size, all inside a single transaction.
+
+    The iterable is consumed lazily so memory stays bounded by the batch size. If it raises
+    ValueError (an invalid row) nothing is written and the error message is returned.
+    """
+
+    records = iter(records)
+    imported = 0
+
+    try:
+        with _connect(db_path) as connection:
+            cursor = connection.cursor()
+
+            # the daily running totals are refreshed once for the whole import instead of once per row. The
+            # triggers are recreated before the commit, other connections never see the db without them.
+            cursor.execute(DB_DEFER_DAILY_BALANCE_COMMAND)
+            triggers = _suspend_insert_triggers(cursor, table)
+            last_id = cursor.execute(f"SELECT IFNULL(MAX(id), 0) FROM {table}").fetchone()[0]
+            last_description_id = cursor.execute("SELECT IFNULL(MAX(id), 0) FROM descriptions").fetchone()[0]
+
+            while batch := list(islice(records, batch_size)):
+                batch_last_id = cursor.execute(f"SELECT IFNULL(MAX(id), 0) FROM {table}").fetchone()[0]
+                cursor.executemany(DB_INSERT_DESCRIPTION_COMMAND, [(description,) for description in {record.description for record in batch}])
+                cursor.executemany(insert_command, [_record_values(record) for record in batch])
+                _add_imported_batch(cursor, table, batch_last_id)
+                imported += len(batch)
+
+            _add_to_daily_balance(cursor, table, last_id)
+            cursor.execute(DB_INDEX_NEW_DESCRIPTIONS_COMMAND, (last_description_id,))
+            cursor.execute(DB_RESUME_DAILY_BALANCE_COMMAND)
+            for trigger in triggers:
+                cursor.execute(trigger)
+            connection.commit()
+
+        return True, imported
+
+    except sqlite3.Error as e:
+        return False, "Database error"
+
+    except ValueError as e:
+        return False, str(e)
+
+    except Exception as e:
+        return False, "Unexpected error"
+
+LIST_ORDERS = {"asc": "ASC", "desc": "DESC"}
+
+def _build_list_query(table: str, limit: int | None, after_id: int | None, before_date: date | None, order: str,
+                      where: Filter | None, columns: str) -> tuple[str, list]:
+    """Builds a keyset paginated SELECT. Only fixed SQL fragments are joined, every value is a parameter."""
+
+    conditions = []
+    params = []
+
+    if after_id is not None:
+        # "after" follows the listing order, so a descending listing continues with smaller ids
+        conditions.append("id > ?" if order == "asc" else "id < ?")
+        params.append(after_id)
+    if before_date is not None:
+        conditions.append("day < ?")
+        params.append(to_day(before_date))
+    if where is not None:
+        conditions.append(where.sql)
+        params.extend(where.params)
+
+    query = f"SELECT {columns} FROM {table}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += f" ORDER BY id {LIST_ORDERS[order]}"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    return query, params
+
+def _stream_chunks(cursor: sqlite3.Cursor, lock, connection: sqlite3.Connection | None, chunk_size: int) -> Iterator[list]:
+    """Yields the cursor rows fetchmany chunk by chunk, closing the connection (if owned) once done."""
+
+    try:
+        while True:
+            with lock:
+                rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+        if connection is not None:
+            connection.close()
+
+def _stream_rows(cursor: sqlite3.Cursor, lock, connection: sqlite3.Connection | None, chunk_size: int) -> Iterator[tuple]:
+    for rows in _stream_chunks(cursor, lock, connection, chunk_size):
+        yield from rows
+
+def _counted(cursor: sqlite3.Cursor) -> sqlite3.Cursor:
+    # the rows are fetched later, while the stream is read, and counted for the operation that returned it
+    return tracing.count_reads(cursor) if tracing.tracer.enabled else cursor
+
+def _execute_streamed(query: str, params: list, db_path: str | Session, row_factory = None) -> tuple[sqlite3.Cursor, object, sqlite3.Connection | None]:
+    """Executes query for a lazy reader, returns the cursor with the lock to hold and the connection to close while reading it."""
+
+    db_path = _default_sessions.get(db_path, db_path)
+
+    if isinstance(db_path, Session):
+        with db_path.lock:
+            if tracing.tracer.enabled:
+                tracing.attach(db_path.connection)
+            cursor = _counted(db_path.connection.cursor())
+            cursor.row_factory = row_factory
+            cursor.execute(query, params)
+        return cursor, db_path.lock, None
+
+    # a stream is read one chunk at a time, not always by the thread that opened it (AsyncDatabase readers)
+    connection = _open_connection(db_path, check_same_thread = False)
+    try:
+        cursor = _counted(connection.cursor())
+        cursor.row_factory = row_factory
+        cursor.execute(query, params)
+    except BaseException:
+        connection.close()
+        raise
+    return cursor, nullcontext(), connection
+
+DB_ARCHIVE_FILES_COMMAND = """
+    SELECT file FROM archives WHERE year BETWEEN ? AND ? ORDER BY year
+"""
+
+def _main_file(connection: sqlite3.Connection) -> str:
+    """Path of the file of the main db of connection, empty for an in-memory db."""
+
+    return next(row[2] for row in connection.execute("PRAGMA database_list") if row[1] == "main")
+
+def _archive_files(connection: sqlite3.Connection, first_day: int | None, last_day: int | None) -> list[str]:
+    """Paths of the archive shards with entries dated between first_day and last_day (inclusive, None for no bound)."""
+
+    first_year = from_day(first_day).year if first_day is not None else date.min.year
+    last_year = from_day(last_day).year if last_day is not None else date.max.year
+    files = connection.execute(DB_ARCHIVE_FILES_COMMAND, (first_year, last_year)).fetchall()
+    if not files:
+        return []
+
+    directory = os.path.dirname(_main_file(connection))
+    return [os.path.join(directory, file) for (file,) in files]
+
+def _execute_archived(query: str, params: list, db_path: str | Session, first_day: int | None, last_day: int | None,
+                      row_factory = None, where: Filter | None = None) -> list[tuple[sqlite3.Cursor, object, sqlite3.Connection | None]]:
+    """_execute_streamed over the db and over the archive shards of the entries between first_day and last_day.
+
+    Returns one (cursor, lock, connection) per source, the shards (oldest first) before the db. Shards
+    are only opened when the range (narrowed to the dates where can match) reaches them, read-only,
+    and have the same tables as the db.
+    """
+
+    if where is not None:
+        first_day, last_day = where.narrow(first_day, last_day)
+
+    main = _execute_streamed(query, params, db_path, row_factory)
+    sources = []
+
+    try:
+        with main[1]:
+            files = _archive_files(main[0].connection, first_day, last_day)
+        for file in files:
+            sources.append(_execute_streamed(query, params, ReadOnly(file), row_factory))
+    except BaseException:
+        for cursor, _, connection in sources + [main]:
+            cursor.close()
+            if connection is not None:
+                connection.close()
+        raise
+
+    return sources + [main]
+
+def _merge_rows(sources: list, chunk_size: int, key, reverse: bool = False, limit: int | None = None) -> Iterator:
+    """Rows of sources that are each sorted by key, merged lazily into one sorted stream of up to limit rows.
+
+    Closing the stream (or reaching the limit) closes the cursors and connections of every source.
+    """
+
+    streams = [_stream_rows(*source, chunk_size) for source in sources]
+    if len(streams) == 1: # the query already has the limit
+        return streams[0]
+    return _merged_streams(streams, key, reverse, limit)
+
+def _merged_streams(streams: list, key, reverse: bool, limit: int | None) -> Iterator:
+    try:
+        rows = heapq.merge(*streams, key = key, reverse = reverse)
+        yield from rows if limit is None else islice(rows, limit)
+    finally:
+        for stream in streams:
+            stream.close()
+
+def _chain_chunks(sources: list, chunk_size: int) -> Iterator[list]:
+    """Chunks of every source one after the other, closing the stream closes every source."""
+
+    return _chained_streams([_stream_chunks(*source, chunk_size) for source in sources])
+
+def _chained_streams(streams: list) -> Iterator:
+    try:
+        for stream in streams:
+            yield from stream
+    finally:
+        for stream in streams:
+            stream.close()
+
+def _iter_rows(table: str, limit: int | None, after_id: int | None, before_date: date | None, order: str,
+               where: Filter | None, db_path: str | Session, chunk_size: int, row_factory = None) -> tuple[bool, Iterator | str]:
+    """Runs the listing query right away (so errors are reported here) and returns a lazy iterator over its rows.
+
+    Without a row_factory the rows are (id, YYYY-MM-DD, description, category, amount) tuples.
+    """
+
+    try:
+        columns = _select_columns(table) if row_factory is None else _record_columns(table)
+        query, params = _build_list_query(table, limit, after_id, before_date, order, where, columns)
+        last_day = to_day(before_date) - 1 if before_date is not None else None
+        sources = _execute_archived(query, params, db_path, None, last_day, row_factory, where)
+
+        return True, _merge_rows(sources, chunk_size, itemgetter(0) if row_factory is None else attrgetter("id"), order == "desc", limit)
+
+    except sqlite3.Error as e:
+        return False, "Database error"
+
+    except Exception as e:
+        return False, "Unexpected error"
+
+# BULK EDIT DB LOGIC ______________________________________________
+
+def _edit_fields(new_date, new_description, new_category, new_amount) -> tuple[list[str], list]:
+    """SET assignments and their values for the given new values of an entry."""
+
+    fields = []
+    values = []
+
+    if new_date is not None:
+        fields.append("day = ?")
+        values.append(to_day(new_date))
+    if new_description is not None:
+        fields.append("description_id = (SELECT id FROM descriptions WHERE text = ?)")
+        values.append(new_description)
+    if new_category is not None:
+        fields.append("category = ?")
+        values.append(_category_key(new_category))
+    if new_amount is not None:
+        fields.append("cents = ?")
+        values.append(to_cents(new_amount))
+
+    return fields, values
+
+# the entries a bulk edit or delete works on, as they were before it
+DB_BULK_ROWS_COMMANDS = ("""
+    CREATE TEMP TABLE IF NOT EXISTS bulk_rows (
+        id INTEGER PRIMARY KEY,
+        day INTEGER NOT NULL,
+        category TEXT,
+        cents INTEGER NOT NULL
+    )
+""", """
+    DELETE FROM temp.bulk_rows
+""")
+
+DB_SELECT_BULK_ROWS_COMMAND = """
+    INSERT INTO temp.bulk_rows (id, day, category, cents)
+    SELECT id, day, category, cents FROM main.{table} WHERE {condition}
+"""
+
+# the whole id list is a single JSON array parameter, whatever its length
+BULK_IDS_CONDITION = "id IN (SELECT value FROM json_each(?))"
+
+BULK_OLD_ROWS = "temp.bulk_rows"
+BULK_NEW_ROWS = "(SELECT day, category, cents FROM main.{table} WHERE id IN (SELECT id FROM temp.bulk_rows))"
+
+DB_BULK_DELETE_COMMAND = """
+    DELETE FROM main.{table} WHERE id IN (SELECT id FROM temp.bulk_rows)
+"""
+
+DB_BULK_UPDATE_COMMAND = """
+    UPDATE main.{table} SET {fields} WHERE id IN (SELECT id FROM temp.bulk_rows)
+"""
+
+DB_START_BULK_WRITE_COMMAND = """
+    INSERT INTO bulk_writing (id) VALUES (1)
+"""
+
+DB_STOP_BULK_WRITE_COMMAND = """
+    DELETE FROM bulk_writing
+"""
+
+# add ({sign} '') or take back ({sign} '-') the entries of {rows} in one grouped statement per derived table
+DB_BULK_ROLLUP_COMMANDS = ("""
+    INSERT INTO monthly_totals (kind, month, category, total, count)
+    SELECT '{kind}', strftime('%Y-%m', day * 86400, 'unixepoch'), COALESCE(category, ''), {sign}SUM(cents), {sign}COUNT(*)
+    FROM {rows} GROUP BY 2, 3
+    ON CONFLICT (kind, month, category) DO UPDATE SET total = total + excluded.total, count = count + excluded.count
+""", """
+    DELETE FROM monthly_totals WHERE count = 0
+""")
+
+DB_BULK_DAILY_BALANCE_COMMAND = """
+    INSERT INTO daily_balance (day, net, cumulative)
+    SELECT day, {sign}SUM(cents), 0 FROM {rows} GROUP BY day
+    ON CONFLICT (day) DO UPDATE SET net = net + excluded.net
+"""
+
+DB_BULK_BALANCE_COMMAND = """
+    UPDATE balance SET curr_balance = curr_balance + (SELECT {sign}COALESCE(SUM(cents), 0) FROM {rows}) WHERE id = 1
+"""
+
+BULK_KINDS = {"expenses": "exp", "incomes": "inc"}
+
+def _apply_bulk_rows(cursor: sqlite3.Cursor, table: str, rows: str, added: bool, balance: bool, rollups: bool):
+    """Adds (or takes back) the entries of rows to the balance and running totals (if balance) and to the rollups."""
+
+    # an expense takes its amount from the balance, an income adds it
+    balance_sign = "-" if (table == "expenses") == added else ""
+
+    if balance:
+        cursor.execute(DB_BULK_BALANCE_COMMAND.format(sign = balance_sign, rows = rows))
+        cursor.execute(DB_BULK_DAILY_BALANCE_COMMAND.format(sign = balance_sign, rows = rows))
+    if rollups:
+        cursor.execute(DB_BULK_ROLLUP_COMMANDS[0].format(kind = BULK_KINDS[table], sign = "" if added else "-", rows = rows))
+        cursor.execute(DB_BULK_ROLLUP_COMMANDS[1])
+
+def _change_bulk_rows(cursor: sqlite3.Cursor, table: str, fields: list[str] | None, values: list | None,
+                      new_description: str | None, balance: bool, rollups: bool) -> int:
+    first_day = cursor.execute(f"SELECT MIN(day) FROM {BULK_OLD_ROWS}").fetchone()[0]
+
+    cursor.execute(DB_START_BULK_WRITE_COMMAND)
+    _apply_bulk_rows(cursor, table, BULK_OLD_ROWS, False, balance, rollups)
+
+    if fields is None:
+        changed = cursor.execute(DB_BULK_DELETE_COMMAND.format(table = table)).rowcount
+    else:
+        if new_description is not None:
+            cursor.execute(DB_INSERT_DESCRIPTION_COMMAND, (new_description,))
+        changed = cursor.execute(DB_BULK_UPDATE_COMMAND.format(table = table, fields = ", ".join(fields)), values).rowcount
+
+        new_rows = BULK_NEW_ROWS.format(table = table)
+        _apply_bulk_rows(cursor, table, new_rows, True, balance, rollups)
+        first_day = min(first_day, cursor.execute(f"SELECT MIN(day) FROM {new_rows}").fetchone()[0])
+
+    if balance:
+        cursor.execute(DB_REFRESH_CUMULATIVE_COMMANDS[0])
+        cursor.execute(DB_REFRESH_CUMULATIVE_COMMANDS[1], (first_day,))
+    cursor.execute(DB_STOP_BULK_WRITE_COMMAND)
+
+    return changed
+
+def _bulk_write(table: str, ids: Iterable[int] | None, where: Filter | None, db_path: str | Session,
+                fields: list[str] | None = None, values: list | None = None, new_description: str | None = None,
+                balance: bool = True, rollups: bool = True) -> tuple[bool, int | str]:
+    """Deletes (without fields) or updates the entries of table with one of ids that match where, returns how many.
+
+    The entries are collected once and changed by a single statement. The per row triggers skip
+    them, the balance (a single SUM), daily running totals (if balance) and rollups (if rollups)
+    are updated once for all the entries instead. Archived entries are read-only, they never match.
+    """
+
+    conditions = []
+    params = []
+
+    if ids is not None:
+        ids = list(ids)
+        conditions.append(BULK_IDS_CONDITION)
+        params.append(json.dumps(ids))
+    if where is not None:
+        conditions.append(where.sql)
+        params.extend(where.params)
+
+    try:
+        if not conditions or ids == []:
+            raise ValueError("Choose the entries by id or with a filter")
+
+        with _connect(db_path) as connection:
+            # the rows are read before they are changed, a deferred transaction could not upgrade to a write
+            # once another connection committed (SQLITE_BUSY_SNAPSHOT under WAL). A grouped session keeps its own.
+            if not connection.in_transaction:
+                connection.execute("BEGIN IMMEDIATE")
+            cursor = connection.cursor()
+
+            for command in DB_BULK_ROWS_COMMANDS:
+                cursor.execute(command)
+            condition = " AND ".join(f"({condition})" for condition in conditions)
+            cursor.execute(DB_SELECT_BULK_ROWS_COMMAND.format(table = table, condition = condition), params)
+
+            changed = 0
+            if cursor.rowcount > 0:
+                changed = _change_bulk_rows(cursor, table, fields, values, new_description, balance, rollups)
+
+            cursor.execute(DB_BULK_ROWS_COMMANDS[1])
+            connection.commit()
+
+        return True, changed
+
+    except sqlite3.Error as e:
+        return False, "Database error"
+
+    except ValueError as e:
+        return False, str(e)
+
     except Exception as e:
-        return False
+        return False, "Unexpected error"
+
+def _bulk_edit(table: str, ids: Iterable[int] | None, where: Filter | None, new_date, new_description, new_category, new_amount,
+               db_path: str | Session) -> tuple[bool, int | str]:
+    fields, values = _edit_fields(new_date, new_description, new_category, new_amount)
+    if not fields:
+        return False, "Choose at least one value to edit"
+
+    # a category edit leaves the balance and running totals alone, a description edit the rollups too
+    balance = new_date is not None or new_amount is not None
+    return _bulk_write(table, ids, where, db_path, fields, values, new_description, balance, balance or new_category is not None)
 
 # EXPENSES DB LOGIC _______________________________________________
 
-DB_GETALL_EXPENSES_COMMAND = """
-    SELECT * FROM expenses
+DB_GETALL_EXPENSES_COMMAND = f"""
+    SELECT {_select_columns("expenses")} FROM expenses
 """
 
 DB_INSERT_EXPENSE_COMMAND = """
-    INSERT INTO expenses (date, description, category, amount)
-    VALUES (? ,? ,?, ?)
+    INSERT INTO expenses (day, description_id, category, cents)
+    VALUES (?, (SELECT id FROM descriptions WHERE text = ?), ?, ?)
 """
 
 DB_DELETE_EXPENSE_COMMAND = """
     DELETE FROM expenses WHERE id = ?
 """
 
-def get_expenses(db_path: str = DB_DEFAULT_PATH) -> tuple[bool, list | str]:
+def get_expenses(db_path: str | Session = DB_DEFAULT_PATH) -> tuple[bool, list | str]:
     try:
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
+        with _connect(db_path) as connection:
+            cursor = connection.cursor()
 
-        cursor.execute(DB_GETALL_EXPENSES_COMMAND)
-        expenses = cursor.fetchall()
-        connection.close()
+            cursor.execute(DB_GETALL_EXPENSES_COMMAND)
+            expenses = cursor.fetchall()
+
+            archived = []
+            for file in _archive_files(connection, None, None):
+                with closing(_open_connection(ReadOnly(file))) as shard:
+                    archived += shard.execute(DB_GETALL_EXPENSES_COMMAND).fetchall()
+            expenses = archived + expenses
         
         return True, expenses
     
@@ -107,22 +1145,25 @@ def get_expenses(db_path: str = DB_DEFAULT_PATH) -> tuple[bool, list | str]:
     except Exception as e:
         return False, "Unexpected error"
 
-def add_expense(expense: Expense, db_path: str = DB_DEFAULT_PATH) -> bool:
+def iter_expenses(limit: int | None = None, after_id: int | None = None, before_date: date | None = None, order: str = "asc",
+                  where: Filter | None = None, db_path: str | Session = DB_DEFAULT_PATH, chunk_size: int = FETCH_CHUNK_SIZE) -> tuple[bool, Iterator[tuple] | str]:
+    return _iter_rows("expenses", limit, after_id, before_date, order, where, db_path, chunk_size)
+
+def iter_expense_records(limit: int | None = None, after_id: int | None = None, before_date: date | None = None, order: str = "asc",
+                         where: Filter | None = None, db_path: str | Session = DB_DEFAULT_PATH, chunk_size: int = FETCH_CHUNK_SIZE) -> tuple[bool, Iterator[Expense] | str]:
+    """Same as iter_expenses but yields Expense records (with their id) built straight from the stored columns."""
+
+    return _iter_rows("expenses", limit, after_id, before_date, order, where, db_path, chunk_size, expense_row_factory)
+
+def add_expense(expense: Expense, db_path: str | Session = DB_DEFAULT_PATH) -> bool:
     try:
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
+        with _connect(db_path) as connection:
+            cursor = connection.cursor()
 
-        cursor.execute(DB_INSERT_EXPENSE_COMMAND, (expense.date.isoformat(),
-                                                   expense.description,
-                                                   expense.category.name,
-                                                   expense.amount))
-        
-        cursor.execute(DB_GET_BALANCE_COMMAND)
-        new_balance = cursor.fetchone()[1] - expense.amount
-        cursor.execute(DB_SET_BALANCE_COMMAND, (new_balance,))
-        
-        connection.commit()
-        connection.close()
+            cursor.execute(DB_INSERT_DESCRIPTION_COMMAND, (expense.description,))
+            cursor.execute(DB_INSERT_EXPENSE_COMMAND, _record_values(expense))
+
+            connection.commit() # the balance is updated by the insert trigger
 
         return True
 
@@ -132,45 +1173,27 @@ def add_expense(expense: Expense, db_path: str = DB_DEFAULT_PATH) -> bool:
     except Exception as e:
         return False
 
-def edit_expense(id: int, new_date = None, new_description = None, new_category = None, new_amount = None, db_path: str = DB_DEFAULT_PATH) -> bool:
-    fields = []
-    values = []
-
-    if new_date is not None:
-        fields.append("date = ?")
-        values.append(new_date.isoformat())
-    if new_description is not None:
-        fields.append("description = ?")
-        values.append(new_description)
-    if new_category is not None:
-        fields.append("category = ?")
-        values.append(new_category)
-    if new_amount is not None:
-        fields.append("amount = ?")
-        values.append(new_amount)
+def edit_expense(id: int, new_date = None, new_description = None, new_category = None, new_amount = None, db_path: str | Session = DB_DEFAULT_PATH) -> bool:
+    fields, values = _edit_fields(new_date, new_description, new_category, new_amount)
 
     if not fields or not values:
         return False # should never happen
     
     values.append(id)
 
-    query_str = f"UPDATE expenses SET {", ".join(fields)} WHERE id = ?"
+    query_str = f"UPDATE expenses SET {', '.join(fields)} WHERE id = ?"
 
     try:
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
-
-        if new_amount is not None:
-            cursor.execute("SELECT * FROM expenses WHERE id = ?", (id,))
-            old_amount = cursor.fetchone()[4] # 4 is the position of the amount
-            diff = old_amount - new_amount
+        with _connect(db_path) as connection:
+            cursor = connection.cursor()
 
-            cursor.execute("UPDATE balance SET curr_balance = curr_balance + ? WHERE id = 1", (diff,))
+            if new_description is not None:
+                cursor.execute(DB_INSERT_DESCRIPTION_COMMAND, (new_description,))
 
-        cursor.execute(query_str, tuple(values))
+            # a changed amount is reflected in the balance by the update trigger
+            cursor.execute(query_str, tuple(values))
 
-        connection.commit()
-        connection.close()
+            connection.commit()
 
         return cursor.rowcount > 0
     
@@ -180,18 +1203,13 @@ def edit_expense(id: int, new_date = None, new_description = None, new_category
     except Exception as e:
         return False
 
-def del_expense(id: int, db_path: str = DB_DEFAULT_PATH) -> bool:
+def del_expense(id: int, db_path: str | Session = DB_DEFAULT_PATH) -> bool:
     try:
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
-
-        cursor.execute("SELECT * FROM expenses WHERE id = ?", (id,))
-        diff = cursor.fetchone()[4]
-        cursor.execute("UPDATE balance SET curr_balance = curr_balance + ? WHERE id = 1", (diff,))
+        with _connect(db_path) as connection:
+            cursor = connection.cursor()
 
-        cursor.execute(DB_DELETE_EXPENSE_COMMAND, (id,))
-        connection.commit()
-        connection.close()
+            cursor.execute(DB_DELETE_EXPENSE_COMMAND, (id,))
+            connection.commit()
 
         return cursor.rowcount > 0
     
@@ -201,29 +1219,50 @@ def del_expense(id: int, db_path: str = DB_DEFAULT_PATH) -> bool:
     except Exception as e:
         return False
 
+def del_expenses(ids: Iterable[int] | None = None, where: Filter | None = None,
+                 db_path: str | Session = DB_DEFAULT_PATH) -> tuple[bool, int | str]:
+    """Deletes the expenses with one of ids that match where in one transaction, returns how many were deleted."""
+
+    return _bulk_write("expenses", ids, where, db_path)
+
+def edit_expenses(ids: Iterable[int] | None = None, where: Filter | None = None, new_date = None, new_description = None,
+                  new_category = None, new_amount = None, db_path: str | Session = DB_DEFAULT_PATH) -> tuple[bool, int | str]:
+    """Gives the expenses with one of ids that match where the same new values in one transaction, returns how many were edited."""
+
+    return _bulk_edit("expenses", ids, where, new_date, new_description, new_category, new_amount, db_path)
+
+def import_expenses(expenses: Iterable[Expense], db_path: str | Session = DB_DEFAULT_PATH,
+                    batch_size: int = IMPORT_BATCH_SIZE) -> tuple[bool, int | str]:
+    return _import_records(expenses, "expenses", DB_INSERT_EXPENSE_COMMAND, db_path, batch_size)
+
 # INCOMES DB LOGIC _______________________________________________
 
-DB_GETALL_INCOMES_COMMAND = """
-    SELECT * FROM incomes
+DB_GETALL_INCOMES_COMMAND = f"""
+    SELECT {_select_columns("incomes")} FROM incomes
 """
 
 DB_INSERT_INCOME_COMMAND = """
-    INSERT INTO incomes (date, description, category, amount)
-    VALUES (? ,? ,?, ?)
+    INSERT INTO incomes (day, description_id, category, cents)
+    VALUES (?, (SELECT id FROM descriptions WHERE text = ?), ?, ?)
 """
 
 DB_DELETE_INCOME_COMMAND = """
     DELETE FROM incomes WHERE id = ?
 """
 
-def get_incomes(db_path: str = DB_DEFAULT_PATH) -> tuple[bool, list | str]:
+def get_incomes(db_path: str | Session = DB_DEFAULT_PATH) -> tuple[bool, list | str]:
     try:
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
+        with _connect(db_path) as connection:
+            cursor = connection.cursor()
 
-        cursor.execute(DB_GETALL_INCOMES_COMMAND)
-        incomes = cursor.fetchall()
-        connection.close()
+            cursor.execute(DB_GETALL_INCOMES_COMMAND)
+            incomes = cursor.fetchall()
+
+            archived = []
+            for file in _archive_files(connection, None, None):
+                with closing(_open_connection(ReadOnly(file))) as shard:
+                    archived += shard.execute(DB_GETALL_INCOMES_COMMAND).fetchall()
+            incomes = archived + incomes
         
         return True, incomes
     
@@ -233,22 +1272,25 @@ def get_incomes(db_path: str = DB_DEFAULT_PATH) -> tuple[bool, list | str]:
     except Exception as e:
         return False, "Unexpected error"
 
-def add_income(income: Income, db_path: str = DB_DEFAULT_PATH) -> bool:
+def iter_incomes(limit: int | None = None, after_id: int | None = None, before_date: date | None = None, order: str = "asc",
+                 where: Filter | None = None, db_path: str | Session = DB_DEFAULT_PATH, chunk_size: int = FETCH_CHUNK_SIZE) -> tuple[bool, Iterator[tuple] | str]:
+    return _iter_rows("incomes", limit, after_id, before_date, order, where, db_path, chunk_size)
+
+def iter_income_records(limit: int | None = None, after_id: int | None = None, before_date: date | None = None, order: str = "asc",
+                        where: Filter | None = None, db_path: str | Session = DB_DEFAULT_PATH, chunk_size: int = FETCH_CHUNK_SIZE) -> tuple[bool, Iterator[Income] | str]:
+    """Same as iter_incomes but yields Income records (with their id) built straight from the stored columns."""
+
+    return _iter_rows("incomes", limit, after_id, before_date, order, where, db_path, chunk_size, income_row_factory)
+
+def add_income(income: Income, db_path: str | Session = DB_DEFAULT_PATH) -> bool:
     try:
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
+        with _connect(db_path) as connection:
+            cursor = connection.cursor()
 
-        cursor.execute(DB_INSERT_INCOME_COMMAND, (income.date.isoformat(),
-                                                  income.description,
-                                                  income.category.name,
-                                                  income.amount))
-        
-        cursor.execute(DB_GET_BALANCE_COMMAND)
-        new_balance = cursor.fetchone()[1] + income.amount
-        cursor.execute(DB_SET_BALANCE_COMMAND, (new_balance,))
-        
-        connection.commit()
-        connection.close()
+            cursor.execute(DB_INSERT_DESCRIPTION_COMMAND, (income.description,))
+            cursor.execute(DB_INSERT_INCOME_COMMAND, _record_values(income))
+
+            connection.commit() # the balance is updated by the insert trigger
 
         return True
 
@@ -258,44 +1300,26 @@ def add_income(income: Income, db_path: str = DB_DEFAULT_PATH) -> bool:
     except Exception as e:
         return False
 
-def edit_income(id: int, new_date = None, new_description = None, new_category = None, new_amount = None, db_path: str = DB_DEFAULT_PATH) -> bool:
-    fields = []
-    values = []
-
-    if new_date is not None:
-        fields.append("date = ?")
-        values.append(new_date.isoformat())
-    if new_description is not None:
-        fields.append("description = ?")
-        values.append(new_description)
-    if new_category is not None:
-        fields.append("category = ?")
-        values.append(new_category)
-    if new_amount is not None:
-        fields.append("amount = ?")
-        values.append(new_amount)
+def edit_income(id: int, new_date = None, new_description = None, new_category = None, new_amount = None, db_path: str | Session = DB_DEFAULT_PATH) -> bool:
+    fields, values = _edit_fields(new_date, new_description, new_category, new_amount)
 
     if not fields or not values:
         return False # should never happen
     
     values.append(id)
 
-    query_str = f"UPDATE incomes SET {", ".join(fields)} WHERE id = ?"
+    query_str = f"UPDATE incomes SET {', '.join(fields)} WHERE id = ?"
 
     try:
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
+        with _connect(db_path) as connection:
+            cursor = connection.cursor()
 
-        if new_amount is not None:
-            cursor.execute("SELECT * FROM incomes WHERE id = ?", (id,))
-            old_amount = cursor.fetchone()[4] # 4 is the position of the amount
-            diff = old_amount - new_amount
+            if new_description is not None:
+                cursor.execute(DB_INSERT_DESCRIPTION_COMMAND, (new_description,))
 
-            cursor.execute("UPDATE balance SET curr_balance = curr_balance - ? WHERE id = 1", (diff,))
-
-        cursor.execute(query_str, tuple(values))
-        connection.commit()
-        connection.close()
+            # a changed amount is reflected in the balance by the update trigger
+            cursor.execute(query_str, tuple(values))
+            connection.commit()
 
         return cursor.rowcount > 0
 
@@ -305,18 +1329,13 @@ def edit_income(id: int, new_date = None, new_description = None, new_category =
     except Exception as e:
         return False
 
-def del_income(id: int, db_path: str = DB_DEFAULT_PATH) -> bool:
+def del_income(id: int, db_path: str | Session = DB_DEFAULT_PATH) -> bool:
     try:
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
+        with _connect(db_path) as connection:
+            cursor = connection.cursor()
 
-        cursor.execute("SELECT * FROM incomes WHERE id = ?", (id,))
-        diff = cursor.fetchone()[4]
-        cursor.execute("UPDATE balance SET curr_balance = curr_balance - ? WHERE id = 1", (diff,))
-
-        cursor.execute(DB_DELETE_INCOME_COMMAND, (id,))
-        connection.commit()
-        connection.close()
+            cursor.execute(DB_DELETE_INCOME_COMMAND, (id,))
+            connection.commit()
 
         return cursor.rowcount > 0
     
@@ -325,3 +1344,606 @@ def del_income(id: int, db_path: str = DB_DEFAULT_PATH) -> bool:
     
     except Exception as e:
         return False
+
+def del_incomes(ids: Iterable[int] | None = None, where: Filter | None = None,
+                db_path: str | Session = DB_DEFAULT_PATH) -> tuple[bool, int | str]:
+    """Deletes the incomes with one of ids that match where in one transaction, returns how many were deleted."""
+
+    return _bulk_write("incomes", ids, where, db_path)
+
+def edit_incomes(ids: Iterable[int] | None = None, where: Filter | None = None, new_date = None, new_description = None,
+                 new_category = None, new_amount = None, db_path: str | Session = DB_DEFAULT_PATH) -> tuple[bool, int | str]:
+    """Gives the incomes with one of ids that match where the same new values in one transaction, returns how many were edited."""
+
+    return _bulk_edit("incomes", ids, where, new_date, new_description, new_category, new_amount, db_path)
+
+def import_incomes(incomes: Iterable[Income], db_path: str | Session = DB_DEFAULT_PATH,
+                   batch_size: int = IMPORT_BATCH_SIZE) -> tuple[bool, int | str]:
+    return _import_records(incomes, "incomes", DB_INSERT_INCOME_COMMAND, db_path, batch_size)
+
+# SUMMARY DB LOGIC ________________________________________________
+
+DB_REBUILD_ROLLUP_COMMANDS = ("""
+    DELETE FROM monthly_totals
+""", """
+    INSERT INTO monthly_totals (kind, month, category, total, count)
+    SELECT 'exp', strftime('%Y-%m', day * 86400, 'unixepoch'), COALESCE(category, ''), SUM(cents), COUNT(*)
+    FROM expenses GROUP BY 2, 3
+""", """
+    INSERT INTO monthly_totals (kind, month, category, total, count)
+    SELECT 'inc', strftime('%Y-%m', day * 86400, 'unixepoch'), COALESCE(category, ''), SUM(cents), COUNT(*)
+    FROM incomes GROUP BY 2, 3
+""", """
+    INSERT INTO monthly_totals (kind, month, category, total, count)
+    SELECT kind, strftime('%Y-%m', day * 86400, 'unixepoch'), category, SUM(total), SUM(count)
+    FROM archived_totals GROUP BY 1, 2, 3
+    ON CONFLICT (kind, month, category) DO UPDATE SET total = total + excluded.total, count = count + excluded.count
+""")
+
+def _rebuild_monthly_totals(cursor: sqlite3.Cursor):
+    for command in DB_REBUILD_ROLLUP_COMMANDS:
+        cursor.execute(command)
+    cursor.execute(DB_BUMP_WRITE_COUNTER_COMMAND)
+
+def rebuild_monthly_totals(db_path: str | Session = DB_DEFAULT_PATH) -> bool:
+    """Recomputes the monthly_totals rollup from scratch, one grouped pass per table."""
+
+    try:
+        with _connect(db_path) as connection:
+            _rebuild_monthly_totals(connection.cursor())
+            connection.commit()
+
+        return True
+
+    except sqlite3.Error as e:
+        return False
+
+    except Exception as e:
+        return False
+
+@cached_report
+def get_monthly_totals(kind: str | None = None, start_month: str | None = None, end_month: str | None = None,
+                       db_path: str | Session = DB_DEFAULT_PATH) -> tuple[bool, list | str]:
+    """Returns (kind, month, category, total, count) rows of the rollup, optionally limited to one kind ('exp' or 'inc')
+    and to an inclusive YYYY-MM month range."""
+
+    conditions = []
+    params = []
+
+    if kind is not None:
+        conditions.append("kind = ?")
+        params.append(kind)
+    if start_month is not None:
+        conditions.append("month >= ?")
+        params.append(start_month)
+    if end_month is not None:
+        conditions.append("month <= ?")
+        params.append(end_month)
+
+    query = "SELECT kind, month, category, total / 100.0, count FROM monthly_totals"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY month, kind, category"
+
+    try:
+        with _connect(db_path) as connection:
+            cursor = connection.cursor()
+
+            cursor.execute(query, params)
+            totals = cursor.fetchall()
+
+        return True, totals
+
+    except sqlite3.Error as e:
+        return False, "Database error"
+
+    except Exception as e:
+        return False, "Unexpected error"
+
+def _rebuild_derived_tables(cursor: sqlite3.Cursor):
+    _rebuild_monthly_totals(cursor)
+    _rebuild_daily_balance(cursor)
+
+# BALANCE HISTORY DB LOGIC ________________________________________
+
+DB_REBUILD_DAILY_BALANCE_COMMANDS = ("""
+    DELETE FROM daily_balance
+""", """
+    INSERT INTO daily_balance (day, net, cumulative)
+    SELECT day, net, SUM(net) OVER (ORDER BY day)
+    FROM (SELECT day, SUM(delta) AS net
+          FROM (SELECT day, -cents AS delta FROM expenses UNION ALL SELECT day, cents FROM incomes
+                UNION ALL SELECT day, CASE kind WHEN 'exp' THEN -total ELSE total END FROM archived_totals)
+          GROUP BY day)
+    WHERE net != 0
+""")
+
+# the current balance can be set by hand, so the history is anchored on it: whatever is not explained
+# by the entries is treated as the opening balance
+DB_OPENING_BALANCE_COMMAND = """
+    SELECT (SELECT curr_balance FROM balance WHERE id = 1)
+           - COALESCE((SELECT cumulative FROM daily_balance ORDER BY day DESC LIMIT 1), 0)
+"""
+
+DB_CUMULATIVE_AT_COMMAND = """
+    SELECT COALESCE((SELECT cumulative FROM daily_balance WHERE day <= ? ORDER BY day DESC LIMIT 1), 0)
+"""
+
+DB_CUMULATIVE_SERIES_COMMAND = """
+    SELECT day, cumulative FROM daily_balance WHERE day > ? AND day <= ? ORDER BY day
+"""
+
+DB_DEFER_DAILY_BALANCE_COMMAND = """
+    INSERT INTO daily_balance_deferred (id) VALUES (1)
+"""
+
+DB_RESUME_DAILY_BALANCE_COMMAND = """
+    DELETE FROM daily_balance_deferred
+"""
+
+DB_ADD_TO_DAILY_BALANCE_COMMAND = """
+    INSERT INTO daily_balance (day, net, cumulative)
+    SELECT day, {sign}SUM(cents), 0 FROM {table} WHERE id > ? GROUP BY day
+    ON CONFLICT (day) DO UPDATE SET net = net + excluded.net
+"""
+
+DB_REFRESH_CUMULATIVE_COMMANDS = ("""
+    DELETE FROM daily_balance WHERE net = 0
+""", """
+    UPDATE daily_balance SET cumulative = running.total
+    FROM (SELECT day, SUM(net) OVER (ORDER BY day) AS total FROM daily_balance) AS running
+    WHERE running.day = daily_balance.day AND daily_balance.day >= ?
+""")
+
+def _add_to_daily_balance(cursor: sqlite3.Cursor, table: str, last_id: int):
+    """Adds the rows of table with an id above last_id to daily_balance in one grouped pass."""
+
+    sign = "-" if table == "expenses" else ""
+    cursor.execute(DB_ADD_TO_DAILY_BALANCE_COMMAND.format(sign = sign, table = table), (last_id,))
+
+    first_day = cursor.execute(f"SELECT MIN(day) FROM {table} WHERE id > ?", (last_id,)).fetchone()[0]
+    if first_day is not None:
+        cursor.execute(DB_REFRESH_CUMULATIVE_COMMANDS[0])
+        cursor.execute(DB_REFRESH_CUMULATIVE_COMMANDS[1], (first_day,))
+
+def _rebuild_daily_balance(cursor: sqlite3.Cursor):
+    for command in DB_REBUILD_DAILY_BALANCE_COMMANDS:
+        cursor.execute(command)
+    cursor.execute(DB_BUMP_WRITE_COUNTER_COMMAND)
+
+def rebuild_daily_balance(db_path: str | Session = DB_DEFAULT_PATH) -> bool:
+    """Recomputes the daily_balance running totals from scratch in one pass."""
+
+    try:
+        with _connect(db_path) as connection:
+            _rebuild_daily_balance(connection.cursor())
+            connection.commit()
+
+        return True
+
+    except sqlite3.Error as e:
+        return False
+
+    except Exception as e:
+        return False
+
+@cached_report
+def get_balance_at(day: date, db_path: str | Session = DB_DEFAULT_PATH) -> tuple[bool, float | str]:
+    """Balance at the end of day, two index lookups whatever the size of the history."""
+
+    try:
+        with _connect(db_path) as connection, _read_transaction(connection):
+            cursor = connection.cursor()
+
+            opening = cursor.execute(DB_OPENING_BALANCE_COMMAND).fetchone()[0]
+            cumulative = cursor.execute(DB_CUMULATIVE_AT_COMMAND, (to_day(day),)).fetchone()[0]
+
+        return True, from_cents(opening + cumulative)
+
+    except sqlite3.Error as e:
+        return False, "Database error"
+
+    except Exception as e:
+        return False, "Unexpected error"
+
+@cached_report
+def get_balance_series(start: date, end: date, db_path: str | Session = DB_DEFAULT_PATH) -> tuple[bool, list | str]:
+    """Returns (date, balance) pairs: the balance at the end of start, then one pair per later day up to end
+    on which the balance changed."""
+
+    try:
+        with _connect(db_path) as connection, _read_transaction(connection):
+            cursor = connection.cursor()
+
+            opening = cursor.execute(DB_OPENING_BALANCE_COMMAND).fetchone()[0]
+            cumulative = cursor.execute(DB_CUMULATIVE_AT_COMMAND, (to_day(start),)).fetchone()[0]
+            series = [(start, from_cents(opening + cumulative))]
+
+            cursor.execute(DB_CUMULATIVE_SERIES_COMMAND, (to_day(start), to_day(end)))
+            series.extend((from_day(day), from_cents(opening + cumulative)) for day, cumulative in cursor)
+
+        return True, series
+
+    except sqlite3.Error as e:
+        return False, "Database error"
+
+    except Exception as e:
+        return False, "Unexpected error"
+
+# ANALYTICS COLUMNS _______________________________________________
+
+COLUMN_CHUNK_SIZE = 65536 # rows per chunk handed to the columnar loader
+
+COLUMN_TABLES = {"exp": ("expenses", ExpCategory), "inc": ("incomes", IncCategory)}
+
+def _category_code_sql(categories: type[ExpCategory] | type[IncCategory]) -> str:
+    """CASE expression giving the position of the category in its enum, unknown categories count as OTHER."""
+
+    cases = " ".join(f"WHEN '{key}' THEN {code}" for code, category in enumerate(categories) for key in (category.name, category.value))
+    return f"CASE category {cases} ELSE {list(categories).index(categories.OTHER)} END"
+
+def iter_columns(kind: str, start: date | None = None, end: date | None = None, db_path: str | Session = DB_DEFAULT_PATH,
+                 chunk_size: int = COLUMN_CHUNK_SIZE) -> tuple[bool, Iterator[list[tuple[int, int, int]]] | str]:
+    """Streams the expenses ('exp') or incomes ('inc') as chunks of (day, category code, cents) rows, all integers.
+
+    The category code is the position of the category in ExpCategory/IncCategory. start and end are inclusive.
+    """
+
+    try:
+        table, categories = COLUMN_TABLES[kind]
+        conditions = []
+        params = []
+
+        if start is not None:
+            conditions.append("day >= ?")
+            params.append(to_day(start))
+        if end is not None:
+            conditions.append("day <= ?")
+            params.append(to_day(end))
+
+        query = f"SELECT day, {_category_code_sql(categories)}, cents FROM {table}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        sources = _execute_archived(query, params, db_path, to_day(start) if start else None, to_day(end) if end else None)
+        return True, _chain_chunks(sources, chunk_size)
+
+    except sqlite3.Error as e:
+        return False, "Database error"
+
+    except Exception as e:
+        return False, "Unexpected error"
+
+
+# EXPORT DB LOGIC _________________________________________________
+
+EXPORT_CHUNK_SIZE = 10000 # rows per fetchmany while exporting
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_COLUMNS = ("type", "id", "date", "description", "category", "amount")
+
+def _category_value_sql(categories: type[ExpCategory] | type[IncCategory]) -> str:
+    """CASE expression giving the enum value of the stored category name ("FOOD" -> "Food")."""
+
+    cases = " ".join(f"WHEN '{category.name}' THEN '{category.value}'" for category in categories)
+    return f"CASE category {cases} ELSE category END"
+
+def _export_select(kind: str, format: str) -> str:
+    """Select list of one ready to write row: the CSV fields of EXPORT_COLUMNS or a single JSON object."""
+
+    table, categories = COLUMN_TABLES[kind]
+    values = (f"'{kind}'",
+              "id",
+              "date(day * 86400, 'unixepoch')",
+              f"(SELECT text FROM descriptions WHERE descriptions.id = {table}.description_id)",
+              _category_value_sql(categories),
+              "printf('%.2f', cents / 100.0)") # exact, amounts are whole cents
+
+    if format == "csv":
+        return ", ".join(values)
+    values = values[:-1] + (f"json({values[-1]})",) # a JSON number that keeps both decimals
+    return "json_object(" + ", ".join(f"'{column}', {value}" for column, value in zip(EXPORT_COLUMNS, values)) + ")"
+
+def iter_export(kind: str, format: str = "csv", start: date | None = None, end: date | None = None, where: Filter | None = None,
+                db_path: str | Session = DB_DEFAULT_PATH, chunk_size: int = EXPORT_CHUNK_SIZE) -> tuple[bool, Iterator[list[tuple]] | str]:
+    """Streams the expenses ('exp') or incomes ('inc') as chunks of rows formatted by SQLite, in id order per
+    archive year (oldest first) and then for the db.
+
+    csv rows are the EXPORT_COLUMNS fields as strings (the amount with two decimals, the category
+    by its value as import_csv reads it), jsonl rows are 1-tuples with a JSON object. start and end
+    are inclusive, where is a compiled filter.
+    """
+
+    try:
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {format}")
+
+        table = COLUMN_TABLES[kind][0]
+        conditions = []
+        params = []
+
+        if start is not None:
+            conditions.append("day >= ?")
+            params.append(to_day(start))
+        if end is not None:
+            conditions.append("day <= ?")
+            params.append(to_day(end))
+        if where is not None:
+            conditions.append(where.sql)
+            params.extend(where.params)
+
+        query = f"SELECT {_export_select(kind, format)} FROM {table}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id"
+
+        sources = _execute_archived(query, params, db_path, to_day(start) if start else None, to_day(end) if end else None,
+                                    where = where)
+        return True, _chain_chunks(sources, chunk_size)
+
+    except sqlite3.Error as e:
+        return False, "Database error"
+
+    except Exception as e:
+        return False, "Unexpected error"
+
+# ARCHIVE DB LOGIC ________________________________________________
+
+ARCHIVE_FILE_NAME = "{stem}-{year}.db" # next to the db, e.g. finances-2019.db
+
+# tables of a shard. Entries and descriptions keep their ids, so the queries written for the db run
+# unchanged on a shard. Shards are only written by archive, they need no triggers.
+ARCHIVE_SCHEMA_COMMANDS = ("""
+    CREATE TABLE IF NOT EXISTS {shard}.descriptions (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL UNIQUE
+    )
+""", """
+    CREATE TABLE IF NOT EXISTS {shard}.expenses (
+        id INTEGER PRIMARY KEY,
+        day INTEGER NOT NULL,
+        description_id INTEGER,
+        category TEXT,
+        cents INTEGER NOT NULL
+    )
+""", """
+    CREATE TABLE IF NOT EXISTS {shard}.incomes (
+        id INTEGER PRIMARY KEY,
+        day INTEGER NOT NULL,
+        description_id INTEGER,
+        category TEXT,
+        cents INTEGER NOT NULL
+    )
+""", """
+    CREATE INDEX IF NOT EXISTS {shard}.expenses_date_idx ON expenses (day)
+""", """
+    CREATE INDEX IF NOT EXISTS {shard}.expenses_description_idx ON expenses (description_id)
+""", """
+    CREATE INDEX IF NOT EXISTS {shard}.incomes_date_idx ON incomes (day)
+""", """
+    CREATE INDEX IF NOT EXISTS {shard}.incomes_description_idx ON incomes (description_id)
+""", """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {shard}.descriptions_search USING fts5 (
+        text,
+        content = 'descriptions',
+        content_rowid = 'id',
+        prefix = '2 3'
+    )
+""")
+
+DB_ARCHIVE_YEARS_COMMAND = """
+    SELECT DISTINCT CAST(strftime('%Y', day * 86400, 'unixepoch') AS INTEGER)
+    FROM (SELECT day FROM expenses WHERE day < ?1 UNION SELECT day FROM incomes WHERE day < ?1)
+"""
+
+DB_ARCHIVE_DESCRIPTIONS_COMMAND = """
+    INSERT INTO {shard}.descriptions (id, text)
+    SELECT id, text FROM main.descriptions
+    WHERE id IN (SELECT description_id FROM main.expenses WHERE day BETWEEN ?1 AND ?2
+                 UNION SELECT description_id FROM main.incomes WHERE day BETWEEN ?1 AND ?2)
+    ON CONFLICT DO NOTHING
+"""
+
+# a later run copies again the entries of a run that was interrupted, in their current state
+DB_ARCHIVE_COPY_COMMAND = """
+    INSERT INTO {shard}.{table} (id, day, description_id, category, cents)
+    SELECT id, day, description_id, category, cents FROM main.{table} WHERE day BETWEEN ? AND ?
+    ON CONFLICT (id) DO UPDATE SET day = excluded.day, description_id = excluded.description_id,
+                                   category = excluded.category, cents = excluded.cents
+"""
+
+DB_ARCHIVE_INDEX_COMMAND = """
+    INSERT INTO {shard}.descriptions_search (descriptions_search) VALUES ('rebuild')
+"""
+
+# only the entries the shard holds exactly are removed, one edited since it was copied stays
+ARCHIVED_ROW_CONDITION = """
+    day BETWEEN ? AND ? AND EXISTS (
+        SELECT 1 FROM {shard}.{table} AS copy
+        WHERE copy.id = {table}.id AND copy.day = {table}.day AND copy.cents = {table}.cents
+              AND copy.category IS {table}.category AND copy.description_id IS {table}.description_id)
+"""
+
+DB_ARCHIVE_TOTALS_COMMAND = """
+    INSERT INTO archived_totals (kind, day, category, total, count)
+    SELECT '{kind}', day, COALESCE(category, ''), SUM(cents), COUNT(*) FROM main.{table}
+    WHERE {condition}
+    GROUP BY day, 3
+    ON CONFLICT (kind, day, category) DO UPDATE SET total = total + excluded.total, count = count + excluded.count
+"""
+
+DB_ARCHIVE_DELETE_COMMAND = """
+    DELETE FROM main.{table} WHERE {condition}
+"""
+
+DB_REGISTER_ARCHIVE_COMMAND = """
+    INSERT INTO archives (year, file) VALUES (?, ?)
+    ON CONFLICT (year) DO UPDATE SET file = excluded.file
+"""
+
+DB_START_ARCHIVING_COMMAND = """
+    INSERT INTO archiving (id) VALUES (1)
+"""
+
+DB_STOP_ARCHIVING_COMMAND = """
+    DELETE FROM archiving
+"""
+
+ARCHIVE_KINDS = (("exp", "expenses"), ("inc", "incomes"))
+
+def _year_days(year: int) -> tuple[int, int]:
+    return to_day(date(year, 1, 1)), to_day(date(year, 12, 31))
+
+def _copy_to_shards(connection: sqlite3.Connection, years: list[int]):
+    """Copies the entries of every year to its attached shard, in one transaction over the shards only."""
+
+    connection.execute("BEGIN")
+    for year in years:
+        shard = f"shard_{year}"
+        for command in ARCHIVE_SCHEMA_COMMANDS:
+            connection.execute(command.format(shard = shard))
+
+        days = _year_days(year)
+        connection.execute(DB_ARCHIVE_DESCRIPTIONS_COMMAND.format(shard = shard), days)
+        for _, table in ARCHIVE_KINDS:
+            connection.execute(DB_ARCHIVE_COPY_COMMAND.format(shard = shard, table = table), days)
+        connection.execute(DB_ARCHIVE_INDEX_COMMAND.format(shard = shard))
+    connection.commit()
+
+def _remove_archived(connection: sqlite3.Connection, years: list[int], stem: str) -> list[int]:
+    """Removes from the db the entries the shards of years now hold, in one transaction, returns how many per kind."""
+
+    removed = [0] * len(ARCHIVE_KINDS)
+
+    connection.execute("BEGIN IMMEDIATE")
+    connection.execute(DB_START_ARCHIVING_COMMAND)
+    for year in years:
+        days = _year_days(year)
+        for i, (kind, table) in enumerate(ARCHIVE_KINDS):
+            condition = ARCHIVED_ROW_CONDITION.format(shard = f"shard_{year}", table = table)
+            connection.execute(DB_ARCHIVE_TOTALS_COMMAND.format(kind = kind, table = table, condition = condition), days)
+            removed[i] += connection.execute(DB_ARCHIVE_DELETE_COMMAND.format(table = table, condition = condition), days).rowcount
+        connection.execute(DB_REGISTER_ARCHIVE_COMMAND, (year, ARCHIVE_FILE_NAME.format(stem = stem, year = year)))
+    connection.execute(DB_STOP_ARCHIVING_COMMAND)
+    connection.execute(DB_BUMP_WRITE_COUNTER_COMMAND)
+    connection.commit()
+
+    return removed
+
+def archive(before_year: int, db_path: str | Session = DB_DEFAULT_PATH) -> tuple[bool, tuple[int, int] | str]:
+    """Moves the entries dated before before_year to one archive shard per year, returns (expenses, incomes) moved.
+
+    The balance, monthly totals and balance history keep counting the archived entries, which can
+    still be listed, searched, exported and analysed but no longer edited or deleted. The shards are
+    written and committed first, then the entries are removed from the db in one transaction per
+    batch of years (as many as SQLite attaches at once). Running it again finishes an interrupted
+    archive and adds entries dated in an archived year since then to its shard.
+    """
+
+    try:
+        with _connect(db_path) as connection:
+            if connection.in_transaction:
+                raise ValueError("Can not archive inside a grouped session")
+
+            main_file = _main_file(connection)
+            if not main_file:
+                raise ValueError("An in-memory db can not be archived")
+
+            years = sorted(year for (year,) in connection.execute(DB_ARCHIVE_YEARS_COMMAND, (to_day(date(before_year, 1, 1)),)))
+            stem = os.path.splitext(os.path.basename(main_file))[0]
+            batch_size = connection.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+            moved = [0] * len(ARCHIVE_KINDS)
+
+            for start in range(0, len(years), batch_size):
+                batch = years[start:start + batch_size]
+                attached = []
+                try:
+                    for year in batch:
+                        path = os.path.join(os.path.dirname(main_file), ARCHIVE_FILE_NAME.format(stem = stem, year = year))
+                        connection.execute("ATTACH DATABASE ? AS ?", (path, f"shard_{year}"))
+                        attached.append(year)
+
+                    _copy_to_shards(connection, batch)
+                    moved = [total + count for total, count in zip(moved, _remove_archived(connection, batch, stem))]
+                finally:
+                    if connection.in_transaction:
+                        connection.rollback()
+                    for year in attached:
+                        connection.execute("DETACH DATABASE ?", (f"shard_{year}",))
+
+        return True, tuple(moved)
+
+    except sqlite3.Error as e:
+        return False, "Database error"
+
+    except ValueError as e:
+        return False, str(e)
+
+    except Exception as e:
+        return False, "Unexpected error"
+
+# SEARCH DB LOGIC _________________________________________________
+
+SEARCH_DEFAULT_LIMIT = 20
+
+SEARCH_TABLES = {"exp": "expenses", "inc": "incomes"}
+
+DB_SEARCH_MATCHES_COMMAND = """
+    WITH matches AS (
+        SELECT rowid AS description_id, rank FROM descriptions_search WHERE descriptions_search MATCH ?
+    )
+"""
+
+def _search_select(kind: str) -> str:
+    table = SEARCH_TABLES[kind]
+    return f"""SELECT '{kind}', {_record_columns(table)}, matches.rank AS rank
+               FROM matches JOIN {table} ON {table}.description_id = matches.description_id"""
+
+def _search_row_factory(cursor: sqlite3.Cursor, row: tuple) -> Expense | Income:
+    """Turns ('exp' | 'inc', _record_columns..., rank) rows into Expense or Income records."""
+
+    return expense_row_factory(cursor, row[1:6]) if row[0] == "exp" else income_row_factory(cursor, row[1:6])
+
+def _search_index(connection: sqlite3.Connection, query: str, count_query: str, match: str, limit: int,
+                  skip: int) -> tuple[list[tuple], int]:
+    """The next rows of the page from the search index of one db, and how many rows the next index has to skip."""
+
+    rows = connection.execute(query, (match, limit, skip)).fetchall()
+    if rows or not skip:
+        return rows, 0
+    # every match of this index was before the page
+    return rows, skip - connection.execute(count_query, (match,)).fetchone()[0]
+
+def search(match: str, kind: str | None = None, limit: int = SEARCH_DEFAULT_LIMIT, offset: int = 0,
+           db_path: str | Session = DB_DEFAULT_PATH) -> tuple[bool, list[Expense | Income] | str]:
+    """Returns a page of the expenses and incomes (or only one kind, 'exp' or 'inc') whose description matches.
+
+    match is an FTS5 MATCH expression, see filters.compile_search. The best matches come first,
+    entries with equally relevant descriptions are ordered newest first. Every archive shard has its
+    own search index and bm25 ranks from different indexes can not be compared, so the matches of
+    the db come first, then those of each shard from the newest year back, each ranked on its own.
+    """
+
+    try:
+        selects = [_search_select(kind)] if kind is not None else [_search_select(kind) for kind in SEARCH_TABLES]
+        query = (DB_SEARCH_MATCHES_COMMAND + " UNION ALL ".join(selects)
+                 + " ORDER BY rank, day DESC, id DESC LIMIT ? OFFSET ?")
+
+        count_query = DB_SEARCH_MATCHES_COMMAND + f"SELECT COUNT(*) FROM ({' UNION ALL '.join(selects)})"
+
+        with _connect(db_path) as connection:
+            rows, skip = _search_index(connection, query, count_query, match, limit, offset)
+            if len(rows) < limit: # the page goes on in the shards, the older ones are only opened if needed
+                for file in reversed(_archive_files(connection, None, None)):
+                    with closing(_open_connection(ReadOnly(file))) as shard:
+                        page, skip = _search_index(shard, query, count_query, match, limit - len(rows), skip)
+                    rows += page
+                    if len(rows) == limit:
+                        break
+
+        return True, [_search_row_factory(None, row) for row in rows]
+
+    except sqlite3.Error as e:
+        return False, "Database error"
+
+    except Exception as e:
+        return False, "Unexpected error"
@@ -0,0 +1,18 @@
+from datetime import date
+
+# Storage format v2 keeps dates as days since 1970-01-01 and amounts as integer cents.
+# These helpers convert between the python values and what is stored in the db.
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def to_day(value: date) -> int:
+    return value.toordinal() - EPOCH_ORDINAL
+
+def from_day(day: int) -> date:
+    return date.fromordinal(day + EPOCH_ORDINAL)
+
+def to_cents(amount: float) -> int:
+    return round(amount * 100)
+
+def from_cents(cents: int) -> float:
+    return cents / 100
@@ -0,0 +1,276 @@
+import math
+import re
+from datetime import datetime
+from enum import Enum
+from typing import NamedTuple
+
+from db.encoding import to_cents, to_day
+
+# Compiles filter expressions such as
+#     date >= 2024-01-01 and (category = food or description ~ "amazon") and amount > 20
+# into a parameterized SQL WHERE clause. The SQL text is only ever built from the constant
+# fragments below, every value typed by the user ends up in the params tuple.
+
+class FilterError(ValueError):
+    pass
+
+class Filter(NamedTuple):
+    sql: str
+    params: tuple
+    # day numbers (inclusive) outside of which no row can match, None when the filter does not bound the date
+    first_day: int | None = None
+    last_day: int | None = None
+
+    def narrow(self, first_day: int | None, last_day: int | None) -> tuple[int | None, int | None]:
+        """The days between first_day and last_day (inclusive, None for no bound) this filter can match."""
+
+        return _intersect((first_day, last_day), (self.first_day, self.last_day))
+
+Days = tuple[int | None, int | None]
+UNBOUNDED: Days = (None, None)
+
+def _date_bounds(operator: str, day: int) -> Days:
+    return {"=": (day, day), "<": (None, day - 1), "<=": (None, day), ">": (day + 1, None), ">=": (day, None)}.get(operator, UNBOUNDED)
+
+def _intersect(a: Days, b: Days) -> Days:
+    first = b[0] if a[0] is None else a[0] if b[0] is None else max(a[0], b[0])
+    last = b[1] if a[1] is None else a[1] if b[1] is None else min(a[1], b[1])
+    return first, last
+
+def _span(a: Days, b: Days) -> Days:
+    first = None if a[0] is None or b[0] is None else min(a[0], b[0])
+    last = None if a[1] is None or b[1] is None else max(a[1], b[1])
+    return first, last
+
+def _encode_date(value: str) -> int:
+    try:
+        return to_day(datetime.strptime(value, "%Y-%m-%d").date())
+    except ValueError:
+        raise FilterError(f"Invalid date: \"{value}\". Expected YYYY-MM-DD.")
+
+def _encode_amount(value: str) -> int:
+    try:
+        amount = float(value)
+    except ValueError:
+        amount = math.nan
+    if not math.isfinite(amount): # inf and nan have no value in cents
+        raise FilterError(f"Invalid amount: \"{value}\".")
+    return to_cents(amount)
+
+def _encode_id(value: str) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise FilterError(f"Invalid id: \"{value}\".")
+
+def _encode_text(value: str) -> str:
+    return value
+
+def _escape_like(value: str) -> str:
+    return "%" + value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def _comparisons(column: str, operators: tuple[str, ...]) -> dict[str, str]:
+    return {operator: f"{column} {operator} ?" for operator in operators}
+
+ORDER_OPERATORS = ("=", "!=", "<", "<=", ">", ">=")
+
+# descriptions are stored once in the descriptions table, so matching them only scans the distinct texts
+DESCRIPTION_CONDITIONS = {
+    "=": "description_id IN (SELECT id FROM descriptions WHERE text = ?)",
+    "!=": "description_id NOT IN (SELECT id FROM descriptions WHERE text = ?)",
+    "~": "description_id IN (SELECT id FROM descriptions WHERE text LIKE ? ESCAPE '\\')",
+}
+
+# field name -> (SQL condition for each allowed operator, value encoder)
+FIELDS = {
+    "id": (_comparisons("id", ORDER_OPERATORS), _encode_id),
+    "date": (_comparisons("day", ORDER_OPERATORS), _encode_date),
+    "amount": (_comparisons("cents", ORDER_OPERATORS), _encode_amount),
+    "category": (_comparisons("category", ("=", "!=")), _encode_text),
+    "description": (DESCRIPTION_CONDITIONS, _encode_text),
+}
+
+TOKEN_REGEX = re.compile(r"""
+    \s*(?:
+        (?P<paren>[()])
+      | (?P<op><=|>=|!=|=|<|>|~)
+      | "(?P<dquoted>[^"]*)"
+      | '(?P<squoted>[^']*)'
+      | (?P<word>[^\s()<>=!~"']+)
+    )""", re.VERBOSE)
+
+KEYWORDS = {"and", "or", "not"}
+
+def _tokenize(text: str) -> list[tuple[str, str]]:
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+
+    while pos < len(text):
+        match = TOKEN_REGEX.match(text, pos)
+        if match is None:
+            raise FilterError(f"Unexpected character at position {pos}: \"{text[pos:].strip()[:10]}\".")
+        pos = match.end()
+
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind in ("dquoted", "squoted"):
+            tokens.append(("value", value))
+        elif kind == "word" and value.lower() in KEYWORDS:
+            tokens.append((value.lower(), value))
+        else:
+            tokens.append((kind, value))
+
+    return tokens
+
+class _Parser:
+    """Recursive descent parser: or-expressions of and-expressions of (negated) comparisons.
+
+    Every parse method returns the SQL of its expression and the days it can match (see Filter).
+    """
+
+    def __init__(self, tokens: list[tuple[str, str]], categories: type[Enum] | None):
+        self.tokens = tokens
+        self.pos = 0
+        self.categories = categories
+        self.params = []
+
+    def peek(self) -> str | None:
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def take(self, *kinds: str) -> str:
+        if self.peek() not in kinds:
+            found = self.tokens[self.pos][1] if self.pos < len(self.tokens) else "end of filter"
+            raise FilterError(f"Unexpected \"{found}\" in filter.")
+        value = self.tokens[self.pos][1]
+        self.pos += 1
+        return value
+
+    def parse(self) -> tuple[str, Days]:
+        sql, days = self.parse_or()
+        if self.pos != len(self.tokens):
+            self.take() # always raises
+        return sql, days
+
+    def parse_or(self) -> tuple[str, Days]:
+        sql, days = self.parse_and()
+        parts = [sql]
+        while self.peek() == "or":
+            self.take("or")
+            sql, other = self.parse_and()
+            parts.append(sql)
+            days = _span(days, other)
+        return (parts[0] if len(parts) == 1 else "(" + " OR ".join(parts) + ")"), days
+
+    def parse_and(self) -> tuple[str, Days]:
+        sql, days = self.parse_not()
+        parts = [sql]
+        while self.peek() == "and":
+            self.take("and")
+            sql, other = self.parse_not()
+            parts.append(sql)
+            days = _intersect(days, other)
+        return (parts[0] if len(parts) == 1 else "(" + " AND ".join(parts) + ")"), days
+
+    def parse_not(self) -> tuple[str, Days]:
+        if self.peek() == "not":
+            self.take("not")
+            sql, _ = self.parse_not()
+            return "NOT " + sql, UNBOUNDED # the days around a range are not one range
+        if self.peek() == "paren":
+            self.take("paren")
+            sql, days = self.parse_or()
+            if self.take("paren") != ")":
+                raise FilterError("Unbalanced parentheses in filter.")
+            return sql, days
+        return self.parse_comparison()
+
+    def parse_comparison(self) -> tuple[str, Days]:
+        field = self.take("word").lower()
+        if field not in FIELDS:
+            raise FilterError(f"Unknown filter field: \"{field}\". Choose from {list(FIELDS)}.")
+        conditions, encode = FIELDS[field]
+
+        operator = self.take("op")
+        if operator not in conditions:
+            raise FilterError(f"Operator \"{operator}\" can not be used with {field}.")
+
+        value = self.take("word", "value")
+        if field == "category":
+            value = self.encode_category(value)
+        elif operator == "~":
+            value = _escape_like(value)
+        else:
+            value = encode(value)
+
+        self.params.append(value)
+        return conditions[operator], _date_bounds(operator, value) if field == "date" else UNBOUNDED
+
+    def encode_category(self, value: str) -> str:
+        """Categories are stored by enum name, accept either the name or the value in any case."""
+
+        if self.categories is None:
+            return value.upper()
+        for category in self.categories:
+            if value.upper() in (category.name, category.value.upper()):
+                return category.name
+        raise FilterError(f"Invalid category: \"{value}\". Choose from {[category.value for category in self.categories]}.")
+
+def compile_filter(text: str, categories: type[Enum] | None = None) -> Filter:
+    """Compiles a filter expression, raises FilterError if it is not valid.
+
+    Comparisons are "field op value" with fields id, date, amount (=, !=, <, <=, >, >=),
+    category (=, !=) and description (=, !=, ~ for a case insensitive substring match).
+    They can be combined with and, or, not and parentheses. Values with spaces must be quoted.
+    """
+
+    tokens = _tokenize(text)
+    if not tokens:
+        raise FilterError("Empty filter.")
+
+    parser = _Parser(tokens, categories)
+    sql, (first_day, last_day) = parser.parse()
+    return Filter(sql, tuple(parser.params), first_day, last_day)
+
+# Search queries are compiled into an FTS5 MATCH expression in the same spirit: every term is
+# passed to FTS5 as a double quoted string, so nothing the user types is read as FTS5 syntax.
+
+SEARCH_TOKEN_REGEX = re.compile(r'\s*(?:"(?P<phrase>[^"]*)"(?P<phrase_prefix>\*?)|(?P<word>[^\s"]+))')
+
+def _quote_search_term(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+def compile_search(text: str) -> str:
+    """Compiles a search query into an FTS5 MATCH expression, raises FilterError if it is not valid.
+
+    Words match whole words, word* matches words starting with word and "several words" matches
+    them next to each other in that order ("several wo"* also works). An entry has to match every
+    term. Matching ignores case and accents.
+    """
+
+    terms = []
+    pos = 0
+    text = text.rstrip()
+
+    while pos < len(text):
+        match = SEARCH_TOKEN_REGEX.match(text, pos)
+        if match is None:
+            raise FilterError("Unbalanced quotes in search.")
+        pos = match.end()
+
+        if match.group("word") is not None:
+            word = match.group("word")
+            prefix = word.endswith("*")
+            term = word.rstrip("*")
+        else:
+            prefix = bool(match.group("phrase_prefix"))
+            term = match.group("phrase").strip()
+
+        if not term:
+            raise FilterError(f"Empty search term at position {match.start()}.")
+        terms.append(_quote_search_term(term) + ("*" if prefix else ""))
+
+    if not terms:
+        raise FilterError("Empty search.")
+
+    return " ".join(terms)
@@ -0,0 +1,206 @@
+import sqlite3
+from typing import Callable, Sequence
+
+# Schema versions are stored in PRAGMA user_version and upgraded by run_migrations.
+#
+# Upgrade of dbs written with storage format v1 (ISO text dates, REAL amounts, inline descriptions)
+# to format v2 (see schema.sql). Rows are copied in batches that each commit on their own, so other
+# connections keep working during a long migration and an interrupted one resumes where it stopped.
+# The final swap to the new tables happens in one short transaction.
+
+MIGRATION_BATCH_SIZE = 10_000
+
+# frozen copy of the v2 tables, the staging tables are renamed over the v1 ones when the copy is done
+V2_STAGING_STATEMENTS = ("""
+    CREATE TABLE IF NOT EXISTS descriptions (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL UNIQUE
+    )
+""", """
+    CREATE TABLE IF NOT EXISTS expenses_v2 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        day INTEGER NOT NULL,
+        description_id INTEGER REFERENCES descriptions (id),
+        category TEXT,
+        cents INTEGER NOT NULL
+    )
+""", """
+    CREATE TABLE IF NOT EXISTS incomes_v2 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        day INTEGER NOT NULL,
+        description_id INTEGER REFERENCES descriptions (id),
+        category TEXT,
+        cents INTEGER NOT NULL
+    )
+""")
+
+V1_TABLES = ("expenses", "incomes")
+
+COPY_DESCRIPTIONS_COMMAND = """
+    INSERT INTO descriptions (text)
+    SELECT DISTINCT COALESCE(description, '')
+    FROM (SELECT description FROM {table} WHERE id > ? ORDER BY id LIMIT ?)
+    WHERE true
+    ON CONFLICT (text) DO NOTHING
+"""
+
+COPY_ROWS_COMMAND = """
+    INSERT INTO {table}_v2 (id, day, description_id, category, cents)
+    SELECT t.id,
+           CAST(strftime('%s', t.date) AS INTEGER) / 86400,
+           d.id,
+           t.category,
+           CAST(ROUND(t.amount * 100) AS INTEGER)
+    FROM {table} AS t JOIN descriptions AS d ON d.text = COALESCE(t.description, '')
+    WHERE t.id > ?
+    ORDER BY t.id
+    LIMIT ?
+"""
+
+# v1 clients can keep writing while the batches are copied, so the final swap transaction brings the
+# rows copied earlier up to date: rows deleted since are dropped, edited or new ones are (re)copied.
+# The diff only reads the rows that did not change.
+RESYNC_STATEMENTS = ("""
+    INSERT INTO descriptions (text)
+    SELECT DISTINCT COALESCE(description, '') FROM {table} WHERE true
+    ON CONFLICT (text) DO NOTHING
+""", """
+    DELETE FROM {table}_v2 WHERE id NOT IN (SELECT id FROM {table})
+""", """
+    INSERT INTO {table}_v2 (id, day, description_id, category, cents)
+    SELECT t.id,
+           CAST(strftime('%s', t.date) AS INTEGER) / 86400,
+           d.id,
+           t.category,
+           CAST(ROUND(t.amount * 100) AS INTEGER)
+    FROM {table} AS t JOIN descriptions AS d ON d.text = COALESCE(t.description, '')
+    WHERE true
+    ON CONFLICT (id) DO UPDATE SET day = excluded.day, description_id = excluded.description_id,
+                                   category = excluded.category, cents = excluded.cents
+    WHERE (day, description_id, category, cents) IS NOT (excluded.day, excluded.description_id, excluded.category, excluded.cents)
+""")
+
+BALANCE_SWAP_STATEMENTS = ("""
+    CREATE TABLE balance_v2 (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        curr_balance INTEGER NOT NULL DEFAULT 0
+    )
+""", """
+    INSERT INTO balance_v2 (id, curr_balance) SELECT id, CAST(ROUND(curr_balance * 100) AS INTEGER) FROM balance
+""", """
+    DROP TABLE balance
+""", """
+    ALTER TABLE balance_v2 RENAME TO balance
+""")
+
+def get_user_version(connection: sqlite3.Connection) -> int:
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+def run_migrations(connection: sqlite3.Connection, migrations: Sequence[tuple[int, Callable[[sqlite3.Connection], None]]]):
+    """Runs, in order, the migrations newer than the user_version of the db.
+
+    migrations are (version, function) pairs sorted by version. Each function is committed
+    together with its new user_version, so an interrupted upgrade resumes from the first
+    migration that did not finish. Functions may run again after a crash and must be idempotent.
+    """
+
+    current = get_user_version(connection)
+    if current > migrations[-1][0]:
+        raise ValueError(f"Db schema version {current} is newer than this program supports ({migrations[-1][0]})")
+
+    for version, migrate in migrations:
+        if version <= current:
+            continue
+
+        try:
+            migrate(connection)
+            connection.execute(f"PRAGMA user_version = {int(version)}")
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        current = version
+
+def split_script(script: str) -> list[str]:
+    """Splits a sql script into its statements, so it can run inside a transaction (executescript commits first)."""
+
+    statements = []
+    current = ""
+
+    for line in script.splitlines(keepends = True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ""
+
+    return statements
+
+def is_v1_format(connection: sqlite3.Connection) -> bool:
+    return connection.execute("SELECT 1 FROM pragma_table_info('expenses') WHERE name = 'date'").fetchone() is not None
+
+def _copy_batch(connection: sqlite3.Connection, table: str, batch_size: int) -> int:
+    """Copies the next batch of not yet migrated rows of table into its staging table, returns how many were copied."""
+
+    last_id = connection.execute(f"SELECT IFNULL(MAX(id), 0) FROM {table}_v2").fetchone()[0]
+    connection.execute(COPY_DESCRIPTIONS_COMMAND.format(table = table), (last_id, batch_size))
+    return connection.execute(COPY_ROWS_COMMAND.format(table = table), (last_id, batch_size)).rowcount
+
+def _swap_tables(connection: sqlite3.Connection, schema: str, rebuild_rollups: Callable[[sqlite3.Cursor], None]):
+    sequences = dict(connection.execute("SELECT name, seq FROM sqlite_sequence"))
+
+    connection.execute("DROP TABLE IF EXISTS monthly_totals") # v1 totals are REAL, recreated by the schema
+    for statement in BALANCE_SWAP_STATEMENTS:
+        connection.execute(statement)
+
+    for table in V1_TABLES:
+        # dropping a table does not fire its delete triggers, so the balance is left alone
+        connection.execute(f"DROP TABLE {table}")
+        connection.execute(f"ALTER TABLE {table}_v2 RENAME TO {table}")
+        connection.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequences.get(table, 0), table))
+
+    for statement in split_script(schema):
+        connection.execute(statement)
+    rebuild_rollups(connection.cursor())
+
+def migrate_v1_to_v2(connection: sqlite3.Connection, schema: str, rebuild_rollups: Callable[[sqlite3.Cursor], None],
+                     batch_size: int = MIGRATION_BATCH_SIZE):
+    """Converts a v1 db to storage format v2. Safe to run from several processes at once and to resume."""
+
+    for statement in V2_STAGING_STATEMENTS:
+        connection.execute(statement)
+    connection.commit()
+
+    for table in V1_TABLES:
+        while True:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # another process may have finished the migration in the meantime
+                copied = _copy_batch(connection, table, batch_size) if is_v1_format(connection) else 0
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+
+            if copied < batch_size:
+                break
+
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        if is_v1_format(connection):
+            for table in V1_TABLES:
+                for statement in RESYNC_STATEMENTS: # rows written by v1 clients since their batch was copied
+                    connection.execute(statement.format(table = table))
+            _swap_tables(connection, schema, rebuild_rollups)
+        else:
+            for table in V1_TABLES:
+                connection.execute(f"DROP TABLE IF EXISTS {table}_v2")
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+    # give the space of the dropped v1 tables back to the file system, can wait for a later run if the db is busy
+    try:
+        connection.execute("VACUUM")
+    except sqlite3.OperationalError:
+        pass
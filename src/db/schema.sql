@@ -1,20 +1,291 @@
+-- storage format v2: dates are days since 1970-01-01, amounts are integer cents and
+-- descriptions are stored once in the descriptions table and referenced by id.
+
+CREATE TABLE IF NOT EXISTS descriptions (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL UNIQUE
+);
+
 CREATE TABLE IF NOT EXISTS expenses (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    date TEXT NOT NULL,
-    description TEXT,
+    day INTEGER NOT NULL,
+    description_id INTEGER REFERENCES descriptions (id),
     category TEXT,
-    amount REAL NOT NULL
+    cents INTEGER NOT NULL
 );
 
 CREATE TABLE IF NOT EXISTS incomes (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    date TEXT NOT NULL,
-    description TEXT,
+    day INTEGER NOT NULL,
+    description_id INTEGER REFERENCES descriptions (id),
     category TEXT,
-    amount REAL NOT NULL
+    cents INTEGER NOT NULL
 );
 
 CREATE TABLE IF NOT EXISTS balance (
     id INTEGER PRIMARY KEY CHECK (id = 1),
-    curr_balance REAL NOT NULL DEFAULT 0
+    curr_balance INTEGER NOT NULL DEFAULT 0 -- cents
+);
+
+-- indexes for date range, category and monthly lookups. They are created with IF NOT EXISTS
+-- so running this script again on an existing db upgrades it in place.
+
+CREATE INDEX IF NOT EXISTS expenses_date_idx ON expenses (day);
+CREATE INDEX IF NOT EXISTS expenses_category_date_idx ON expenses (category, day);
+CREATE INDEX IF NOT EXISTS expenses_month_idx ON expenses (strftime('%Y-%m', day * 86400, 'unixepoch'));
+
+CREATE INDEX IF NOT EXISTS incomes_date_idx ON incomes (day);
+CREATE INDEX IF NOT EXISTS incomes_category_date_idx ON incomes (category, day);
+CREATE INDEX IF NOT EXISTS incomes_month_idx ON incomes (strftime('%Y-%m', day * 86400, 'unixepoch'));
+
+-- rows by description, used to go from the descriptions matched by a search to their entries
+CREATE INDEX IF NOT EXISTS expenses_description_idx ON expenses (description_id);
+CREATE INDEX IF NOT EXISTS incomes_description_idx ON incomes (description_id);
+
+-- monthly totals per category, kept up to date by the triggers below so summaries never rescan
+-- the expenses/incomes tables. kind is 'exp' or 'inc', month is YYYY-MM, total is in cents.
+
+CREATE TABLE IF NOT EXISTS monthly_totals (
+    kind TEXT NOT NULL,
+    month TEXT NOT NULL,
+    category TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, month, category)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS expenses_rollup_insert AFTER INSERT ON expenses BEGIN
+    INSERT INTO monthly_totals (kind, month, category, total, count)
+    VALUES ('exp', strftime('%Y-%m', NEW.day * 86400, 'unixepoch'), COALESCE(NEW.category, ''), NEW.cents, 1)
+    ON CONFLICT (kind, month, category) DO UPDATE SET total = total + excluded.total, count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS expenses_rollup_delete AFTER DELETE ON expenses
+WHEN NOT EXISTS (SELECT 1 FROM archiving) AND NOT EXISTS (SELECT 1 FROM bulk_writing) BEGIN
+    UPDATE monthly_totals SET total = total - OLD.cents, count = count - 1
+    WHERE kind = 'exp' AND month = strftime('%Y-%m', OLD.day * 86400, 'unixepoch') AND category = COALESCE(OLD.category, '');
+    DELETE FROM monthly_totals
+    WHERE kind = 'exp' AND month = strftime('%Y-%m', OLD.day * 86400, 'unixepoch') AND category = COALESCE(OLD.category, '') AND count = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS expenses_rollup_update AFTER UPDATE OF day, category, cents ON expenses
+WHEN NOT EXISTS (SELECT 1 FROM bulk_writing) BEGIN
+    UPDATE monthly_totals SET total = total - OLD.cents, count = count - 1
+    WHERE kind = 'exp' AND month = strftime('%Y-%m', OLD.day * 86400, 'unixepoch') AND category = COALESCE(OLD.category, '');
+    DELETE FROM monthly_totals
+    WHERE kind = 'exp' AND month = strftime('%Y-%m', OLD.day * 86400, 'unixepoch') AND category = COALESCE(OLD.category, '') AND count = 0;
+    INSERT INTO monthly_totals (kind, month, category, total, count)
+    VALUES ('exp', strftime('%Y-%m', NEW.day * 86400, 'unixepoch'), COALESCE(NEW.category, ''), NEW.cents, 1)
+    ON CONFLICT (kind, month, category) DO UPDATE SET total = total + excluded.total, count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incomes_rollup_insert AFTER INSERT ON incomes BEGIN
+    INSERT INTO monthly_totals (kind, month, category, total, count)
+    VALUES ('inc', strftime('%Y-%m', NEW.day * 86400, 'unixepoch'), COALESCE(NEW.category, ''), NEW.cents, 1)
+    ON CONFLICT (kind, month, category) DO UPDATE SET total = total + excluded.total, count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incomes_rollup_delete AFTER DELETE ON incomes
+WHEN NOT EXISTS (SELECT 1 FROM archiving) AND NOT EXISTS (SELECT 1 FROM bulk_writing) BEGIN
+    UPDATE monthly_totals SET total = total - OLD.cents, count = count - 1
+    WHERE kind = 'inc' AND month = strftime('%Y-%m', OLD.day * 86400, 'unixepoch') AND category = COALESCE(OLD.category, '');
+    DELETE FROM monthly_totals
+    WHERE kind = 'inc' AND month = strftime('%Y-%m', OLD.day * 86400, 'unixepoch') AND category = COALESCE(OLD.category, '') AND count = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incomes_rollup_update AFTER UPDATE OF day, category, cents ON incomes
+WHEN NOT EXISTS (SELECT 1 FROM bulk_writing) BEGIN
+    UPDATE monthly_totals SET total = total - OLD.cents, count = count - 1
+    WHERE kind = 'inc' AND month = strftime('%Y-%m', OLD.day * 86400, 'unixepoch') AND category = COALESCE(OLD.category, '');
+    DELETE FROM monthly_totals
+    WHERE kind = 'inc' AND month = strftime('%Y-%m', OLD.day * 86400, 'unixepoch') AND category = COALESCE(OLD.category, '') AND count = 0;
+    INSERT INTO monthly_totals (kind, month, category, total, count)
+    VALUES ('inc', strftime('%Y-%m', NEW.day * 86400, 'unixepoch'), COALESCE(NEW.category, ''), NEW.cents, 1)
+    ON CONFLICT (kind, month, category) DO UPDATE SET total = total + excluded.total, count = count + 1;
+END;
+
+-- the balance follows every write to expenses/incomes inside the writing statement itself,
+-- so no caller needs to read it, compute the new value and write it back.
+
+CREATE TRIGGER IF NOT EXISTS expenses_balance_insert AFTER INSERT ON expenses BEGIN
+    UPDATE balance SET curr_balance = curr_balance - NEW.cents WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS expenses_balance_delete AFTER DELETE ON expenses
+WHEN NOT EXISTS (SELECT 1 FROM archiving) AND NOT EXISTS (SELECT 1 FROM bulk_writing) BEGIN
+    UPDATE balance SET curr_balance = curr_balance + OLD.cents WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS expenses_balance_update AFTER UPDATE OF cents ON expenses
+WHEN NOT EXISTS (SELECT 1 FROM bulk_writing) BEGIN
+    UPDATE balance SET curr_balance = curr_balance + OLD.cents - NEW.cents WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incomes_balance_insert AFTER INSERT ON incomes BEGIN
+    UPDATE balance SET curr_balance = curr_balance + NEW.cents WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incomes_balance_delete AFTER DELETE ON incomes
+WHEN NOT EXISTS (SELECT 1 FROM archiving) AND NOT EXISTS (SELECT 1 FROM bulk_writing) BEGIN
+    UPDATE balance SET curr_balance = curr_balance - OLD.cents WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incomes_balance_update AFTER UPDATE OF cents ON incomes
+WHEN NOT EXISTS (SELECT 1 FROM bulk_writing) BEGIN
+    UPDATE balance SET curr_balance = curr_balance - OLD.cents + NEW.cents WHERE id = 1;
+END;
+
+-- net change per day and its running total (cumulative), so the balance at any past date is one
+-- index lookup. Only days with entries have a row. Writes update their own day and the running
+-- total of the days after it, which is a single row for entries dated today.
+
+CREATE TABLE IF NOT EXISTS daily_balance (
+    day INTEGER PRIMARY KEY,
+    net INTEGER NOT NULL DEFAULT 0,
+    cumulative INTEGER NOT NULL DEFAULT 0
 );
+
+-- bulk imports hold a row here inside their own transaction, the insert triggers then skip the
+-- per row running total (and search index) updates and the import catches up once at the end.
+CREATE TABLE IF NOT EXISTS daily_balance_deferred (
+    id INTEGER PRIMARY KEY
+);
+
+-- archive holds a row here while it deletes the entries it moved to the archive shards. They are
+-- still part of the history, so the delete triggers leave the balance, rollups and running totals alone.
+CREATE TABLE IF NOT EXISTS archiving (
+    id INTEGER PRIMARY KEY
+);
+
+-- bulk edits and deletes hold a row here inside their own transaction. The update and delete triggers
+-- then skip their rows, the writer updates the balance, rollups and running totals once for all of them.
+CREATE TABLE IF NOT EXISTS bulk_writing (
+    id INTEGER PRIMARY KEY
+);
+
+CREATE TRIGGER IF NOT EXISTS expenses_daily_insert AFTER INSERT ON expenses
+WHEN NOT EXISTS (SELECT 1 FROM daily_balance_deferred) BEGIN
+    INSERT INTO daily_balance (day, net, cumulative)
+    VALUES (NEW.day, 0, COALESCE((SELECT cumulative FROM daily_balance WHERE day < NEW.day ORDER BY day DESC LIMIT 1), 0))
+    ON CONFLICT (day) DO NOTHING;
+    UPDATE daily_balance SET net = net - NEW.cents WHERE day = NEW.day;
+    UPDATE daily_balance SET cumulative = cumulative - NEW.cents WHERE day >= NEW.day;
+END;
+
+CREATE TRIGGER IF NOT EXISTS expenses_daily_delete AFTER DELETE ON expenses
+WHEN NOT EXISTS (SELECT 1 FROM archiving) AND NOT EXISTS (SELECT 1 FROM bulk_writing) BEGIN
+    UPDATE daily_balance SET net = net + OLD.cents WHERE day = OLD.day;
+    UPDATE daily_balance SET cumulative = cumulative + OLD.cents WHERE day >= OLD.day;
+    DELETE FROM daily_balance WHERE day = OLD.day AND net = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS expenses_daily_update AFTER UPDATE OF day, cents ON expenses
+WHEN NOT EXISTS (SELECT 1 FROM bulk_writing) BEGIN
+    UPDATE daily_balance SET net = net + OLD.cents WHERE day = OLD.day;
+    UPDATE daily_balance SET cumulative = cumulative + OLD.cents WHERE day >= OLD.day;
+    DELETE FROM daily_balance WHERE day = OLD.day AND net = 0;
+    INSERT INTO daily_balance (day, net, cumulative)
+    VALUES (NEW.day, 0, COALESCE((SELECT cumulative FROM daily_balance WHERE day < NEW.day ORDER BY day DESC LIMIT 1), 0))
+    ON CONFLICT (day) DO NOTHING;
+    UPDATE daily_balance SET net = net - NEW.cents WHERE day = NEW.day;
+    UPDATE daily_balance SET cumulative = cumulative - NEW.cents WHERE day >= NEW.day;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incomes_daily_insert AFTER INSERT ON incomes
+WHEN NOT EXISTS (SELECT 1 FROM daily_balance_deferred) BEGIN
+    INSERT INTO daily_balance (day, net, cumulative)
+    VALUES (NEW.day, 0, COALESCE((SELECT cumulative FROM daily_balance WHERE day < NEW.day ORDER BY day DESC LIMIT 1), 0))
+    ON CONFLICT (day) DO NOTHING;
+    UPDATE daily_balance SET net = net + NEW.cents WHERE day = NEW.day;
+    UPDATE daily_balance SET cumulative = cumulative + NEW.cents WHERE day >= NEW.day;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incomes_daily_delete AFTER DELETE ON incomes
+WHEN NOT EXISTS (SELECT 1 FROM archiving) AND NOT EXISTS (SELECT 1 FROM bulk_writing) BEGIN
+    UPDATE daily_balance SET net = net - OLD.cents WHERE day = OLD.day;
+    UPDATE daily_balance SET cumulative = cumulative - OLD.cents WHERE day >= OLD.day;
+    DELETE FROM daily_balance WHERE day = OLD.day AND net = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incomes_daily_update AFTER UPDATE OF day, cents ON incomes
+WHEN NOT EXISTS (SELECT 1 FROM bulk_writing) BEGIN
+    UPDATE daily_balance SET net = net - OLD.cents WHERE day = OLD.day;
+    UPDATE daily_balance SET cumulative = cumulative - OLD.cents WHERE day >= OLD.day;
+    DELETE FROM daily_balance WHERE day = OLD.day AND net = 0;
+    INSERT INTO daily_balance (day, net, cumulative)
+    VALUES (NEW.day, 0, COALESCE((SELECT cumulative FROM daily_balance WHERE day < NEW.day ORDER BY day DESC LIMIT 1), 0))
+    ON CONFLICT (day) DO NOTHING;
+    UPDATE daily_balance SET net = net + NEW.cents WHERE day = NEW.day;
+    UPDATE daily_balance SET cumulative = cumulative + NEW.cents WHERE day >= NEW.day;
+END;
+
+-- full text index over the descriptions. It stores no copy of the texts (they are read from the
+-- descriptions table) and the prefix indexes keep "word*" queries from scanning the whole vocabulary.
+-- Expenses/incomes only reference a description by id, so adding, editing or deleting an entry
+-- only ever touches this index through a new description. Bulk imports index theirs in one statement.
+
+CREATE VIRTUAL TABLE IF NOT EXISTS descriptions_search USING fts5 (
+    text,
+    content = 'descriptions',
+    content_rowid = 'id',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS descriptions_search_insert AFTER INSERT ON descriptions
+WHEN NOT EXISTS (SELECT 1 FROM daily_balance_deferred) BEGIN
+    INSERT INTO descriptions_search (rowid, text) VALUES (NEW.id, NEW.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS descriptions_search_delete AFTER DELETE ON descriptions BEGIN
+    INSERT INTO descriptions_search (descriptions_search, rowid, text) VALUES ('delete', OLD.id, OLD.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS descriptions_search_update AFTER UPDATE OF text ON descriptions BEGIN
+    INSERT INTO descriptions_search (descriptions_search, rowid, text) VALUES ('delete', OLD.id, OLD.text);
+    INSERT INTO descriptions_search (rowid, text) VALUES (NEW.id, NEW.text);
+END;
+
+-- counts the writes that can change a report (balance, totals, balance history), so cached
+-- report results (see the report cache in database.py) are checked with a single row read.
+-- Every insert, delete and amount change already updates the balance row, so the counter
+-- follows that row plus the date and category edits, which leave the balance alone.
+
+CREATE TABLE IF NOT EXISTS write_counter (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    db_id INTEGER NOT NULL DEFAULT (random()), -- tells a db apart from a new one created at the same path
+    value INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO write_counter (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+CREATE TRIGGER IF NOT EXISTS balance_write_counter AFTER UPDATE ON balance BEGIN
+    UPDATE write_counter SET value = value + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS expenses_write_counter AFTER UPDATE OF day, category ON expenses BEGIN
+    UPDATE write_counter SET value = value + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incomes_write_counter AFTER UPDATE OF day, category ON incomes BEGIN
+    UPDATE write_counter SET value = value + 1 WHERE id = 1;
+END;
+
+-- entries dated before a year can be moved by archive (see database.py) to one shard file per year,
+-- next to this db. A shard is a small db of its own with the entries, their descriptions and a
+-- search index. Reads open the shards of the years their date range reaches.
+
+CREATE TABLE IF NOT EXISTS archives (
+    year INTEGER PRIMARY KEY,
+    file TEXT NOT NULL -- relative to the directory of this db
+);
+
+-- totals of the archived entries per day and category, so the rollups and running totals can be
+-- rebuilt without opening the shards. kind is 'exp' or 'inc', total is in cents.
+CREATE TABLE IF NOT EXISTS archived_totals (
+    kind TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (kind, day, category)
+) WITHOUT ROWID;
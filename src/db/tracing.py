@@ -0,0 +1,368 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from types import ModuleType
+from typing import Callable
+
+# Opt-in instrumentation of the db functions and CLI handlers. enable() wraps the public functions
+# of db.database (and whatever else is passed to instrument) in place, so calls between them are
+# timed too, and disable() puts the originals back. Nothing is wrapped while tracing is off.
+#
+# Per operation it records a latency histogram, the time spent in the operation itself (without the
+# traced operations it called), the SQLite statements it ran (as reported by the sqlite3 trace
+# callback, which also reports the steps of the triggers they fire), the rows they wrote
+# (connection.total_changes, trigger writes included) and the rows fetched from their cursors.
+# An operation that returns (True, iterator) lasts until the iterator is exhausted or closed, the
+# rows its caller reads from it are counted and the time spent producing them is its own.
+
+TRACE_ENV_VAR = "FINANCES_TRACE"
+SUMMARY_DESTINATION = "-" # print a summary on stderr, any other destination is a Prometheus text file
+
+# upper bounds in seconds, the last bucket is +Inf
+HISTOGRAM_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class OperationStats:
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.own = 0.0
+        self.statements = 0
+        self.rows_written = 0
+        self.rows_read = 0
+
+    def observe(self, duration: float, own: float, statements: int, rows_written: int, rows_read: int = 0):
+        self.count += 1
+        self.total += duration
+        self.own += own
+        self.statements += statements
+        self.rows_written += rows_written
+        self.rows_read += rows_read
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if duration <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q quantile, inf when it is above the last bound."""
+
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return HISTOGRAM_BUCKETS[i] if i < len(HISTOGRAM_BUCKETS) else float("inf")
+        return 0.0
+
+class _Frame:
+    __slots__ = ("name", "start", "active", "children", "statements", "rows_written", "rows_read")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.active = 0.0 # time the frame was on the stack, a stream is only there while it produces rows
+        self.children = 0.0
+        self.statements = 0
+        self.rows_written = 0
+        self.rows_read = 0
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.destination = SUMMARY_DESTINATION
+        self.operations: dict[str, OperationStats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._originals: list[tuple[ModuleType, str, Callable]] = []
+
+    def _stack(self) -> list[_Frame]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def span(self, name: str):
+        """Times the block as operation name, nested inside the operation in progress on this thread."""
+
+        frame = _Frame(name)
+        try:
+            with self._resumed(frame):
+                yield
+        finally:
+            self._finish(frame)
+
+    @contextmanager
+    def _resumed(self, frame: _Frame):
+        """Puts frame on top of this thread's stack for the block, the block's time is taken out of the parent's own time."""
+
+        stack = self._stack()
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            active = time.perf_counter() - start
+            stack.pop()
+            frame.active += active
+            if stack:
+                stack[-1].children += active
+
+    def _finish(self, frame: _Frame):
+        self.record(frame.name, time.perf_counter() - frame.start, frame.active - frame.children,
+                    frame.statements, frame.rows_written, frame.rows_read)
+
+    def _stream(self, frame: _Frame, rows: Iterator) -> Iterator:
+        """Yields the items of rows with frame resumed while each one is produced, frame ends with the stream."""
+
+        try:
+            while True:
+                with self._resumed(frame):
+                    try:
+                        item = next(rows)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            close = getattr(rows, "close", None)
+            if close is not None: # an abandoned stream releases its cursor and connection inside the operation
+                with self._resumed(frame):
+                    close()
+            self._finish(frame)
+
+    def wrap(self, name: str, function: Callable) -> Callable:
+        @wraps(function)
+        def traced(*args, **kwargs):
+            if not self.enabled:
+                return function(*args, **kwargs)
+
+            frame = _Frame(name)
+            try:
+                with self._resumed(frame):
+                    result = function(*args, **kwargs)
+            except BaseException:
+                self._finish(frame)
+                raise
+
+            if isinstance(result, tuple) and len(result) == 2 and result[0] is True and isinstance(result[1], Iterator):
+                return True, self._stream(frame, result[1])
+            self._finish(frame)
+            return result
+
+        traced.__wrapped_by_tracer__ = True
+        return traced
+
+    def record(self, name: str, duration: float, own: float, statements: int = 0, rows_written: int = 0, rows_read: int = 0):
+        with self._lock:
+            stats = self.operations.get(name)
+            if stats is None:
+                stats = self.operations[name] = OperationStats()
+            stats.observe(duration, own, statements, rows_written, rows_read)
+
+    def count_statement(self, sql: str):
+        """sqlite3 trace callback, adds the statement to the innermost traced operation of this thread."""
+
+        stack = self._stack() if self.enabled else None
+        if stack:
+            stack[-1].statements += 1
+
+    def add_rows_written(self, rows: int):
+        stack = self._stack() if self.enabled else None
+        if stack:
+            stack[-1].rows_written += rows
+
+    def add_rows_read(self, rows: int):
+        stack = self._stack() if self.enabled else None
+        if stack:
+            stack[-1].rows_read += rows
+
+    def instrument(self, module: ModuleType, prefix: str, include: Callable[[str], bool]):
+        """Wraps the functions of module whose name passes include, recorded as prefix + name."""
+
+        for name, value in list(vars(module).items()):
+            if (callable(value) and getattr(value, "__module__", None) == module.__name__ and include(name)
+                    and not isinstance(value, type) and not getattr(value, "__wrapped_by_tracer__", False)):
+                self._originals.append((module, name, value))
+                setattr(module, name, self.wrap(prefix + name, value))
+
+    def reset(self):
+        with self._lock:
+            self.operations.clear()
+
+tracer = Tracer()
+
+# helpers of db.database that are not operations of their own (row factories run once per row)
+DB_EXCLUDED = {"cached_report", "use_session", "use_read_only", "expense_row_factory", "income_row_factory",
+               "get_profile", "set_profile", "cache_stats", "set_cache_size", "clear_cache"}
+
+def enable(destination: str = SUMMARY_DESTINATION):
+    """Starts tracing the db functions, report() later writes to destination ("-" or a Prometheus text file)."""
+
+    import db.database as db
+
+    tracer.destination = destination
+    if not tracer.enabled:
+        tracer.instrument(db, "db.", lambda name: not name.startswith("_") and name not in DB_EXCLUDED)
+        tracer.enabled = True
+
+def enable_from_env() -> bool:
+    """Enables tracing when FINANCES_TRACE is set ("1" or "-" for a summary, otherwise a Prometheus file path)."""
+
+    destination = os.environ.get(TRACE_ENV_VAR)
+    if not destination or destination == "0":
+        return False
+    enable(SUMMARY_DESTINATION if destination == "1" else destination)
+    return True
+
+def instrument(module: ModuleType, prefix: str, include: Callable[[str], bool]):
+    """Traces the functions of another module (e.g. the CLI handlers) until disable()."""
+
+    tracer.instrument(module, prefix, include)
+
+def disable():
+    """Stops tracing and puts the original functions back, the recorded stats are kept."""
+
+    tracer.enabled = False
+    while tracer._originals:
+        module, name, function = tracer._originals.pop()
+        setattr(module, name, function)
+
+def enabled() -> bool:
+    return tracer.enabled
+
+def span(name: str):
+    """Times the block as operation name while tracing, does nothing otherwise."""
+
+    return tracer.span(name) if tracer.enabled else nullcontext()
+
+def attach(connection):
+    """Counts the statements run on connection for the traced operations, returns it."""
+
+    connection.set_trace_callback(tracer.count_statement)
+    return connection
+
+class _CountedCursor:
+    """Cursor that adds the rows fetched through it to the traced operation in progress."""
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        object.__setattr__(self, "_cursor", cursor)
+
+    def execute(self, *args):
+        self._cursor.execute(*args)
+        return self
+
+    def executemany(self, *args):
+        self._cursor.executemany(*args)
+        return self
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            tracer.add_rows_read(1)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        tracer.add_rows_read(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        tracer.add_rows_read(len(rows))
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self._cursor)
+        tracer.add_rows_read(1)
+        return row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value): # row_factory, arraysize
+        setattr(self._cursor, name, value)
+
+class _CountedConnection:
+    """Connection whose cursors count the rows fetched through them, see count_reads."""
+
+    def __init__(self, connection: sqlite3.Connection):
+        object.__setattr__(self, "_connection", connection)
+
+    def cursor(self, *args):
+        return _CountedCursor(self._connection.cursor(*args))
+
+    def execute(self, *args):
+        return _CountedCursor(self._connection.execute(*args))
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._connection, name, value)
+
+def count_reads(connection: sqlite3.Connection | sqlite3.Cursor):
+    """The connection or cursor wrapped so the rows fetched through it are counted as read by the traced operations."""
+
+    return _CountedCursor(connection) if isinstance(connection, sqlite3.Cursor) else _CountedConnection(connection)
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def prometheus_text() -> str:
+    """The recorded stats in the Prometheus text exposition format."""
+
+    lines = ["# HELP finances_operation_duration_seconds Latency of the traced operations.",
+             "# TYPE finances_operation_duration_seconds histogram"]
+    with tracer._lock:
+        operations = sorted(tracer.operations.items())
+
+    for name, stats in operations:
+        label = f"operation=\"{_label(name)}\""
+        cumulative = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS + ("+Inf",), stats.buckets):
+            cumulative += count
+            lines.append(f"finances_operation_duration_seconds_bucket{{{label},le=\"{bound}\"}} {cumulative}")
+        lines.append(f"finances_operation_duration_seconds_sum{{{label}}} {stats.total}")
+        lines.append(f"finances_operation_duration_seconds_count{{{label}}} {stats.count}")
+
+    for metric, help_text, attribute in (
+            ("finances_operation_own_seconds_total", "Time spent in the operation itself, without the traced operations it called.", "own"),
+            ("finances_operation_statements_total", "SQLite statements run by the operation, trigger steps included.", "statements"),
+            ("finances_operation_rows_written_total", "Rows written by the operation, trigger writes included.", "rows_written"),
+            ("finances_operation_rows_read_total", "Rows fetched by the operation, streamed rows included.", "rows_read")):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for name, stats in operations:
+            lines.append(f"{metric}{{operation=\"{_label(name)}\"}} {getattr(stats, attribute)}")
+
+    return "\n".join(lines) + "\n"
+
+def summary() -> str:
+    with tracer._lock:
+        operations = sorted(tracer.operations.items(), key = lambda item: item[1].total, reverse = True)
+
+    lines = [f"{'operation':<32} {'calls':>6} {'total ms':>10} {'own ms':>10} {'p50 ms':>8} {'p95 ms':>8} {'stmts':>7} {'written':>8} {'read':>8}"]
+    for name, stats in operations:
+        lines.append(f"{name:<32} {stats.count:>6} {stats.total * 1000:>10.2f} {stats.own * 1000:>10.2f} "
+                     f"{stats.quantile(0.5) * 1000:>8.2f} {stats.quantile(0.95) * 1000:>8.2f} {stats.statements:>7} "
+                     f"{stats.rows_written:>8} {stats.rows_read:>8}")
+    lines.append("(p50/p95 are histogram bucket bounds)")
+    return "\n".join(lines) + "\n"
+
+def report():
+    """Writes the summary to stderr or the Prometheus text to the file given to enable."""
+
+    if tracer.destination == SUMMARY_DESTINATION:
+        sys.stderr.write(summary())
+    else:
+        with open(tracer.destination, "w") as outf:
+            outf.write(prometheus_text())
@@ -0,0 +1,140 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import db.database as db
+from db.database import DB_DEFAULT_PATH, Session
+from internal_libs.expense import Expense
+from internal_libs.income import Income
+
+GROUP_DEFAULT_SIZE = 500 # max rows committed together
+GROUP_DEFAULT_WAIT = 0.005 # seconds a group stays open for more rows after its first one
+
+_STOP = object()
+
+class GroupWriter:
+    """Background thread that inserts queued expenses/incomes with group commits.
+
+    Producers call add_expense/add_income from any thread and get a Future that resolves to the
+    same bool the db function returns, once the commit holding their row is done. A group closes
+    when it has max_group rows or max_wait seconds after its first row, so many producers share
+    one commit (and one sync to disk) instead of queueing on the db lock one commit each.
+    Each row runs in its own savepoint, an invalid row fails alone without affecting its group.
+    A row that raises fails its own future with the error, a failed commit fails the whole group,
+    and the writer goes on with the next group either way.
+    """
+
+    def __init__(self, db_path: str = DB_DEFAULT_PATH, max_group: int = GROUP_DEFAULT_SIZE, max_wait: float = GROUP_DEFAULT_WAIT):
+        self.db_path = db_path
+        self.max_group = max_group
+        self.max_wait = max_wait
+        self.groups_committed = 0
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(target = self._run, name = "db-group-writer", daemon = True)
+        self._thread.start()
+
+    def add_expense(self, expense: Expense) -> Future:
+        return self._submit(db.add_expense, expense)
+
+    def add_income(self, income: Income) -> Future:
+        return self._submit(db.add_income, income)
+
+    def _submit(self, add_function, record: Expense | Income) -> Future:
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError("GroupWriter is closed")
+            self._queue.put((add_function, record, future))
+        return future
+
+    def close(self):
+        """Commits everything queued so far and stops the writer thread."""
+
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        session = None
+        stopping = False
+
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            group = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(group) < self.max_group:
+                try:
+                    item = self._queue.get(timeout = max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                group.append(item)
+
+            try:
+                if session is None:
+                    session = Session(self.db_path)
+            except sqlite3.Error:
+                for _, _, future in group:
+                    future.set_result(False)
+                continue
+            except Exception as e:
+                for _, _, future in group:
+                    future.set_exception(e)
+                continue
+
+            self._commit_group(session, group)
+
+        if session is not None:
+            session.close()
+
+    def _commit_group(self, session: Session, group: list):
+        results = []
+
+        try:
+            with session.group():
+                for add_function, record, _ in group:
+                    results.append(self._add_row(add_function, record, session))
+            self.groups_committed += 1
+
+        except sqlite3.Error:
+            # the commit itself failed, nothing of the group was written
+            session.connection.rollback()
+            results = [False] * len(group)
+
+        except Exception as e:
+            # same, but the caller gets the error instead of a plain False, the writer keeps running
+            session.connection.rollback()
+            results = [e] * len(group)
+
+        for (_, _, future), result in zip(group, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _add_row(self, add_function, record: Expense | Income, session: Session) -> bool | Exception:
+        """Result of one row, an error raised by the row was already undone by its savepoint and only fails its own future."""
+
+        try:
+            return add_function(record, session)
+        except Exception as e:
+            return e
@@ -0,0 +1,125 @@
+import sqlite3
+from datetime import date
+from itertools import chain
+from typing import NamedTuple
+
+try:
+    import numpy as np
+except ImportError: # optional, only the analytics need it
+    np = None
+
+import db.database as db
+from internal_libs.category import ExpCategory, IncCategory
+
+# Vectorized analytics over the expenses/incomes loaded as NumPy columns. Rows go from the
+# cursor straight into int64 arrays (day number, category code, cents), every statistic below
+# is computed with array operations, never with a Python loop over the rows.
+
+DEFAULT_QUANTILES = (50, 90, 99)
+DEFAULT_WINDOW = 3 # months of the moving average
+
+class Columns(NamedTuple):
+    day: "np.ndarray"      # days since 1970-01-01
+    category: "np.ndarray" # position of the category in ExpCategory/IncCategory
+    cents: "np.ndarray"
+
+class Report(NamedTuple):
+    expense_categories: dict       # category -> total
+    income_categories: dict        # category -> total
+    months: list                   # YYYY-MM of every month between the first and last entry
+    monthly_expenses: "np.ndarray" # totals per month
+    monthly_incomes: "np.ndarray"
+    moving_average: "np.ndarray"   # trailing average of the monthly expenses, NaN until the window is full
+    monthly_savings_rate: "np.ndarray" # (incomes - expenses) / incomes, NaN for months without incomes
+    percentiles: dict              # quantile -> expense amount
+    savings_rate: float            # over the whole period, NaN without incomes
+
+def numpy_available() -> bool:
+    return np is not None
+
+def load_columns(kind: str, start: date | None = None, end: date | None = None,
+                 db_path: str | db.Session = db.DB_DEFAULT_PATH) -> tuple[bool, Columns | str]:
+    """Loads the expenses ('exp') or incomes ('inc') between start and end (inclusive) as NumPy columns."""
+
+    if np is None:
+        return False, "NumPy is not installed"
+
+    success, chunks = db.iter_columns(kind, start, end, db_path)
+    if not success:
+        return False, chunks
+
+    try:
+        # fromiter over the flattened rows skips the per tuple checks np.array does
+        arrays = [np.fromiter(chain.from_iterable(chunk), dtype = np.int64, count = 3 * len(chunk)).reshape(-1, 3) for chunk in chunks]
+    except sqlite3.Error:
+        return False, "Database error"
+
+    data = np.concatenate(arrays) if arrays else np.empty((0, 3), dtype = np.int64)
+    return True, Columns(np.ascontiguousarray(data[:, 0]), np.ascontiguousarray(data[:, 1]), np.ascontiguousarray(data[:, 2]))
+
+def category_totals(columns: Columns, categories: type[ExpCategory] | type[IncCategory]) -> dict:
+    totals = np.bincount(columns.category, weights = columns.cents, minlength = len(categories)) / 100
+    return {category: float(total) for category, total in zip(categories, totals)}
+
+def month_numbers(days: "np.ndarray") -> "np.ndarray":
+    """Months since 1970-01 of each day number."""
+
+    return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+def monthly_totals(columns: Columns, first_month: int, month_count: int) -> "np.ndarray":
+    return np.bincount(month_numbers(columns.day) - first_month, weights = columns.cents, minlength = month_count) / 100
+
+def moving_average(values: "np.ndarray", window: int) -> "np.ndarray":
+    """Trailing mean over window values, NaN where fewer than window values are available."""
+
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        sums = np.cumsum(np.insert(values, 0, 0.0))
+        result[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return result
+
+def percentiles(columns: Columns, quantiles: tuple = DEFAULT_QUANTILES) -> dict:
+    if len(columns.cents) == 0:
+        return {}
+    return {quantile: float(value) / 100 for quantile, value in zip(quantiles, np.percentile(columns.cents, quantiles))}
+
+def savings_rate(incomes: "np.ndarray", expenses: "np.ndarray") -> "np.ndarray":
+    incomes = np.asarray(incomes, dtype = float)
+    return np.divide(incomes - expenses, incomes, out = np.full(incomes.shape, np.nan), where = incomes != 0)
+
+def build_report(expenses: Columns, incomes: Columns, window: int = DEFAULT_WINDOW, quantiles: tuple = DEFAULT_QUANTILES) -> Report:
+    days = np.concatenate((expenses.day, incomes.day))
+    if len(days):
+        first_month = int(month_numbers(days.min(keepdims = True))[0])
+        month_count = int(month_numbers(days.max(keepdims = True))[0]) - first_month + 1
+    else:
+        first_month, month_count = 0, 0
+
+    monthly_expenses = monthly_totals(expenses, first_month, month_count)
+    monthly_incomes = monthly_totals(incomes, first_month, month_count)
+    months = np.arange(first_month, first_month + month_count).astype("datetime64[M]").astype(str).tolist()
+
+    return Report(category_totals(expenses, ExpCategory),
+                  category_totals(incomes, IncCategory),
+                  months,
+                  monthly_expenses,
+                  monthly_incomes,
+                  moving_average(monthly_expenses, window),
+                  savings_rate(monthly_incomes, monthly_expenses),
+                  percentiles(expenses, quantiles),
+                  float(savings_rate(np.array([incomes.cents.sum()]), np.array([expenses.cents.sum()]))[0]))
+
+@db.cached_report
+def get_report(start: date | None = None, end: date | None = None, window: int = DEFAULT_WINDOW, quantiles: tuple = DEFAULT_QUANTILES,
+               db_path: str | db.Session = db.DB_DEFAULT_PATH) -> tuple[bool, Report | str]:
+    """Report of the expenses and incomes between start and end (inclusive), served from the report cache while the db is unchanged."""
+
+    success, expenses = load_columns("exp", start, end, db_path)
+    if not success:
+        return False, expenses
+
+    success, incomes = load_columns("inc", start, end, db_path)
+    if not success:
+        return False, incomes
+
+    return True, build_report(expenses, incomes, window, quantiles)
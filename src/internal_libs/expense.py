@@ -3,11 +3,15 @@ from datetime import date
 from .category import ExpCategory
 
 class Expense:
-    def __init__(self, amount: float, date: date = date.today(), description: str = "", category: ExpCategory = ExpCategory.OTHER):
+    __slots__ = ("amount", "date", "description", "category", "id")
+
+    def __init__(self, amount: float, date: date = date.today(), description: str = "", category: ExpCategory = ExpCategory.OTHER,
+                 id: int | None = None):
         self.amount = amount
         self.date = date
         self.description = description
         self.category = category
+        self.id = id # set on records read from the db
 
     def __repr__(self):
         return f"Expense(date: {self.date}, description: \"{self.description}\", category: {self.category.value}, amount: {self.amount:.2f}€)"
@@ -0,0 +1,89 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import NamedTuple
+
+import db.database as db
+from db.encoding import from_cents, to_cents
+
+# Consolidated report over several dbs, e.g. one per household member. Every db is aggregated in a
+# worker process of its own (read-only, from its monthly_totals rollup) and the partial results are
+# merged in integer cents, so the wall-clock time follows the slowest db instead of their sum.
+
+class Partial(NamedTuple):
+    balance: int  # cents
+    monthly: dict # (kind, month, category) -> (cents, count)
+
+class HouseholdReport(NamedTuple):
+    files: list      # the dbs the report covers
+    balance: float   # current balance of all dbs together
+    totals: dict     # kind -> (total, count)
+    categories: dict # (kind, category) -> (total, count), categories by enum name
+    months: list     # YYYY-MM of the months with entries
+    monthly: dict    # (kind, month) -> total
+
+def file_aggregates(db_path: str, start_month: str | None = None, end_month: str | None = None) -> tuple[bool, Partial | str]:
+    """Aggregates of one db between two YYYY-MM months (inclusive), runs in a worker process."""
+
+    read_only = db.ReadOnly(db_path)
+
+    success, balance = db.get_balance(read_only)
+    if not success:
+        return False, balance
+
+    success, rows = db.get_monthly_totals(None, start_month, end_month, read_only)
+    if not success:
+        return False, rows
+
+    return True, Partial(to_cents(balance), {(kind, month, category): (to_cents(total), count)
+                                             for kind, month, category, total, count in rows})
+
+def merge(files: list, partials: list[Partial]) -> HouseholdReport:
+    balance = 0
+    totals = {}
+    categories = {}
+    monthly = {}
+
+    for partial in partials:
+        balance += partial.balance
+        for (kind, month, category), (cents, count) in partial.monthly.items():
+            for totals_dict, key in ((totals, kind), (categories, (kind, category))):
+                previous = totals_dict.get(key, (0, 0))
+                totals_dict[key] = (previous[0] + cents, previous[1] + count)
+            monthly[kind, month] = monthly.get((kind, month), 0) + cents
+
+    return HouseholdReport(files,
+                           from_cents(balance),
+                           {kind: (from_cents(cents), count) for kind, (cents, count) in sorted(totals.items())},
+                           {key: (from_cents(cents), count) for key, (cents, count) in sorted(categories.items())},
+                           sorted({month for _, month in monthly}),
+                           {key: from_cents(cents) for key, cents in monthly.items()})
+
+def get_report(db_paths: list[str], start_month: str | None = None, end_month: str | None = None,
+               workers: int | None = None) -> tuple[bool, HouseholdReport | str]:
+    """Report over db_paths, aggregated by up to workers processes (default: one per db, at most one per core)."""
+
+    try:
+        files = []
+        seen = set()
+        for path in db_paths:
+            if os.path.abspath(path) not in seen: # a db given twice is only counted once
+                seen.add(os.path.abspath(path))
+                files.append(path)
+
+        workers = min(len(files), workers or os.cpu_count() or 1)
+
+        if workers <= 1:
+            results = [file_aggregates(path, start_month, end_month) for path in files]
+        else:
+            with ProcessPoolExecutor(max_workers = workers) as pool:
+                results = list(pool.map(file_aggregates, files, repeat(start_month), repeat(end_month)))
+
+        for path, (success, value) in zip(files, results):
+            if not success:
+                return False, f"{path}: {value}"
+
+        return True, merge(files, [partial for _, partial in results])
+
+    except Exception as e:
+        return False, "Unexpected error"
@@ -3,11 +3,15 @@ from datetime import date
 from .category import IncCategory
 
 class Income:
-    def __init__(self, amount: float, date: date = date.today(), description: str = "", category: IncCategory = IncCategory.OTHER):
+    __slots__ = ("amount", "date", "description", "category", "id")
+
+    def __init__(self, amount: float, date: date = date.today(), description: str = "", category: IncCategory = IncCategory.OTHER,
+                 id: int | None = None):
         self.amount = amount
         self.date = date
         self.description = description
         self.category = category
+        self.id = id # set on records read from the db
 
     def __repr__(self):
         return f"Income(date: {self.date}, description: \"{self.description}\", category: {self.category.value}, amount: {self.amount:.2f}€)"
@@ -1,12 +1,39 @@
+import os
+import sqlite3
+
 import db.database as db
 import cli.cli as cli
+from db import tracing
 
 def main():
-    success = db.init_db()
-    if success:
-        cli.main()
-    else:
+    profile = os.environ.get(db.PROFILE_ENV_VAR, db.DEFAULT_PROFILE)
+    if not db.set_profile(profile):
+        print(f"ERROR: Unknown db profile \"{profile}\" in {db.PROFILE_ENV_VAR}. Choose from {list(db.PROFILES)}.")
+        return
+
+    tracing.enable_from_env() # before init_db, so the startup is traced too
+    args = cli.parse_args() # --profile and --trace apply to the connection init_db opens as well
+
+    # reporting processes: the db is only read, it is neither created nor migrated
+    read_only = os.environ.get(db.READ_ONLY_ENV_VAR, "")
+    if read_only not in ("", "0"):
+        with db.use_read_only(immutable = read_only == "immutable"):
+            cli.main(args)
+        return
+
+    # the version check and the command share one connection, a cold show_balance is a single read on it
+    try:
+        session = db.Session()
+    except sqlite3.Error:
         print("ERROR: Failed to initialize db.")
+        return
+
+    with session, db.use_session(session):
+        success = db.init_db()
+        if success:
+            cli.main(args)
+        else:
+            print("ERROR: Failed to initialize db.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,16 @@
+import sys
+import os
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+import db.database as db
+
+@pytest.fixture
+def tmp_db(tmp_path):
+    """create a temporary db for testing"""
+
+    db_path = tmp_path / "test_finances.db"
+    assert db.init_db(db_path), "Failed to initialize test database"
+
+    return db_path
@@ -0,0 +1,112 @@
+import sqlite3
+import pytest
+from datetime import date
+
+np = pytest.importorskip("numpy")
+
+import db.database as db
+from internal_libs import analytics
+from internal_libs.expense import Expense, ExpCategory
+from internal_libs.income import Income, IncCategory
+
+@pytest.fixture
+def sample_db(tmp_db):
+    """the temporary db with a few expenses and incomes"""
+
+    db.import_expenses([Expense(10, date(2024, 1, 5), "a", ExpCategory.FOOD),
+                        Expense(30, date(2024, 3, 5), "b", ExpCategory.GAMING),
+                        Expense(5.5, date(2024, 3, 6))], tmp_db)
+    db.import_incomes([Income(100, date(2024, 1, 31), "salary", IncCategory.SALARY)], tmp_db)
+
+    return tmp_db
+
+def test_load_columns(sample_db):
+    """testing the rows are loaded as int64 columns, filtered by date"""
+
+    success, columns = analytics.load_columns("exp", db_path = sample_db)
+    assert success
+    assert columns.day.dtype == np.int64
+    assert columns.category.tolist() == [list(ExpCategory).index(category) for category in (ExpCategory.FOOD, ExpCategory.GAMING, ExpCategory.OTHER)]
+    assert columns.cents.tolist() == [1000, 3000, 550]
+
+    success, columns = analytics.load_columns("exp", date(2024, 2, 1), date(2024, 3, 5), sample_db)
+    assert success
+    assert columns.cents.tolist() == [3000]
+
+    success, columns = analytics.load_columns("inc", date(2030, 1, 1), db_path = sample_db)
+    assert success
+    assert len(columns.day) == 0
+
+def test_load_columns_negative(monkeypatch):
+    """testing load_columns reports a db error and a missing NumPy"""
+
+    def mock_connect(*args, **kwargs):
+        raise sqlite3.Error("connection failed")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    assert analytics.load_columns("exp", db_path = "fake_path") == (False, "Database error")
+
+    monkeypatch.setattr(analytics, "np", None)
+    assert not analytics.numpy_available()
+    assert analytics.load_columns("exp", db_path = "fake_path") == (False, "NumPy is not installed")
+
+def test_statistics():
+    """testing the vectorized statistics on hand made columns"""
+
+    columns = analytics.Columns(np.array([0, 31, 31, 60]), np.array([0, 0, 2, 4]), np.array([100, 200, 300, 400]))
+
+    totals = analytics.category_totals(columns, ExpCategory)
+    assert totals[ExpCategory.FOOD] == 3
+    assert totals[ExpCategory.GAMING] == 3
+    assert totals[ExpCategory.TRANSPORT] == 0
+
+    assert analytics.month_numbers(columns.day).tolist() == [0, 1, 1, 2]
+    assert analytics.monthly_totals(columns, 0, 3).tolist() == [1, 5, 4]
+
+    average = analytics.moving_average(np.array([1.0, 2.0, 3.0, 6.0]), 2)
+    assert np.isnan(average[0])
+    assert average[1:].tolist() == [1.5, 2.5, 4.5]
+    assert np.isnan(analytics.moving_average(np.array([1.0]), 3)).all()
+
+    assert analytics.percentiles(columns, (0, 50, 100)) == {0: 1, 50: 2.5, 100: 4}
+    assert analytics.percentiles(analytics.Columns(np.array([]), np.array([]), np.array([]))) == {}
+
+    rates = analytics.savings_rate(np.array([100.0, 0.0]), np.array([25.0, 10.0]))
+    assert rates[0] == 0.75
+    assert np.isnan(rates[1])
+
+def test_build_report(sample_db):
+    """testing the report of the stats command"""
+
+    _, expenses = analytics.load_columns("exp", db_path = sample_db)
+    _, incomes = analytics.load_columns("inc", db_path = sample_db)
+    report = analytics.build_report(expenses, incomes, window = 2)
+
+    assert report.months == ["2024-01", "2024-02", "2024-03"]
+    assert report.monthly_expenses.tolist() == [10, 0, 35.5]
+    assert report.monthly_incomes.tolist() == [100, 0, 0]
+    assert report.moving_average[1:].tolist() == [5, 17.75]
+    assert report.monthly_savings_rate[0] == 0.9
+    assert report.expense_categories[ExpCategory.OTHER] == 5.5
+    assert report.income_categories[IncCategory.SALARY] == 100
+    assert report.savings_rate == pytest.approx(0.545)
+
+    empty = analytics.build_report(analytics.Columns(np.array([], dtype = np.int64), np.array([], dtype = np.int64), np.array([], dtype = np.int64)),
+                                   analytics.Columns(np.array([], dtype = np.int64), np.array([], dtype = np.int64), np.array([], dtype = np.int64)))
+    assert empty.months == []
+    assert np.isnan(empty.savings_rate)
+
+def test_get_report_cached(sample_db):
+    """testing that the report is computed once and again after a write"""
+
+    db.clear_cache()
+
+    success, report = analytics.get_report(window = 2, db_path = sample_db)
+    assert success
+    assert report.monthly_expenses.tolist() == [10, 0, 35.5]
+    assert analytics.get_report(window = 2, db_path = sample_db)[1] is report
+
+    db.add_expense(Expense(4.5, date(2024, 3, 9)), sample_db)
+    _, report = analytics.get_report(window = 2, db_path = sample_db)
+    assert report.monthly_expenses.tolist() == [10, 0, 40]
+    assert db.cache_stats()["hits"] == 1
@@ -0,0 +1,114 @@
+import asyncio
+import sqlite3
+from datetime import date
+
+import db.database as db
+from db.async_database import AsyncDatabase
+from db.filters import compile_filter, compile_search
+from internal_libs.expense import Expense, ExpCategory
+from internal_libs.income import Income
+
+def test_concurrent_writes_share_one_writer(tmp_db):
+    """test that many coroutines can write at once through the single writer connection"""
+
+    async def scenario():
+        async with AsyncDatabase(tmp_db) as adb:
+            results = await asyncio.gather(*[adb.add_expense(Expense(1, date(2024, 1, i % 28 + 1))) for i in range(50)],
+                                           *[adb.add_income(Income(10)) for _ in range(10)])
+            assert all(results)
+
+            assert await adb.get_balance() == (True, 50)
+            success, expenses = await adb.get_expenses()
+            assert success
+            assert len(expenses) == 50
+
+            assert await adb.edit_expense(1, new_amount = 6)
+            assert await adb.del_income(1)
+            assert not await adb.del_income(1)
+            assert await adb.get_balance() == (True, 35)
+
+    asyncio.run(scenario())
+
+    # everything was committed, a sync call sees it
+    assert db.get_balance(tmp_db) == (True, 35)
+
+def test_iter_expenses_async(tmp_db):
+    """test the async listing iterator, fetched in several chunks and with a filter"""
+
+    db.import_expenses([Expense(i, date(2024, 1, i), f"row {i}", ExpCategory.FOOD if i % 2 else ExpCategory.OTHER)
+                        for i in range(1, 11)], tmp_db)
+
+    async def scenario():
+        async with AsyncDatabase(tmp_db, readers = 2) as adb:
+            success, rows = await adb.iter_expenses(order = "desc", chunk_size = 3)
+            assert success
+            assert [row[0] async for row in rows] == list(range(10, 0, -1))
+
+            success, rows = await adb.iter_expenses(where = compile_filter("category = food and amount > 4", ExpCategory))
+            assert success
+            assert [row[4] async for row in rows] == [5, 7, 9]
+
+            # a listing stopped early releases its connection
+            success, rows = await adb.iter_expenses(chunk_size = 2)
+            async for row in rows:
+                break
+            await rows.aclose()
+
+    asyncio.run(scenario())
+
+def test_iter_expenses_async_archived(tmp_db):
+    """test a listing with a limit over the db and its archive shards, closed early and read to its end"""
+
+    db.import_expenses([Expense(i, date(2020 + i % 3, 1, i)) for i in range(1, 10)], tmp_db)
+    assert db.archive(2022, tmp_db) == (True, (6, 0))
+
+    async def scenario():
+        async with AsyncDatabase(tmp_db) as adb:
+            success, rows = await adb.iter_expenses(limit = 2)
+            assert success
+            assert [row[0] async for row in rows] == [1, 2]
+
+            success, rows = await adb.iter_expenses(limit = 5, order = "desc", chunk_size = 2)
+            async for row in rows:
+                break
+            await rows.aclose()
+
+    asyncio.run(scenario())
+
+def test_import_and_summary_async(tmp_db):
+    """test the bulk import and the derived tables through the async api"""
+
+    async def scenario():
+        async with AsyncDatabase(tmp_db) as adb:
+            assert await adb.set_balance(10) # opening balance
+            assert await adb.import_incomes([Income(100, date(2024, 2, 1)), Income(50, date(2024, 3, 1), "bonus")]) == (True, 2)
+
+            success, totals = await adb.get_monthly_totals("inc")
+            assert success
+            assert [total[1] for total in totals] == ["2024-02", "2024-03"]
+
+            assert await adb.get_balance_at(date(2024, 2, 15)) == (True, 110)
+            assert await adb.get_balance_series(date(2024, 1, 1), date(2024, 12, 31)) == (True, [(date(2024, 1, 1), 10), (date(2024, 2, 1), 110), (date(2024, 3, 1), 160)])
+
+            success, records = await adb.search(compile_search("bon*"))
+            assert success
+            assert [record.amount for record in records] == [50]
+
+    asyncio.run(scenario())
+
+def test_async_database_errors(monkeypatch):
+    """test that the async api returns the same errors as the sync one when the db can not be opened"""
+
+    def mock_connect(*args, **kwargs):
+        raise sqlite3.Error("connection failed")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    async def scenario():
+        async with AsyncDatabase("fake_path") as adb:
+            assert await adb.get_balance() == (False, "Database error")
+            assert await adb.get_expenses() == (False, "Database error")
+            assert await adb.iter_incomes() == (False, "Database error")
+            assert not await adb.add_expense(Expense(1))
+            assert not await adb.init_db()
+
+    asyncio.run(scenario())
@@ -4,11 +4,11 @@ import pytest
 import argparse
 from datetime import date
 
-sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
-
 import cli.cli as cli
 from internal_libs.category import ExpCategory
 from internal_libs.category import IncCategory
+from internal_libs.expense import Expense
+from internal_libs.income import Income
 import db.database as db
 
 def test_show_categories(capsys):
@@ -99,11 +99,20 @@ def test_set_balance_negative(monkeypatch, capsys):
 def test_list_expenses_handler_positive(monkeypatch, capsys):
     """positive test function that handles the list expenses command"""
 
-    dummyExpenses = [(0, "1998-06-04", "description test", "gaming", 70),
-                     (1, "2025-10-24", "description test 2", "other", 5)]
-    monkeypatch.setattr(db, "get_expenses", lambda: (True, dummyExpenses))
+    dummyExpenses = [Expense(70, date(1998, 6, 4), "description test", ExpCategory.GAMING, 0),
+                     Expense(5, date(2025, 10, 24), "description test 2", ExpCategory.OTHER, 1)]
+    monkeypatch.setattr(db, "iter_expense_records", lambda *args: (True, iter(dummyExpenses)))
+
+    class DummyClass:
+        pass
+    dummy = DummyClass()
+    dummy.limit = None
+    dummy.after_id = None
+    dummy.before_date = None
+    dummy.order = "asc"
+    dummy.where = None
 
-    cli.handle_exp_list_command()
+    cli.handle_exp_list_command(dummy)
     out = capsys.readouterr().out
     expected_out = (
         "(id:0) Expense(date: 1998-06-04, description: \"description test\", category: Gaming, amount: 70.00€)\n"
@@ -115,14 +124,49 @@ def test_list_expenses_handler_positive(monkeypatch, capsys):
 def test_list_expenses_handler_negative(monkeypatch, capsys):
     """negative test function that handles the list expenses command"""
 
-    monkeypatch.setattr(db, "get_expenses", lambda: (False, "Database error"))
+    monkeypatch.setattr(db, "iter_expense_records", lambda *args: (False, "Database error"))
+
+    class DummyClass:
+        pass
+    dummy = DummyClass()
+    dummy.limit = None
+    dummy.after_id = None
+    dummy.before_date = None
+    dummy.order = "asc"
+    dummy.where = None
 
-    cli.handle_exp_list_command()
+    cli.handle_exp_list_command(dummy)
     out = capsys.readouterr().out
     expected_out = "ERROR: Database error.\n"
 
     assert out == expected_out
 
+def test_list_expenses_handler_pagination(monkeypatch, capsys):
+    """test that the list expenses command forwards the pagination options and rejects a non positive limit"""
+
+    received = {}
+    def mock_iter_expenses(*args):
+        received["args"] = args
+        return True, iter([])
+    monkeypatch.setattr(db, "iter_expense_records", mock_iter_expenses)
+
+    class DummyClass:
+        pass
+    dummy = DummyClass()
+    dummy.limit = 10
+    dummy.after_id = 20
+    dummy.before_date = date(2024, 1, 1)
+    dummy.order = "desc"
+    dummy.where = cli.validate_expense_filter("category = food")
+
+    cli.handle_exp_list_command(dummy)
+    assert received["args"] == (10, 20, date(2024, 1, 1), "desc", dummy.where)
+
+    dummy.limit = 0
+    cli.handle_exp_list_command(dummy)
+    out = capsys.readouterr().out
+    assert out == "ERROR: Limit needs to be positive (> 0).\n"
+
 def test_add_expense_positive_1(monkeypatch, capsys):
     """test the positive result of adding a new expense with custom values"""
 
@@ -209,7 +253,8 @@ def test_edit_expense_positive(monkeypatch, capsys):
     dummy.date = None
     dummy.description = "test desc"
     dummy.category = None
-    dummy.id = 1
+    dummy.ids = [1]
+    dummy.where = None
 
     cli.handle_edit_exp_command(dummy)
     out = capsys.readouterr().out
@@ -263,7 +308,8 @@ def test_edit_expense_negative_3(monkeypatch, capsys):
     dummy.date = None
     dummy.description = "test"
     dummy.category = None
-    dummy.id = 1
+    dummy.ids = [1]
+    dummy.where = None
 
     cli.handle_edit_exp_command(dummy)
     out = capsys.readouterr().out
@@ -279,7 +325,8 @@ def test_delete_expense_positive(monkeypatch, capsys):
     class DummyClass:
         pass
     dummy = DummyClass()
-    dummy.id = 1
+    dummy.ids = [1]
+    dummy.where = None
 
     cli.handle_del_exp_command(dummy)
     out = capsys.readouterr().out
@@ -295,7 +342,8 @@ def test_delete_expense_negative(monkeypatch, capsys):
     class DummyClass:
         pass
     dummy = DummyClass()
-    dummy.id = 1
+    dummy.ids = [1]
+    dummy.where = None
 
     cli.handle_del_exp_command(dummy)
     out = capsys.readouterr().out
@@ -324,11 +372,20 @@ def test_exp_category_validation_negative():
 def test_list_incomes_handler_positive(monkeypatch, capsys):
     """positive test function that handles the list incomes command"""
 
-    dummyIncomes = [(0, "2025-10-27", "description test", "salary", 2000),
-                    (1, "2025-10-24", "description test 2", "other", 5)]
-    monkeypatch.setattr(db, "get_incomes", lambda: (True, dummyIncomes))
+    dummyIncomes = [Income(2000, date(2025, 10, 27), "description test", IncCategory.SALARY, 0),
+                    Income(5, date(2025, 10, 24), "description test 2", IncCategory.OTHER, 1)]
+    monkeypatch.setattr(db, "iter_income_records", lambda *args: (True, iter(dummyIncomes)))
+
+    class DummyClass:
+        pass
+    dummy = DummyClass()
+    dummy.limit = None
+    dummy.after_id = None
+    dummy.before_date = None
+    dummy.order = "asc"
+    dummy.where = None
 
-    cli.handle_inc_list_command()
+    cli.handle_inc_list_command(dummy)
     out = capsys.readouterr().out
     expected_out = (
         "(id:0) Income(date: 2025-10-27, description: \"description test\", category: Salary, amount: 2000.00€)\n"
@@ -340,9 +397,18 @@ def test_list_incomes_handler_positive(monkeypatch, capsys):
 def test_list_incomes_handler_negative(monkeypatch, capsys):
     """negative test function that handles the list incomes command"""
 
-    monkeypatch.setattr(db, "get_incomes", lambda: (False, "Database error"))
+    monkeypatch.setattr(db, "iter_income_records", lambda *args: (False, "Database error"))
 
-    cli.handle_inc_list_command()
+    class DummyClass:
+        pass
+    dummy = DummyClass()
+    dummy.limit = None
+    dummy.after_id = None
+    dummy.before_date = None
+    dummy.order = "asc"
+    dummy.where = None
+
+    cli.handle_inc_list_command(dummy)
     out = capsys.readouterr().out
     expected_out = "ERROR: Database error.\n"
 
@@ -434,7 +500,8 @@ def test_edit_income_positive(monkeypatch, capsys):
     dummy.date = None
     dummy.description = "test desc"
     dummy.category = None
-    dummy.id = 1
+    dummy.ids = [1]
+    dummy.where = None
 
     cli.handle_edit_inc_command(dummy)
     out = capsys.readouterr().out
@@ -488,7 +555,8 @@ def test_edit_income_negative_3(monkeypatch, capsys):
     dummy.date = None
     dummy.description = "test"
     dummy.category = None
-    dummy.id = 1
+    dummy.ids = [1]
+    dummy.where = None
 
     cli.handle_edit_inc_command(dummy)
     out = capsys.readouterr().out
@@ -504,7 +572,8 @@ def test_delete_income_positive(monkeypatch, capsys):
     class DummyClass:
         pass
     dummy = DummyClass()
-    dummy.id = 1
+    dummy.ids = [1]
+    dummy.where = None
 
     cli.handle_del_inc_command(dummy)
     out = capsys.readouterr().out
@@ -520,7 +589,8 @@ def test_delete_income_negative(monkeypatch, capsys):
     class DummyClass:
         pass
     dummy = DummyClass()
-    dummy.id = 1
+    dummy.ids = [1]
+    dummy.where = None
 
     cli.handle_del_inc_command(dummy)
     out = capsys.readouterr().out
@@ -549,8 +619,13 @@ def test_inc_category_validation_negative():
 @pytest.mark.parametrize("argv, handler_name", [
     (["src/main.py", "show_balance"], "handle_show_balance"),
     (["src/main.py", "set_balance", "1000"], "handle_set_balance"),
+    (["src/main.py", "balance_at", "2023-06-30"], "handle_balance_at"),
+    (["src/main.py", "balance_series", "2023-01-01", "2023-12-31"], "handle_balance_series"),
     (["src/main.py", "list_exp"], "handle_exp_list_command"),
     (["src/main.py", "list_inc"], "handle_inc_list_command"),
+    (["src/main.py", "list_exp", "--limit", "5", "--after-id", "10", "--order", "desc"], "handle_exp_list_command"),
+    (["src/main.py", "list_inc", "--before-date", "2024-01-01"], "handle_inc_list_command"),
+    (["src/main.py", "list_exp", "--where", "amount > 10 or description ~ 'rent'"], "handle_exp_list_command"),
     (["src/main.py", "categories"], "handle_categories_command"),
     (["src/main.py", "add_exp", "10"], "handle_add_exp_command"),
     (["src/main.py", "edit_exp", "1", "--amount", "10"], "handle_edit_exp_command"),
@@ -558,6 +633,18 @@ def test_inc_category_validation_negative():
     (["src/main.py", "add_inc", "2000"], "handle_add_inc_command"),
     (["src/main.py", "edit_inc", "1", "--amount", "10"], "handle_edit_inc_command"),
     (["src/main.py", "del_inc", "1"], "handle_del_inc_command"),
+    (["src/main.py", "del_exp", "1", "2", "3"], "handle_del_exp_command"),
+    (["src/main.py", "del_inc", "--where", "date < 2020-01-01"], "handle_del_inc_command"),
+    (["src/main.py", "edit_exp", "--where", "description ~ amazon", "--category", "gaming"], "handle_edit_exp_command"),
+    (["src/main.py", "import_csv", "file.csv", "--type", "exp"], "handle_import_csv_command"),
+    (["src/main.py", "summary", "--type", "inc", "--from", "2024-01", "--to", "2024-06"], "handle_summary_command"),
+    (["src/main.py", "stats", "--from", "2024-01-01", "--window", "6"], "handle_stats_command"),
+    (["src/main.py", "search", "amaz* \"monthly rent\"", "--type", "exp", "--page", "2"], "handle_search_command"),
+    (["src/main.py", "report", "--db", "a.db", "--db", "b.db", "--from", "2024-01", "--workers", "2"], "handle_report_command"),
+    (["src/main.py", "export", "out.jsonl.gz", "--type", "inc", "--from", "2024-01-01", "--where", "amount > 10"], "handle_export_command"),
+    (["src/main.py", "archive", "--before", "2020"], "handle_archive_command"),
+    (["src/main.py", "batch", "commands.txt", "--group", "10"], "handle_batch_command"),
+    (["src/main.py", "shell"], "handle_shell_command"),
 ])
 def test_cli_dispatch(monkeypatch, argv, handler_name):
     """test the main function of cli, to see if the correct handler is called depending on each command"""
@@ -572,4 +659,568 @@ def test_cli_dispatch(monkeypatch, argv, handler_name):
     cli.main()
 
     assert result["called"]
-    
\ No newline at end of file
+    
+def test_read_csv_records_positive():
+    """test that csv rows are parsed into expense objects with defaults for missing values"""
+
+    import io
+    file = io.StringIO("date,description,category,amount\n"
+                       "2024-03-01,Groceries,food,12.5\n"
+                       ",,,3\n")
+
+    records = list(cli.read_csv_records(file, cli.Expense, cli.validate_expense_category, ExpCategory.OTHER))
+
+    assert len(records) == 2
+    assert records[0].date == date(2024, 3, 1)
+    assert records[0].description == "Groceries"
+    assert records[0].category == ExpCategory.FOOD
+    assert records[0].amount == 12.5
+    assert records[1].category == ExpCategory.OTHER
+    assert records[1].description == ""
+
+def test_read_csv_records_negative():
+    """test that an invalid csv row raises a ValueError with its line number"""
+
+    import io
+    file = io.StringIO("date,amount,category\n"
+                       "2024-03-01,5,salary\n"
+                       "2024-03-02,-1,salary\n")
+
+    records = cli.read_csv_records(file, cli.Income, cli.validate_income_category, IncCategory.OTHER)
+    next(records)
+
+    with pytest.raises(ValueError) as err:
+        next(records)
+
+    assert str(err.value) == "Line 3: Amount needs to be positive (> 0)."
+
+@pytest.mark.parametrize("amount", ["nan", "inf", "-inf", "Infinity"])
+def test_read_csv_records_not_finite(amount):
+    """test that a csv amount float() parses but that is not a finite number is rejected"""
+
+    import io
+    file = io.StringIO(f"amount\n5\n{amount}\n")
+
+    with pytest.raises(ValueError) as err:
+        list(cli.read_csv_records(file, cli.Expense, cli.validate_expense_category, ExpCategory.OTHER))
+
+    assert str(err.value) == f"Line 3: Invalid amount: \"{amount}\"."
+
+def test_import_csv_positive(monkeypatch, capsys, tmp_path):
+    """test the positive result of importing a csv file"""
+
+    csv_path = tmp_path / "expenses.csv"
+    csv_path.write_text("amount\n1\n2\n")
+    monkeypatch.setattr(db, "import_expenses", lambda expenses: (True, len(list(expenses))))
+
+    class DummyClass:
+        pass
+    dummy = DummyClass()
+    dummy.file = str(csv_path)
+    dummy.type = "exp"
+
+    cli.handle_import_csv_command(dummy)
+    out = capsys.readouterr().out
+    expected_out = "SUCCESS: Imported 2 expenses.\n"
+
+    assert out == expected_out
+
+def test_import_csv_negative(monkeypatch, capsys, tmp_path):
+    """test the negative results of importing a csv file"""
+
+    monkeypatch.setattr(db, "import_incomes", lambda incomes: (False, "Line 2: Invalid date format: \"x\". Expected YYYY-MM-DD."))
+
+    class DummyClass:
+        pass
+    dummy = DummyClass()
+    dummy.file = str(tmp_path / "incomes.csv")
+    dummy.type = "inc"
+
+    cli.handle_import_csv_command(dummy)
+    out = capsys.readouterr().out
+    assert out == f"ERROR: Could not read file \"{dummy.file}\".\n"
+
+    (tmp_path / "incomes.csv").write_text("date,amount\nx,1\n")
+    cli.handle_import_csv_command(dummy)
+    out = capsys.readouterr().out
+    assert out == "ERROR: Line 2: Invalid date format: \"x\". Expected YYYY-MM-DD. Nothing was imported.\n"
+
+def test_filter_validation():
+    """test the filter validators turn filter errors into argparse errors"""
+
+    assert cli.validate_income_filter("category = salary").params == ("SALARY",)
+
+    with pytest.raises(argparse.ArgumentTypeError) as err:
+        cli.validate_expense_filter("category = salary")
+
+    assert str(err.value) == f"Invalid category: \"salary\". Choose from {ExpCategory.list()}."
+
+def test_month_validation():
+    """test the month validation for summary ranges"""
+
+    assert cli.validate_month("2024-3") == "2024-03"
+
+    with pytest.raises(argparse.ArgumentTypeError) as err:
+        cli.validate_month("2024-13")
+
+    assert str(err.value) == "Invalid month format: \"2024-13\". Expected YYYY-MM."
+
+def test_summary_positive(monkeypatch, capsys):
+    """test the summary command output"""
+
+    totals = [("exp", "2024-01", "FOOD", 25.5, 2), ("inc", "2024-01", "SALARY", 1000, 1)]
+    monkeypatch.setattr(db, "get_monthly_totals", lambda *args: (True, totals))
+
+    class DummyClass:
+        pass
+    dummy = DummyClass()
+    dummy.rebuild = False
+    dummy.type = None
+    dummy.start = None
+    dummy.end = None
+
+    cli.handle_summary_command(dummy)
+    out = capsys.readouterr().out
+    expected_out = (
+        "2024-01 Expenses Food            25.50€ (2 entries)\n"
+        "2024-01 Incomes  Salary        1000.00€ (1 entries)\n"
+    )
+
+    assert out == expected_out
+
+def test_summary_negative(monkeypatch, capsys):
+    """test the summary command when the db fails"""
+
+    monkeypatch.setattr(db, "rebuild_monthly_totals", lambda: False)
+    monkeypatch.setattr(db, "get_monthly_totals", lambda *args: (False, "Database error"))
+
+    class DummyClass:
+        pass
+    dummy = DummyClass()
+    dummy.rebuild = True
+    dummy.type = "exp"
+    dummy.start = None
+    dummy.end = None
+
+    cli.handle_summary_command(dummy)
+    assert capsys.readouterr().out == "ERROR: Error while trying to rebuild the summary.\n"
+
+    dummy.rebuild = False
+    cli.handle_summary_command(dummy)
+    assert capsys.readouterr().out == "ERROR: Database error.\n"
+
+def test_balance_at(monkeypatch, capsys):
+    """test the balance_at command output"""
+
+    class DummyClass:
+        pass
+    dummy = DummyClass()
+    dummy.date = date(2023, 6, 30)
+
+    monkeypatch.setattr(db, "get_balance_at", lambda day: (True, 900))
+    cli.handle_balance_at(dummy)
+    assert capsys.readouterr().out == "Balance on 2023-06-30: 900.00€\n"
+
+    monkeypatch.setattr(db, "get_balance_at", lambda day: (False, "Database error"))
+    cli.handle_balance_at(dummy)
+    assert capsys.readouterr().out == "ERROR: Database error.\n"
+
+def test_balance_series(monkeypatch, capsys):
+    """test the balance_series command output and date checks"""
+
+    series = [(date(2023, 6, 1), 100), (date(2023, 6, 10), 75.5)]
+    monkeypatch.setattr(db, "get_balance_series", lambda start, end: (True, series))
+
+    class DummyClass:
+        pass
+    dummy = DummyClass()
+    dummy.start = date(2023, 6, 1)
+    dummy.end = date(2023, 6, 30)
+
+    cli.handle_balance_series(dummy)
+    assert capsys.readouterr().out == "2023-06-01: 100.00€\n2023-06-10: 75.50€\n"
+
+    dummy.start, dummy.end = dummy.end, dummy.start
+    cli.handle_balance_series(dummy)
+    assert capsys.readouterr().out == "ERROR: The end date needs to be after the start date.\n"
+
+def test_run_commands(tmp_path, monkeypatch, capsys):
+    """test that a batch runs every line with one parser and session, skipping invalid ones"""
+
+    monkeypatch.chdir(tmp_path)
+    assert db.init_db()
+
+    lines = ["set_balance 100\n",
+             "add_exp 10 --description \"coffee beans\" --category food\n",
+             "\n",
+             "# comments and empty lines are ignored\n",
+             "add_exp not_a_number\n",
+             "batch other.txt\n",
+             "--profile bulk-load add_exp 5\n",
+             "--trace add_exp 5\n",
+             "--trace-file metrics.prom show_balance\n",
+             "add_inc 50 --description 'un \"closed\n",
+             "add_inc 50\n",
+             "show_balance\n"]
+    cli.run_commands(cli.build_parser(), lines, group = 4)
+
+    out = capsys.readouterr().out.splitlines()
+    assert out == ["SUCCESS: New balance set.",
+                   "SUCCESS: Expense added to the db.",
+                   "ERROR: batch can not be used inside a batch or shell.",
+                   "ERROR: --profile can not be used inside a batch or shell, give it to the batch or shell command itself.",
+                   "ERROR: --trace can not be used inside a batch or shell, give it to the batch or shell command itself.",
+                   "ERROR: --trace-file can not be used inside a batch or shell, give it to the batch or shell command itself.",
+                   "ERROR: No closing quotation.",
+                   "SUCCESS: Income added to the db.",
+                   "Current balance: 140.00€"]
+
+    assert not db._default_sessions
+    assert db.get_balance() == (True, 140)
+    success, expenses = db.get_expenses()
+    assert expenses[0][2] == "coffee beans"
+
+def test_handle_batch_command(tmp_path, monkeypatch, capsys):
+    """test the batch command with a file, a missing file and an invalid group size"""
+
+    import argparse
+    monkeypatch.chdir(tmp_path)
+    assert db.init_db()
+    (tmp_path / "commands.txt").write_text("add_inc 5\nadd_inc 7\n")
+
+    cli.handle_batch_command(argparse.Namespace(file = "commands.txt", group = 10))
+    cli.handle_batch_command(argparse.Namespace(file = "missing.txt", group = 1))
+    cli.handle_batch_command(argparse.Namespace(file = "commands.txt", group = 0))
+
+    out = capsys.readouterr().out.splitlines()
+    assert out == ["SUCCESS: Income added to the db.",
+                   "SUCCESS: Income added to the db.",
+                   "ERROR: Could not read file \"missing.txt\".",
+                   "ERROR: Group size needs to be positive (> 0)."]
+    assert db.get_balance() == (True, 12)
+
+def test_handle_shell_command(tmp_path, monkeypatch, capsys):
+    """test that the shell runs commands until exit"""
+
+    import argparse
+    monkeypatch.chdir(tmp_path)
+    assert db.init_db()
+
+    inputs = iter(["add_inc 20", "show_balance", "exit", "add_inc 20"])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(inputs))
+
+    cli.handle_shell_command(argparse.Namespace(group = 2))
+
+    out = capsys.readouterr().out.splitlines()
+    assert out[1:] == ["SUCCESS: Income added to the db.", "Current balance: 20.00€"]
+    assert next(inputs) == "add_inc 20" # nothing was read after exit
+
+def test_cli_profile_option(monkeypatch):
+    """test that --profile selects the db profile before the command runs"""
+
+    monkeypatch.setattr(db, "_profile", db.DEFAULT_PROFILE)
+    monkeypatch.setattr(sys, "argv", ["src/main.py", "--profile", "bulk-load", "show_balance"])
+
+    profiles = []
+    monkeypatch.setattr(cli, "handle_show_balance", lambda: profiles.append(db.get_profile()))
+
+    cli.main()
+
+    assert profiles == ["bulk-load"]
+
+def test_main_profile_option_before_init(tmp_path, monkeypatch):
+    """test that --profile already configures the connection the db is initialized on"""
+
+    import main
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "_profile", db.DEFAULT_PROFILE)
+    monkeypatch.delenv(db.PROFILE_ENV_VAR, raising = False)
+    monkeypatch.delenv(db.READ_ONLY_ENV_VAR, raising = False)
+    monkeypatch.setattr(sys, "argv", ["src/main.py", "--profile", "bulk-load", "show_balance"])
+
+    profiles = []
+    new_connection = db._new_connection
+    monkeypatch.setattr(db, "_new_connection", lambda *args, **kwargs: profiles.append(db.get_profile()) or new_connection(*args, **kwargs))
+    monkeypatch.setattr(cli, "handle_show_balance", lambda: profiles.append(db.get_profile()))
+
+    main.main()
+
+    assert profiles == ["bulk-load", "bulk-load"]
+
+def test_main_show_balance_one_connection(tmp_path, monkeypatch, capsys):
+    """test that main runs the version check and show_balance on one connection"""
+
+    import main
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv(db.READ_ONLY_ENV_VAR, raising = False)
+    monkeypatch.setattr(sys, "argv", ["src/main.py", "show_balance"])
+    main.main() # creates the db
+
+    connections = []
+    new_connection = db._new_connection
+    monkeypatch.setattr(db, "_new_connection", lambda *args, **kwargs: connections.append(args) or new_connection(*args, **kwargs))
+
+    main.main()
+
+    assert len(connections) == 1
+    assert capsys.readouterr().out.splitlines()[-1] == "Current balance: 0.00€"
+
+def test_handle_stats_command(tmp_path, monkeypatch, capsys):
+    """test the stats command output and its argument checks"""
+
+    pytest.importorskip("numpy")
+    import argparse
+    monkeypatch.chdir(tmp_path)
+    assert db.init_db()
+    db.add_expense(Expense(10, date(2024, 1, 5), "a", ExpCategory.FOOD))
+    db.add_income(Income(40, date(2024, 2, 1), "b", IncCategory.SALARY))
+
+    cli.handle_stats_command(argparse.Namespace(start = None, end = None, window = 2))
+    out = capsys.readouterr().out
+    assert "  Food             10.00€\n" in out
+    assert "2024-01        10.00€        0.00€       -            -\n" in out
+    assert "2024-02         0.00€       40.00€  100.0%        5.00€\n" in out
+    assert "Expense amounts: p50 10.00€, p90 10.00€, p99 10.00€\n" in out
+    assert out.endswith("Savings rate: 75.0%\n")
+
+    cli.handle_stats_command(argparse.Namespace(start = date(2030, 1, 1), end = None, window = 2))
+    cli.handle_stats_command(argparse.Namespace(start = date(2024, 2, 1), end = date(2024, 1, 1), window = 2))
+    cli.handle_stats_command(argparse.Namespace(start = None, end = None, window = 0))
+    monkeypatch.setattr(cli.analytics, "load_columns", lambda *args: (False, "Database error"))
+    db.clear_cache() # the report above would be served from the cache
+    cli.handle_stats_command(argparse.Namespace(start = None, end = None, window = 2))
+    monkeypatch.setattr(cli.analytics, "np", None)
+    cli.handle_stats_command(argparse.Namespace(start = None, end = None, window = 2))
+
+    assert capsys.readouterr().out.splitlines() == ["No entries for this period.",
+                                                    "ERROR: The end date needs to be after the start date.",
+                                                    "ERROR: Window needs to be positive (> 0).",
+                                                    "ERROR: Database error.",
+                                                    "ERROR: The stats command needs NumPy (pip install numpy)."]
+
+
+def test_handle_search_command(tmp_path, monkeypatch, capsys):
+    """test the search command output, paging and its argument checks"""
+
+    monkeypatch.chdir(tmp_path)
+    assert db.init_db()
+    db.add_expense(Expense(10, date(2024, 1, 5), "Amazon order", ExpCategory.OTHER))
+    db.add_expense(Expense(20, date(2024, 1, 6), "Lidl groceries", ExpCategory.FOOD))
+    db.add_income(Income(5, date(2024, 1, 7), "amazon refund", IncCategory.OTHER))
+
+    def run(query, type = None, limit = 20, page = 1):
+        cli.handle_search_command(argparse.Namespace(query = cli.validate_search(query), type = type, limit = limit, page = page))
+
+    run("amaz*")
+    run("amaz*", limit = 1, page = 2)
+    run("amazon", type = "exp")
+    run("\"amazon order\"", page = 2)
+    run("nothing")
+    run("amazon", limit = 0)
+    run("amazon", page = 0)
+    monkeypatch.setattr(db, "search", lambda *args: (False, "Database error"))
+    run("amazon")
+
+    assert capsys.readouterr().out.splitlines() == [
+        "(id:1) Income(date: 2024-01-07, description: \"amazon refund\", category: Other, amount: 5.00€)",
+        "(id:1) Expense(date: 2024-01-05, description: \"Amazon order\", category: Other, amount: 10.00€)",
+        "(id:1) Expense(date: 2024-01-05, description: \"Amazon order\", category: Other, amount: 10.00€)",
+        "(id:1) Expense(date: 2024-01-05, description: \"Amazon order\", category: Other, amount: 10.00€)",
+        "No more matches.",
+        "No matches.",
+        "ERROR: Limit needs to be positive (> 0).",
+        "ERROR: Page needs to be positive (> 0).",
+        "ERROR: Database error.",
+    ]
+
+def test_validate_search_negative():
+    """test that an invalid search query is rejected by the parser"""
+
+    with pytest.raises(argparse.ArgumentTypeError) as err:
+        cli.validate_search("\"amazon")
+    assert str(err.value) == "Unbalanced quotes in search."
+
+def test_handle_export_command(tmp_path, monkeypatch, capsys):
+    """test that an exported csv imports back into an empty db and that gzip jsonl reads back"""
+
+    import gzip
+    import json
+
+    monkeypatch.chdir(tmp_path)
+    assert db.init_db()
+    db.add_expense(Expense(10.5, date(2024, 1, 5), "Groceries, \"bio\"", ExpCategory.FOOD))
+    db.add_expense(Expense(3, date(2024, 2, 1), "Bus", ExpCategory.TRANSPORT))
+    db.add_income(Income(1500, date(2024, 1, 31), "Salary", IncCategory.SALARY))
+
+    def run(file, type = "all", format = None, gzip = False, start = None, end = None, where = None):
+        cli.handle_export_command(argparse.Namespace(file = file, type = type, format = format, gzip = gzip, start = start, end = end, where = where))
+
+    run("expenses.csv", type = "exp")
+    run("all.jsonl.gz", start = date(2024, 1, 10))
+    assert capsys.readouterr().out == "SUCCESS: Exported 2 rows to expenses.csv.\nSUCCESS: Exported 2 rows to all.jsonl.gz.\n"
+
+    with gzip.open("all.jsonl.gz", "rt") as inf:
+        assert [json.loads(line) for line in inf] == [
+            {"type": "exp", "id": 2, "date": "2024-02-01", "description": "Bus", "category": "Transport", "amount": 3},
+            {"type": "inc", "id": 1, "date": "2024-01-31", "description": "Salary", "category": "Salary", "amount": 1500}]
+
+    os.mkdir("copy")
+    monkeypatch.chdir(tmp_path / "copy")
+    assert db.init_db()
+    cli.handle_import_csv_command(argparse.Namespace(file = "../expenses.csv", type = "exp"))
+    assert capsys.readouterr().out == "SUCCESS: Imported 2 expenses.\n"
+    assert [str(expense) for expense in db.iter_expense_records()[1]] == [
+        "Expense(date: 2024-01-05, description: \"Groceries, \"bio\"\", category: Food, amount: 10.50€)",
+        "Expense(date: 2024-02-01, description: \"Bus\", category: Transport, amount: 3.00€)"]
+
+def test_handle_export_command_negative(tmp_path, monkeypatch, capsys):
+    """test that a failed export reports the error and leaves no partial file"""
+
+    monkeypatch.chdir(tmp_path)
+
+    def run(file, where = None, start = None, end = None):
+        cli.handle_export_command(argparse.Namespace(file = file, type = "exp", format = None, gzip = False, start = start, end = end, where = where))
+
+    run("out.csv", start = date(2024, 2, 1), end = date(2024, 1, 1))
+    run("out.csv", where = "category = salary")
+    run(str(tmp_path / "missing" / "out.csv"))
+    monkeypatch.setattr(db, "iter_export", lambda *args: (False, "Database error"))
+    run("out.csv")
+
+    assert capsys.readouterr().out.splitlines() == [
+        "ERROR: The end date needs to be after the start date.",
+        f"ERROR: Invalid category: \"salary\". Choose from {ExpCategory.list()}.",
+        f"ERROR: Could not write file \"{tmp_path / 'missing' / 'out.csv'}\".",
+        "ERROR: Database error.",
+    ]
+    assert not os.path.exists("out.csv")
+
+def test_handle_export_command_full_disk(tmp_path, monkeypatch, capsys):
+    """test that a write failing when the compressed export is closed is reported, not a success"""
+
+    import errno
+    import io
+
+    class FullFile(io.RawIOBase):
+        def writable(self):
+            return True
+
+        def write(self, data):
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.chdir(tmp_path)
+    assert db.init_db()
+    db.add_expense(Expense(10.5, date(2024, 1, 5), "Groceries", ExpCategory.FOOD))
+    # the few compressed bytes stay buffered until the file is closed
+    monkeypatch.setattr(cli, "open", lambda *args, **kwargs: io.BufferedWriter(FullFile(), cli.EXPORT_BUFFER_SIZE), raising = False)
+
+    for gzip in (False, True):
+        cli.handle_export_command(argparse.Namespace(file = "out.jsonl", type = "exp", format = None, gzip = gzip, start = None, end = None, where = None))
+    assert capsys.readouterr().out.splitlines() == ["ERROR: Could not write file \"out.jsonl\"."] * 2
+
+def test_export_format():
+    """test the export format is taken from the option, then from the file name"""
+
+    assert cli.export_format("out.jsonl.gz", None) == "jsonl"
+    assert cli.export_format("out.json", None) == "jsonl"
+    assert cli.export_format("out.txt", None) == "csv"
+    assert cli.export_format("-", "jsonl") == "jsonl"
+
+def test_handle_report_command(tmp_path, monkeypatch, capsys):
+    """test the household report output over two dbs and its argument checks"""
+
+    for name, expense, income in (("a.db", Expense(10, date(2024, 1, 5), "a", ExpCategory.FOOD), Income(100, date(2024, 1, 31))),
+                                  ("b.db", Expense(5.5, date(2024, 2, 1), "b", ExpCategory.FOOD), None)):
+        path = str(tmp_path / name)
+        assert db.init_db(path)
+        db.add_expense(expense, path)
+        if income is not None:
+            db.add_income(income, path)
+
+    def run(dbs, start = None, end = None, workers = None):
+        cli.handle_report_command(argparse.Namespace(db = [str(tmp_path / name) for name in dbs], start = start, end = end, workers = workers))
+
+    run(["a.db", "b.db"])
+    run(["a.db"], start = "2025-01")
+    run(["a.db"], workers = 0)
+    run(["a.db"], start = "2024-02", end = "2024-01")
+    run(["a.db", "missing.db"])
+
+    assert capsys.readouterr().out.splitlines() == [
+        f"Databases: {tmp_path / 'a.db'}, {tmp_path / 'b.db'}",
+        "Current balance: 84.50€",
+        "Expenses: 15.50€ (2 entries)",
+        "Incomes: 100.00€ (1 entries)",
+        "",
+        "By category:",
+        "  Expenses Food              15.50€ (2 entries)",
+        "  Incomes  Other            100.00€ (1 entries)",
+        "",
+        "Month        Expenses      Incomes          Net",
+        "2024-01        10.00€      100.00€       90.00€",
+        "2024-02         5.50€        0.00€       -5.50€",
+        f"Databases: {tmp_path / 'a.db'}",
+        "Current balance: 90.00€",
+        "No entries for this period.",
+        "ERROR: Workers needs to be positive (> 0).",
+        "ERROR: The end month needs to be after the start month.",
+        f"ERROR: {tmp_path / 'missing.db'}: Database error.",
+    ]
+
+def test_handle_archive_command(tmp_path, monkeypatch, capsys):
+    """test the archive command output and its year check"""
+
+    monkeypatch.chdir(tmp_path)
+    assert db.init_db()
+    db.add_expense(Expense(10, date(2019, 5, 1)))
+    db.add_income(Income(20, date(2019, 6, 1)))
+
+    cli.handle_archive_command(argparse.Namespace(before = 2020))
+    cli.handle_archive_command(argparse.Namespace(before = 2020))
+    monkeypatch.setattr(db, "archive", lambda before: (False, "Database error"))
+    cli.handle_archive_command(argparse.Namespace(before = 2020))
+
+    assert capsys.readouterr().out.splitlines() == [
+        "SUCCESS: Archived 1 expenses and 1 incomes dated before 2020.",
+        "Nothing to archive before 2020.",
+        "ERROR: Database error.",
+    ]
+    assert os.path.exists("finances-2019.db")
+
+    with pytest.raises(argparse.ArgumentTypeError) as err:
+        cli.validate_year("20x")
+    assert str(err.value) == "Invalid year: \"20x\". Expected YYYY."
+
+def test_handle_bulk_edit_and_delete_commands(tmp_path, monkeypatch, capsys):
+    """test editing and deleting several entries by id or filter from the cli"""
+
+    monkeypatch.chdir(tmp_path)
+    assert db.init_db()
+    for amount, description in ((10, "amazon"), (20, "rent"), (30, "amazon")):
+        db.add_expense(Expense(amount, date(2024, 1, 1), description))
+    db.add_income(Income(100, date(2024, 1, 1)))
+
+    parser = cli.build_parser()
+    for argv in (["edit_exp", "--where", "description ~ amazon", "--category", "gaming"],
+                 ["edit_exp", "1", "2", "--where", "category = gaming", "--amount", "5"],
+                 ["edit_exp", "--amount", "5"],
+                 ["del_exp", "1", "2"],
+                 ["del_exp"],
+                 ["del_inc", "--where", "amount > 50"],
+                 ["edit_inc", "1", "2", "--amount", "5"]):
+        cli.dispatch(parser.parse_args(argv))
+    monkeypatch.setattr(db, "del_incomes", lambda ids, where: (False, "Database error"))
+    cli.handle_del_inc_command(argparse.Namespace(ids = [1, 2], where = None))
+
+    assert capsys.readouterr().out.splitlines() == [
+        "SUCCESS: Edited 2 expenses.",
+        "SUCCESS: Edited 1 expenses.",
+        "ERROR: Choose the expenses to edit by id or with --where.",
+        "SUCCESS: Deleted 2 expenses.",
+        "ERROR: Choose the expenses to delete by id or with --where.",
+        "SUCCESS: Deleted 1 incomes.",
+        "SUCCESS: Edited 0 incomes.",
+        "ERROR: Database error.",
+    ]
+    assert [(expense.id, expense.category) for expense in db.iter_expense_records()[1]] == [(3, ExpCategory.GAMING)]
+    assert db.get_balance() == (True, -30)
@@ -1,22 +1,14 @@
+import os
 import sqlite3
+import sys
 import pytest
 from datetime import date
 
 import db.database as db
+from db.filters import compile_filter, compile_search
 from internal_libs.expense import Expense, ExpCategory
 from internal_libs.income import Income, IncCategory
 
-@pytest.fixture
-def tmp_db(tmp_path):
-    """create a temporary db for testing"""
-
-    db_path = tmp_path / "test_finances.db"
-    success = db.init_db(db_path)
-
-    assert success, "Failed to initialize test database"
-
-    return db_path
-
 def test_init_db_creates_balance_table(tmp_db):
     """test if calling init_db creates the balance table 0 initialized"""
 
@@ -30,6 +22,45 @@ def test_init_db_creates_balance_table(tmp_db):
 
     assert balance == 0
 
+def test_init_db_sets_schema_version(tmp_db, monkeypatch):
+    """test that init_db records the schema version and skips all the bootstrap work once it is current"""
+
+    connection = sqlite3.connect(tmp_db)
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION
+    connection.close()
+
+    def fail(*args):
+        raise AssertionError("the schema should not be applied again")
+
+    monkeypatch.setattr(db, "_read_schema", fail)
+    assert db.init_db(tmp_db)
+
+def test_init_db_upgrades_unversioned_db(tmp_db):
+    """test that a db without a schema version (older release) is bootstrapped again"""
+
+    connection = sqlite3.connect(tmp_db)
+    connection.execute("DROP INDEX expenses_date_idx")
+    connection.execute("PRAGMA user_version = 0")
+    connection.commit()
+    connection.close()
+
+    assert db.init_db(tmp_db)
+
+    connection = sqlite3.connect(tmp_db)
+    assert connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'expenses_date_idx'").fetchone() is not None
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION
+    connection.close()
+
+def test_init_db_newer_schema_version(tmp_db):
+    """test that init_db refuses a db written by a newer release"""
+
+    connection = sqlite3.connect(tmp_db)
+    connection.execute(f"PRAGMA user_version = {db.SCHEMA_VERSION + 1}")
+    connection.commit()
+    connection.close()
+
+    assert not db.init_db(tmp_db)
+
 def test_init_db_negative_1(monkeypatch):
     """test if init_db returns False when a database error is raised"""
 
@@ -376,3 +407,1117 @@ def test_delete_income_negative_2(monkeypatch):
     monkeypatch.setattr(sqlite3, "connect", mock_connect)
 
     assert not db.del_income(1, db_path = "fake_path")
+
+def test_session_reuses_connection(tmp_db):
+    """test that db functions accept a Session and share its connection"""
+
+    with db.Session(tmp_db) as session:
+        assert db.add_expense(Expense(50), session)
+        assert db.add_income(Income(80), session)
+
+        success, expenses = db.get_expenses(session)
+        assert success
+        assert len(expenses) == 1
+
+        success, balance = db.get_balance(session)
+        assert success
+        assert balance == 30
+
+    # the changes were committed and are visible to a plain db path call
+    success, balance = db.get_balance(tmp_db)
+    assert success
+    assert balance == 30
+
+def test_session_rolls_back_on_error(tmp_db):
+    """test that a failed call through a session does not leave a pending transaction behind"""
+
+    with db.Session(tmp_db) as session:
+        assert not db.del_expense(1, session) # no expense with id 1, fails after nothing was written
+        assert not db.edit_expense(1, new_amount = 10, db_path = session)
+        assert not session.connection.in_transaction
+
+        assert db.add_expense(Expense(10), session)
+        success, balance = db.get_balance(session)
+        assert balance == -10
+
+def test_session_group(tmp_db):
+    """test that grouped calls commit together and a failing call only undoes its own changes"""
+
+    bad_expense = Expense(10, description = "never stored")
+    bad_expense.category = "not a category" # fails after its description was inserted
+
+    with db.Session(tmp_db) as session:
+        with session.group():
+            assert db.add_expense(Expense(10, description = "kept"), session)
+            assert not db.add_expense(bad_expense, session)
+            assert db.add_income(Income(50), session)
+
+            # nothing is visible to other connections before the group ends
+            assert db.get_balance(tmp_db) == (True, 0)
+
+        assert db.get_balance(tmp_db) == (True, 40)
+
+        with pytest.raises(RuntimeError):
+            with session.group():
+                assert db.add_income(Income(5), session)
+                raise RuntimeError("abort the group")
+
+        assert not session.grouped
+        assert db.get_balance(session) == (True, 40)
+
+    connection = sqlite3.connect(tmp_db)
+    assert connection.execute("SELECT text FROM descriptions ORDER BY text").fetchall() == [("",), ("kept",)]
+    connection.close()
+
+def test_use_session(tmp_db):
+    """test that calls made with the path of a session in use are routed through it"""
+
+    with db.Session(tmp_db) as session, db.use_session(session):
+        session.begin_group()
+        assert db.add_income(Income(20), tmp_db)
+        assert db.add_expense(Expense(5), tmp_db)
+        assert session.connection.in_transaction
+
+        # streamed listings read through the session too, so they see the pending rows
+        success, rows = db.iter_expenses(db_path = tmp_db)
+        assert success
+        assert len(list(rows)) == 1
+        session.end_group()
+
+    assert tmp_db not in db._default_sessions
+    assert db.get_balance(tmp_db) == (True, 15)
+
+PROFILES_CACHE = {name: pragmas["cache_size"] for name, pragmas in db.PROFILES.items()}
+
+@pytest.mark.parametrize("profile, synchronous", [("durable", 2), ("balanced", 1), ("bulk-load", 0)])
+def test_profiles_applied_to_connections(tmp_db, monkeypatch, profile, synchronous):
+    """test that the selected profile is applied to path connections, sessions and streamed listings"""
+
+    monkeypatch.setattr(db, "_profile", db.DEFAULT_PROFILE)
+    assert db.set_profile(profile)
+    assert db.get_profile() == profile
+
+    with db._connect(tmp_db) as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert connection.execute("PRAGMA synchronous").fetchone()[0] == synchronous
+        assert connection.execute("PRAGMA cache_size").fetchone()[0] == PROFILES_CACHE[profile]
+
+    with db.Session(tmp_db) as session:
+        assert session.connection.execute("PRAGMA synchronous").fetchone()[0] == synchronous
+
+    real_connect = sqlite3.connect
+    opened = []
+    monkeypatch.setattr(sqlite3, "connect", lambda path, **kwargs: opened.append(real_connect(path, **kwargs)) or opened[-1])
+    success, rows = db.iter_expenses(db_path = tmp_db)
+    assert success
+    assert opened[0].execute("PRAGMA synchronous").fetchone()[0] == synchronous
+    list(rows)
+
+def test_set_profile_negative(monkeypatch):
+    """test that an unknown profile is refused and the current one is kept"""
+
+    monkeypatch.setattr(db, "_profile", db.DEFAULT_PROFILE)
+    assert not db.set_profile("fastest")
+    assert db.get_profile() == db.DEFAULT_PROFILE
+
+def test_read_only(tmp_db, tmp_path):
+    """test that read-only connections read next to a writer, never write and never create the file"""
+
+    db.add_expense(Expense(10, date(2024, 1, 5), "coffee", ExpCategory.FOOD), tmp_db)
+    read_only = db.ReadOnly(str(tmp_db))
+
+    with db._connect(read_only) as connection:
+        assert connection.execute("PRAGMA mmap_size").fetchone()[0] == db.READ_ONLY_MMAP_SIZE
+        assert connection.execute("PRAGMA query_only").fetchone()[0] == 1
+
+    assert db.get_balance(read_only) == (True, -10)
+    assert db.get_monthly_totals(db_path = read_only)[1] == [("exp", "2024-01", "FOOD", 10, 1)]
+    assert [expense.id for expense in db.iter_expense_records(db_path = read_only)[1]] == [1]
+    assert len(db.search(compile_search("coffee"), db_path = read_only)[1]) == 1
+
+    # a read-only session sees what a writer commits meanwhile
+    with db.Session(read_only) as session:
+        assert db.add_income(Income(30), tmp_db)
+        assert db.get_balance(session) == (True, 20)
+        assert not db.add_expense(Expense(5), session)
+
+    assert not db.set_balance(0, read_only)
+    assert db.get_balance(tmp_db) == (True, 20)
+
+    missing = tmp_path / "missing.db"
+    assert db.get_balance(db.ReadOnly(str(missing))) == (False, "Database error")
+    assert not missing.exists()
+
+def test_use_read_only(tmp_db):
+    """test that calls and sessions on a path routed by use_read_only are read-only, and the route is undone"""
+
+    db.add_expense(Expense(10), tmp_db)
+    path = str(tmp_db)
+
+    with db.use_read_only(path):
+        assert db.get_balance(path) == (True, -10)
+        assert not db.add_expense(Expense(5), path)
+
+        with db.Session(path) as session, db.use_session(session):
+            assert not db.add_expense(Expense(5), path)
+        assert db._default_sessions[path] == db.ReadOnly(path)
+
+    assert path not in db._default_sessions
+    assert db.add_expense(Expense(5), path)
+
+def test_read_only_immutable(tmp_db):
+    """test that an immutable connection reads a checkpointed db without locking it"""
+
+    db.add_expense(Expense(10), tmp_db)
+    with db._connect(tmp_db) as connection:
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    assert db.get_balance(db.ReadOnly(str(tmp_db), immutable = True)) == (True, -10)
+
+def test_session_pool_threads(tmp_db):
+    """test that multiple threads can write through a session pool"""
+
+    import threading
+
+    pool = db.SessionPool(tmp_db, size = 2)
+
+    def worker():
+        for _ in range(25):
+            with pool.session() as session:
+                assert db.add_income(Income(1), session)
+
+    threads = [threading.Thread(target = worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert pool._created <= 2
+    pool.close()
+
+    success, balance = db.get_balance(tmp_db)
+    assert success
+    assert balance == 100
+
+def test_import_expenses(tmp_db):
+    """test the db import_expenses function with several batches"""
+
+    expenses = (Expense(i, date(2024, 1, i), f"row {i}", ExpCategory.FOOD) for i in range(1, 8))
+    success, imported = db.import_expenses(expenses, tmp_db, batch_size = 3)
+
+    assert success
+    assert imported == 7
+
+    _, expenses = db.get_expenses(tmp_db)
+    _, balance = db.get_balance(tmp_db)
+
+    assert len(expenses) == 7
+    assert expenses[6][1] == "2024-01-07"
+    assert balance == -28
+
+def test_import_incomes(tmp_db):
+    """test the db import_incomes function"""
+
+    success, imported = db.import_incomes([Income(100), Income(50, category = IncCategory.SALARY)], tmp_db)
+    _, balance = db.get_balance(tmp_db)
+
+    assert success
+    assert imported == 2
+    assert balance == 150
+
+def test_import_expenses_invalid_row(tmp_db):
+    """test that an invalid row aborts the whole import without writing anything"""
+
+    def rows():
+        for i in range(5):
+            yield Expense(10)
+        raise ValueError("Line 7: bad row")
+
+    success, msg = db.import_expenses(rows(), tmp_db, batch_size = 2)
+    _, expenses = db.get_expenses(tmp_db)
+    _, balance = db.get_balance(tmp_db)
+
+    assert not success
+    assert msg == "Line 7: bad row"
+    assert expenses == []
+    assert balance == 0
+
+    # the insert triggers the import dropped came back with the rollback
+    db.add_expense(Expense(10), tmp_db)
+    assert db.get_balance(tmp_db) == (True, -10)
+
+def test_import_adds_batches_to_balance_and_rollups(tmp_db):
+    """test that an import, without its insert triggers, leaves the same balance and rollups as single writes"""
+
+    db.add_expense(Expense(1, date(2024, 1, 1), "before", ExpCategory.FOOD), tmp_db)
+    db.import_expenses([Expense(i, date(2024, i % 3 + 1, 1), category = ExpCategory.FOOD if i % 2 else ExpCategory.GAMING)
+                        for i in range(1, 8)], tmp_db, batch_size = 3)
+    db.import_incomes([Income(100, date(2024, 2, 1)), Income(50, date(2024, 3, 1))], tmp_db, batch_size = 1)
+
+    connection = sqlite3.connect(tmp_db)
+    triggers = {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    totals = connection.execute("SELECT * FROM monthly_totals ORDER BY 1, 2, 3").fetchall()
+    connection.close()
+
+    assert {f"{table}_{name}_insert" for table in ("expenses", "incomes") for name in db.IMPORT_SUSPENDED_TRIGGERS} <= triggers
+    assert db.get_balance(tmp_db) == (True, 121)
+    assert db.rebuild_monthly_totals(tmp_db)
+
+    connection = sqlite3.connect(tmp_db)
+    assert connection.execute("SELECT * FROM monthly_totals ORDER BY 1, 2, 3").fetchall() == totals
+    connection.close()
+
+def test_import_incomes_negative(monkeypatch):
+    """test if import_incomes returns False when a database error is raised"""
+
+    def mock_connect(_):
+        raise sqlite3.Error("connection failed")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    success, msg = db.import_incomes([Income(1)], "fake_path")
+
+    assert not success
+    assert msg == "Database error"
+
+def test_init_db_creates_indexes_on_existing_db(tmp_path):
+    """test that init_db adds the date/category/month indexes to a db created before they existed"""
+
+    db_path = tmp_path / "old_finances.db"
+    connection = sqlite3.connect(db_path)
+    connection.executescript("""
+        CREATE TABLE expenses (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, description TEXT, category TEXT, amount REAL NOT NULL);
+        CREATE TABLE incomes (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, description TEXT, category TEXT, amount REAL NOT NULL);
+        CREATE TABLE balance (id INTEGER PRIMARY KEY CHECK (id = 1), curr_balance REAL NOT NULL DEFAULT 0);
+        INSERT INTO balance VALUES (1, 0);
+        INSERT INTO expenses (date, description, category, amount) VALUES ('2024-01-01', 'old', 'FOOD', 5);
+    """)
+    connection.close()
+
+    assert db.init_db(db_path)
+
+    connection = sqlite3.connect(db_path)
+    indexes = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    count = connection.execute("SELECT COUNT(*) FROM expenses").fetchone()[0]
+    connection.close()
+
+    assert count == 1
+    for table in ("expenses", "incomes"):
+        assert {f"{table}_date_idx", f"{table}_category_date_idx", f"{table}_month_idx"} <= indexes
+
+@pytest.mark.parametrize("query, index", [
+    ("SELECT * FROM expenses WHERE day BETWEEN 19723 AND 19754", "expenses_date_idx"),
+    ("SELECT * FROM expenses WHERE category = 'FOOD' AND day >= 19723", "expenses_category_date_idx"),
+    ("SELECT SUM(cents) FROM incomes WHERE strftime('%Y-%m', day * 86400, 'unixepoch') = '2024-01'", "incomes_month_idx"),
+])
+def test_queries_use_indexes(tmp_db, query, index):
+    """test that date, category and month lookups are index searches instead of table scans"""
+
+    connection = sqlite3.connect(tmp_db)
+    plan = " ".join(row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {query}"))
+    connection.close()
+
+    assert f"USING INDEX {index}" in plan
+
+def test_edit_expense_stores_category_name(tmp_db):
+    """test that editing with a category enum stores its name like add_expense does"""
+
+    db.add_expense(Expense(5), tmp_db)
+    assert db.edit_expense(1, new_category = ExpCategory.GAMING, db_path = tmp_db)
+    assert db.edit_income(1, new_category = IncCategory.SALARY, db_path = tmp_db) is False # no income with id 1
+
+    _, expenses = db.get_expenses(tmp_db)
+    assert expenses[0][3] == "GAMING"
+
+def test_iter_expenses_pagination(tmp_db):
+    """test the keyset pagination options of the db iter_expenses function"""
+
+    for day in range(1, 11):
+        db.add_expense(Expense(day, date(2024, 1, day)), tmp_db)
+
+    success, rows = db.iter_expenses(limit = 3, db_path = tmp_db)
+    assert success
+    assert [row[0] for row in rows] == [1, 2, 3]
+
+    _, rows = db.iter_expenses(limit = 3, after_id = 3, db_path = tmp_db)
+    assert [row[0] for row in rows] == [4, 5, 6]
+
+    _, rows = db.iter_expenses(limit = 2, after_id = 5, order = "desc", db_path = tmp_db)
+    assert [row[0] for row in rows] == [4, 3]
+
+    _, rows = db.iter_expenses(before_date = date(2024, 1, 4), db_path = tmp_db, chunk_size = 1)
+    assert [row[1] for row in rows] == ["2024-01-01", "2024-01-02", "2024-01-03"]
+
+def test_iter_incomes_session(tmp_db):
+    """test that iter_incomes streams through a session without closing its connection"""
+
+    with db.Session(tmp_db) as session:
+        db.add_income(Income(10), session)
+        db.add_income(Income(20), session)
+
+        success, rows = db.iter_incomes(order = "desc", db_path = session)
+        assert success
+        assert [row[4] for row in rows] == [20, 10]
+
+        success, balance = db.get_balance(session)
+        assert balance == 30
+
+def test_iter_records(tmp_db):
+    """test that the record listings build Expense/Income objects straight from the stored columns"""
+
+    db.add_expense(Expense(12.34, date(2024, 1, 5), "Groceries", ExpCategory.FOOD), tmp_db)
+    db.add_expense(Expense(3, date(2024, 1, 6)), tmp_db)
+    db.add_income(Income(1500, date(2024, 1, 31), "Salary", IncCategory.SALARY), tmp_db)
+
+    success, records = db.iter_expense_records(order = "desc", db_path = tmp_db)
+    assert success
+    records = list(records)
+    assert [record.id for record in records] == [2, 1]
+    assert records[1].amount == 12.34
+    assert records[1].date == date(2024, 1, 5)
+    assert records[1].description == "Groceries"
+    assert records[1].category == ExpCategory.FOOD
+
+    with db.Session(tmp_db) as session:
+        success, records = db.iter_income_records(db_path = session)
+        assert success
+        assert [(record.id, record.amount, record.category) for record in records] == [(1, 1500, IncCategory.SALARY)]
+
+def test_record_row_factories():
+    """test the category decoding of the row factories, including values written by older releases"""
+
+    assert db.expense_row_factory(None, (1, 0, "a", "FOOD", 250)).category == ExpCategory.FOOD
+    assert db.expense_row_factory(None, (1, 0, "a", "Transport", 250)).category == ExpCategory.TRANSPORT
+    assert db.expense_row_factory(None, (1, 0, "a", None, 250)).category == ExpCategory.OTHER
+
+    income = db.income_row_factory(None, (3, 1, "b", "SALARY", 5))
+    assert (income.id, income.date, income.amount, income.category) == (3, date(1970, 1, 2), 0.05, IncCategory.SALARY)
+
+def test_iter_expenses_negative_1(monkeypatch):
+    """test if iter_expenses returns False when a database error is raised"""
+
+    def mock_connect(*args, **kwargs):
+        raise sqlite3.Error("connection failed")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    success, msg = db.iter_expenses(db_path = "fake_path")
+
+    assert not success
+    assert msg == "Database error"
+
+def test_iter_incomes_negative_2(monkeypatch):
+    """test if iter_incomes returns False when a generic error is raised"""
+
+    def mock_connect(_):
+        raise RuntimeError("generic error")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    success, msg = db.iter_incomes(db_path = "fake_path")
+
+    assert not success
+    assert msg == "Unexpected error"
+
+def test_iter_expenses_where(tmp_db):
+    """test that a compiled filter is applied by iter_expenses in SQL"""
+
+    from db.filters import compile_filter
+
+    db.add_expense(Expense(10, date(2024, 1, 5), "Amazon order", ExpCategory.OTHER), tmp_db)
+    db.add_expense(Expense(60, date(2024, 2, 5), "Dinner", ExpCategory.FOOD), tmp_db)
+    db.add_expense(Expense(5, date(2023, 12, 5), "amazon prime", ExpCategory.OTHER), tmp_db)
+
+    where = compile_filter("date >= 2024-01-01 and (description ~ amazon or category = food)", ExpCategory)
+    _, rows = db.iter_expenses(where = where, db_path = tmp_db)
+    assert [row[0] for row in rows] == [1, 2]
+
+    where = compile_filter("amount < 50 and description ~ AMAZON")
+    _, rows = db.iter_expenses(order = "desc", where = where, db_path = tmp_db)
+    assert [row[0] for row in rows] == [3, 1]
+
+def test_monthly_totals_follow_writes(tmp_db):
+    """test that the rollup is kept up to date by adds, edits and deletes"""
+
+    db.add_expense(Expense(10, date(2024, 1, 5), "", ExpCategory.FOOD), tmp_db)
+    db.add_expense(Expense(15, date(2024, 1, 20), "", ExpCategory.FOOD), tmp_db)
+    db.add_expense(Expense(7, date(2024, 2, 1), "", ExpCategory.GAMING), tmp_db)
+    db.add_income(Income(100, date(2024, 1, 31), "", IncCategory.SALARY), tmp_db)
+
+    success, totals = db.get_monthly_totals(db_path = tmp_db)
+    assert success
+    assert totals == [("exp", "2024-01", "FOOD", 25, 2),
+                      ("inc", "2024-01", "SALARY", 100, 1),
+                      ("exp", "2024-02", "GAMING", 7, 1)]
+
+    db.edit_expense(2, new_date = date(2024, 2, 3), new_amount = 20, db_path = tmp_db)
+    db.del_expense(3, tmp_db)
+    db.edit_income(1, new_category = IncCategory.INVESTMENT, db_path = tmp_db)
+
+    _, totals = db.get_monthly_totals(db_path = tmp_db)
+    assert totals == [("exp", "2024-01", "FOOD", 10, 1),
+                      ("inc", "2024-01", "INVESTMENT", 100, 1),
+                      ("exp", "2024-02", "FOOD", 20, 1)]
+
+    _, totals = db.get_monthly_totals("exp", "2024-02", "2024-12", tmp_db)
+    assert totals == [("exp", "2024-02", "FOOD", 20, 1)]
+
+def test_rebuild_monthly_totals(tmp_db):
+    """test that the rollup can be recomputed from scratch and is backfilled for older dbs"""
+
+    db.import_expenses([Expense(i, date(2023, i, 1)) for i in range(1, 13)], tmp_db)
+
+    connection = sqlite3.connect(tmp_db)
+    connection.execute("DELETE FROM monthly_totals")
+    connection.execute("PRAGMA user_version = 0") # as written by a release before schema versions
+    connection.commit()
+    connection.close()
+
+    assert db.init_db(tmp_db) # rows without a rollup are backfilled
+    _, totals = db.get_monthly_totals(db_path = tmp_db)
+    assert len(totals) == 12
+
+    connection = sqlite3.connect(tmp_db)
+    connection.execute("UPDATE monthly_totals SET total = 0")
+    connection.commit()
+    connection.close()
+
+    assert db.rebuild_monthly_totals(tmp_db)
+    _, totals = db.get_monthly_totals(db_path = tmp_db)
+    assert sum(row[3] for row in totals) == 78
+
+def test_get_monthly_totals_negative(monkeypatch):
+    """test if get_monthly_totals and rebuild_monthly_totals fail when a database error is raised"""
+
+    def mock_connect(_):
+        raise sqlite3.Error("connection failed")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    success, msg = db.get_monthly_totals(db_path = "fake_path")
+
+    assert not success
+    assert msg == "Database error"
+    assert not db.rebuild_monthly_totals("fake_path")
+
+def test_balance_follows_edits_and_deletes(tmp_db):
+    """test that the balance triggers keep the balance in sync with every write"""
+
+    db.set_balance(100, tmp_db)
+    db.add_expense(Expense(30), tmp_db)
+    db.add_income(Income(50), tmp_db)
+    db.edit_expense(1, new_amount = 40, db_path = tmp_db)
+    db.edit_income(1, new_amount = 70, db_path = tmp_db)
+
+    _, balance = db.get_balance(tmp_db)
+    assert balance == 130
+
+    db.del_expense(1, tmp_db)
+    db.del_income(1, tmp_db)
+
+    _, balance = db.get_balance(tmp_db)
+    assert balance == 100
+
+    assert not db.del_expense(1, tmp_db) # already deleted, balance untouched
+    _, balance = db.get_balance(tmp_db)
+    assert balance == 100
+
+def _stress_writer(db_path, worker, writes):
+    failures = 0
+    for i in range(writes):
+        if worker % 2:
+            failures += not db.add_income(Income(5), db_path)
+        else:
+            failures += not db.add_expense(Expense(1), db_path)
+            failures += not db.edit_expense(worker * writes + i + 1, new_amount = 2, db_path = db_path)
+    sys.exit(failures)
+
+def test_balance_concurrent_writers(tmp_path):
+    """test that concurrent writer processes never lose a balance update"""
+
+    import multiprocessing
+
+    db_path = str(tmp_path / "stress.db")
+    db.init_db(db_path)
+
+    # reserve the expense ids each even worker edits so they never touch each other's rows
+    workers, writes = 6, 40
+    db.import_expenses([Expense(0)] * (workers * writes), db_path)
+    db.set_balance(0, db_path)
+
+    processes = [multiprocessing.Process(target = _stress_writer, args = (db_path, worker, writes)) for worker in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert [process.exitcode for process in processes] == [0] * workers
+
+    # 3 income workers add 5 per write, 3 expense workers add 1 and raise a reserved 0 expense to 2
+    _, balance = db.get_balance(db_path)
+    assert balance == 3 * writes * 5 - 3 * writes * (1 + 2)
+
+def _bulk_stress_writer(db_path, worker, writes):
+    failures = 0
+    for i in range(writes):
+        if worker % 2:
+            failures += not db.add_income(Income(5), db_path)
+        else:
+            # each write raises two reserved 0 expenses to 1 by id and deletes the previous pair by filter
+            first = (worker * writes + i) * 2 + 1
+            failures += db.edit_expenses([first, first + 1], new_amount = 1, db_path = db_path) != (True, 2)
+            if i:
+                failures += db.del_expenses(where = db.Filter("id IN (?, ?)", [first - 2, first - 1]), db_path = db_path) != (True, 2)
+    sys.exit(failures)
+
+def test_bulk_concurrent_writers(tmp_path):
+    """test that bulk edits and deletes in concurrent writer processes never fail or lose a balance update"""
+
+    import multiprocessing
+
+    db_path = str(tmp_path / "stress.db")
+    db.init_db(db_path)
+
+    workers, writes = 6, 30
+    db.import_expenses([Expense(0)] * (workers * writes * 2), db_path)
+    db.set_balance(0, db_path)
+
+    processes = [multiprocessing.Process(target = _bulk_stress_writer, args = (db_path, worker, writes)) for worker in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert [process.exitcode for process in processes] == [0] * workers
+
+    # 3 income workers add 5 per write, each expense worker keeps only its last pair of 1 expenses
+    _, balance = db.get_balance(db_path)
+    assert balance == 3 * writes * 5 - 3 * 2
+
+def test_balance_at_and_series(tmp_db):
+    """test point in time balances, including writes that change past days"""
+
+    db.set_balance(100, tmp_db) # opening balance
+    db.add_income(Income(1000, date(2023, 6, 1)), tmp_db)
+    db.add_expense(Expense(200, date(2023, 6, 15)), tmp_db)
+    db.add_expense(Expense(50, date(2023, 7, 1)), tmp_db)
+
+    assert db.get_balance_at(date(2023, 5, 31), tmp_db) == (True, 100)
+    assert db.get_balance_at(date(2023, 6, 30), tmp_db) == (True, 900)
+    assert db.get_balance_at(date(2024, 1, 1), tmp_db) == (True, 850)
+
+    # back dated entry and edits move every later day
+    db.add_expense(Expense(25, date(2023, 6, 10)), tmp_db)
+    db.edit_income(1, new_date = date(2023, 6, 20), db_path = tmp_db)
+    db.del_expense(1, tmp_db)
+
+    assert db.get_balance_at(date(2023, 6, 15), tmp_db) == (True, 75)
+    assert db.get_balance_at(date(2023, 6, 30), tmp_db) == (True, 1075)
+
+    success, series = db.get_balance_series(date(2023, 6, 1), date(2023, 7, 31), tmp_db)
+    assert success
+    assert series == [(date(2023, 6, 1), 100), (date(2023, 6, 10), 75), (date(2023, 6, 20), 1075), (date(2023, 7, 1), 1025)]
+
+    _, balance = db.get_balance(tmp_db)
+    assert balance == 1025
+
+def test_rebuild_daily_balance(tmp_db):
+    """test that the running totals can be recomputed and are backfilled for older dbs"""
+
+    db.import_expenses([Expense(i, date(2023, 1, i)) for i in range(1, 6)], tmp_db)
+    db.import_incomes([Income(100, date(2023, 1, 3))], tmp_db)
+
+    connection = sqlite3.connect(tmp_db)
+    expected = connection.execute("SELECT * FROM daily_balance ORDER BY day").fetchall()
+    connection.execute("DELETE FROM daily_balance")
+    connection.execute("PRAGMA user_version = 0") # as written by a release before schema versions
+    connection.commit()
+    connection.close()
+
+    assert db.init_db(tmp_db)
+
+    connection = sqlite3.connect(tmp_db)
+    assert connection.execute("SELECT * FROM daily_balance ORDER BY day").fetchall() == expected
+    connection.close()
+
+    assert db.rebuild_daily_balance(tmp_db)
+    assert db.get_balance_at(date(2023, 1, 3), tmp_db) == (True, 94)
+
+def test_import_updates_daily_balance(tmp_db):
+    """test that a bulk import into a db with later entries leaves the same running totals as a rebuild"""
+
+    db.add_expense(Expense(10, date(2023, 3, 1)), tmp_db)
+    db.add_income(Income(40, date(2023, 1, 2)), tmp_db)
+    db.import_expenses([Expense(i, date(2023, 1, i % 4 + 1)) for i in range(1, 9)], tmp_db)
+    db.import_incomes([Income(5, date(2023, 1, 2)), Income(1, date(2023, 2, 1))], tmp_db)
+
+    connection = sqlite3.connect(tmp_db)
+    imported = connection.execute("SELECT * FROM daily_balance ORDER BY day").fetchall()
+    assert connection.execute("SELECT COUNT(*) FROM daily_balance_deferred").fetchone()[0] == 0
+    connection.close()
+
+    assert db.rebuild_daily_balance(tmp_db)
+
+    connection = sqlite3.connect(tmp_db)
+    assert connection.execute("SELECT * FROM daily_balance ORDER BY day").fetchall() == imported
+    connection.close()
+
+    assert db.get_balance_at(date(2023, 2, 28), tmp_db) == (True, 10)
+
+    # single row writes after an import still go through the triggers
+    db.add_expense(Expense(3, date(2023, 1, 1)), tmp_db)
+    assert db.get_balance_at(date(2023, 2, 28), tmp_db) == (True, 7)
+
+def test_balance_history_negative(monkeypatch):
+    """test if the balance history functions fail when a database error is raised"""
+
+    def mock_connect(_):
+        raise sqlite3.Error("connection failed")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    assert db.get_balance_at(date(2024, 1, 1), "fake_path") == (False, "Database error")
+    assert db.get_balance_series(date(2024, 1, 1), date(2024, 2, 1), "fake_path") == (False, "Database error")
+    assert not db.rebuild_daily_balance("fake_path")
+
+def test_iter_columns(tmp_db):
+    """test the integer column chunks used by the analytics, including categories written by older releases"""
+
+    db.import_expenses([Expense(i, date(2024, 1, i), category = ExpCategory.GAMING) for i in range(1, 6)], tmp_db)
+    connection = sqlite3.connect(tmp_db)
+    connection.execute("UPDATE expenses SET category = 'Gaming' WHERE id = 5")
+    connection.commit()
+    connection.close()
+
+    success, chunks = db.iter_columns("exp", start = date(2024, 1, 2), end = date(2024, 1, 5), db_path = tmp_db, chunk_size = 2)
+    assert success
+    chunks = list(chunks)
+    gaming = list(ExpCategory).index(ExpCategory.GAMING)
+    assert [len(chunk) for chunk in chunks] == [2, 2]
+    assert [row for chunk in chunks for row in chunk] == [(db.to_day(date(2024, 1, i)), gaming, i * 100) for i in range(2, 6)]
+
+    assert db.iter_columns("unknown", db_path = tmp_db) == (False, "Unexpected error")
+
+def test_iter_columns_negative(monkeypatch):
+    """test if iter_columns returns False when a database error is raised"""
+
+    def mock_connect(*args, **kwargs):
+        raise sqlite3.Error("connection failed")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    assert db.iter_columns("inc", db_path = "fake_path") == (False, "Database error")
+
+
+def test_search(tmp_db):
+    """test ranked, paginated search over the descriptions of expenses and incomes"""
+
+    db.add_expense(Expense(10, date(2024, 1, 5), "Amazon order", ExpCategory.FOOD), tmp_db)
+    db.add_expense(Expense(20, date(2024, 1, 6), "amazon", ExpCategory.FOOD), tmp_db)
+    db.add_expense(Expense(30, date(2024, 1, 7), "monthly rent", ExpCategory.UTILITIES), tmp_db)
+    db.add_income(Income(5, date(2024, 1, 8), "Amazon refund for the order", IncCategory.OTHER), tmp_db)
+
+    success, records = db.search(compile_search("amazon"), db_path = tmp_db)
+    assert success
+    # the shortest description is the most relevant one
+    assert [(type(record), record.id) for record in records] == [(Expense, 2), (Expense, 1), (Income, 1)]
+
+    _, records = db.search(compile_search("amaz*"), "inc", db_path = tmp_db)
+    assert [(type(record), record.id) for record in records] == [(Income, 1)]
+
+    _, records = db.search(compile_search('"amazon order"'), db_path = tmp_db)
+    assert [record.description for record in records] == ["Amazon order"]
+
+    _, page = db.search(compile_search("amazon"), limit = 2, offset = 2, db_path = tmp_db)
+    assert [(type(record), record.id) for record in page] == [(Income, 1)]
+
+    assert db.search(compile_search("rent"), "exp", db_path = tmp_db)[1][0].category == ExpCategory.UTILITIES
+    assert db.search(compile_search("salary"), db_path = tmp_db) == (True, [])
+
+def test_search_follows_writes(tmp_db):
+    """test that adds, edits, deletes and imports are found by the search right away"""
+
+    db.add_expense(Expense(10, date(2024, 1, 5), "coffee"), tmp_db)
+    db.import_expenses([Expense(1, date(2024, 1, 6), f"bakery {i}") for i in range(3)] + [Expense(2, description = "coffee")], tmp_db)
+    assert len(db.search(compile_search("bakery"), db_path = tmp_db)[1]) == 3
+    assert len(db.search(compile_search("coffee"), db_path = tmp_db)[1]) == 2
+
+    db.edit_expense(1, new_description = "tea", db_path = tmp_db)
+    db.del_expense(5, tmp_db)
+    assert db.search(compile_search("coffee"), db_path = tmp_db) == (True, [])
+    assert [record.id for record in db.search(compile_search("tea"), db_path = tmp_db)[1]] == [1]
+
+def test_search_backfilled_for_older_dbs(tmp_db):
+    """test that a db created before the search index existed has its descriptions indexed by init_db"""
+
+    db.add_expense(Expense(10, date(2024, 1, 5), "old description"), tmp_db)
+
+    connection = sqlite3.connect(tmp_db)
+    for trigger in ("insert", "delete", "update"):
+        connection.execute(f"DROP TRIGGER descriptions_search_{trigger}")
+    connection.execute("DROP TABLE descriptions_search")
+    connection.execute("PRAGMA user_version = 1")
+    connection.commit()
+    connection.close()
+
+    assert db.init_db(tmp_db)
+    _, records = db.search(compile_search("old"), db_path = tmp_db)
+    assert [record.description for record in records] == ["old description"]
+
+def test_search_negative(monkeypatch):
+    """test if search fails when a database error is raised"""
+
+    def mock_connect(_):
+        raise sqlite3.Error("connection failed")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    assert db.search(compile_search("amazon"), db_path = "fake_path") == (False, "Database error")
+
+def test_report_cache_hits_and_invalidation(tmp_db):
+    """test that report results are reused until a write that can change them"""
+
+    db.clear_cache()
+    db.add_expense(Expense(10, date(2024, 1, 5), "a", ExpCategory.FOOD), tmp_db)
+
+    first = db.get_monthly_totals(db_path = tmp_db)
+    assert db.get_monthly_totals(db_path = tmp_db) is first
+    assert db.get_monthly_totals("exp", db_path = tmp_db) is not first # other arguments, other entry
+    assert db.cache_stats() == {"hits": 1, "misses": 2, "entries": 2, "size": db.REPORT_CACHE_SIZE}
+
+    writes = [lambda: db.add_income(Income(5, date(2024, 1, 6)), tmp_db),
+              lambda: db.edit_expense(1, new_category = ExpCategory.OTHER, db_path = tmp_db),
+              lambda: db.edit_expense(1, new_date = date(2024, 2, 1), db_path = tmp_db),
+              lambda: db.del_income(1, tmp_db),
+              lambda: db.set_balance(100, tmp_db),
+              lambda: db.rebuild_daily_balance(tmp_db)]
+
+    for write in writes:
+        before = db.get_balance_series(date(2024, 1, 1), date(2024, 12, 31), tmp_db)
+        assert write()
+        assert db.get_balance_series(date(2024, 1, 1), date(2024, 12, 31), tmp_db) is not before
+
+    # a description edit can not change a report
+    before = db.get_balance_at(date(2024, 6, 1), tmp_db)
+    assert db.edit_expense(1, new_description = "b", db_path = tmp_db)
+    assert db.get_balance_at(date(2024, 6, 1), tmp_db) is before
+
+def test_report_cache_sees_other_connections(tmp_db):
+    """test that writes of another connection (or process) invalidate the cached results"""
+
+    db.clear_cache()
+    assert db.get_balance_at(date(2024, 1, 1), tmp_db) == (True, 0)
+
+    connection = sqlite3.connect(tmp_db)
+    connection.execute("INSERT INTO incomes (day, cents) VALUES (19000, 500)")
+    connection.commit()
+    connection.close()
+
+    assert db.get_balance_at(date(2024, 1, 1), tmp_db) == (True, 5)
+
+def test_report_cache_skipped(tmp_path, tmp_db):
+    """test that uncommitted results, a disabled cache and a new db at the same path are never served from the cache"""
+
+    db.clear_cache()
+
+    with db.Session(tmp_db) as session:
+        with session.group():
+            db.add_income(Income(5, date(2024, 1, 1)), session)
+            assert db.get_balance_at(date(2024, 1, 1), session) == (True, 5)
+            assert db.cache_stats()["entries"] == 0
+
+    db.set_cache_size(0)
+    try:
+        assert db.get_balance_at(date(2024, 1, 1), tmp_db) == (True, 5)
+        assert db.cache_stats() == {"hits": 0, "misses": 0, "entries": 0, "size": 0}
+    finally:
+        db.set_cache_size(db.REPORT_CACHE_SIZE)
+
+    db_path = tmp_path / "recreated.db"
+    assert db.init_db(db_path)
+    db.add_income(Income(5, date(2024, 1, 1)), db_path)
+    assert db.get_balance_at(date(2024, 1, 1), db_path) == (True, 5)
+    os.remove(db_path)
+    assert db.init_db(db_path)
+    assert db.get_balance_at(date(2024, 1, 1), db_path) == (True, 0)
+
+def test_report_cache_errors_not_cached(monkeypatch):
+    """test that a db that can not be read falls through to the function and its error return"""
+
+    db.clear_cache()
+
+    def mock_connect(_):
+        raise sqlite3.Error("connection failed")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    assert db.get_balance_at(date(2024, 1, 1), "fake_path") == (False, "Database error")
+    assert db.cache_stats()["entries"] == 0
+
+def test_iter_export(tmp_db):
+    """test that the export rows come formatted by SQLite, in id order and filtered"""
+
+    db.add_expense(Expense(10, date(2024, 1, 5), "Groceries, \"bio\"", ExpCategory.FOOD), tmp_db)
+    db.add_expense(Expense(0.1, date(2024, 2, 1), "Bus", ExpCategory.TRANSPORT), tmp_db)
+    db.add_income(Income(1500, date(2024, 1, 31), "Salary", IncCategory.SALARY), tmp_db)
+
+    success, chunks = db.iter_export("exp", db_path = tmp_db, chunk_size = 1)
+    assert success
+    assert list(chunks) == [[("exp", 1, "2024-01-05", "Groceries, \"bio\"", "Food", "10.00")],
+                            [("exp", 2, "2024-02-01", "Bus", "Transport", "0.10")]]
+
+    _, chunks = db.iter_export("inc", "jsonl", db_path = tmp_db)
+    assert list(chunks) == [[('{"type":"inc","id":1,"date":"2024-01-31","description":"Salary","category":"Salary","amount":1500.00}',)]]
+
+    _, chunks = db.iter_export("exp", start = date(2024, 1, 6), db_path = tmp_db)
+    assert [row[1] for chunk in chunks for row in chunk] == [2]
+    _, chunks = db.iter_export("exp", end = date(2024, 1, 5), where = compile_filter("category = food", ExpCategory), db_path = tmp_db)
+    assert [row[1] for chunk in chunks for row in chunk] == [1]
+
+def test_iter_export_negative(monkeypatch):
+    """test if iter_export fails on an unknown format or a database error"""
+
+    assert db.iter_export("exp", "xml", db_path = "fake_path") == (False, "Unexpected error")
+
+    def mock_connect(*args, **kwargs):
+        raise sqlite3.Error("connection failed")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    assert db.iter_export("exp", db_path = "fake_path") == (False, "Database error")
+
+def test_archive(tmp_db, tmp_path):
+    """test that archived entries leave the db but are still counted and read from their yearly shards"""
+
+    db.clear_cache()
+    db.import_expenses([Expense(10, date(2022, 3, 1), "old coffee", ExpCategory.FOOD),
+                        Expense(20, date(2023, 5, 2), "older rent", ExpCategory.UTILITIES),
+                        Expense(30, date(2024, 1, 3), "new coffee", ExpCategory.FOOD)], tmp_db)
+    db.import_incomes([Income(100, date(2022, 12, 31), "salary", IncCategory.SALARY)], tmp_db)
+
+    balance = db.get_balance(tmp_db)
+    totals = db.get_monthly_totals(db_path = tmp_db)
+    series = db.get_balance_series(date(2022, 1, 1), date(2024, 12, 31), tmp_db)
+
+    assert db.archive(2024, tmp_db) == (True, (2, 1))
+    assert sorted(os.listdir(tmp_path)) == ["test_finances-2022.db", "test_finances-2023.db", "test_finances.db"]
+
+    connection = sqlite3.connect(tmp_db)
+    assert connection.execute("SELECT id FROM expenses").fetchall() == [(3,)]
+    assert connection.execute("SELECT COUNT(*) FROM incomes").fetchone()[0] == 0
+    connection.close()
+
+    # the history did not change, also when it is recomputed from scratch
+    for _ in range(2):
+        assert db.get_balance(tmp_db) == balance
+        assert db.get_monthly_totals(db_path = tmp_db) == totals
+        assert db.get_balance_series(date(2022, 1, 1), date(2024, 12, 31), tmp_db) == series
+        assert db.rebuild_monthly_totals(tmp_db) and db.rebuild_daily_balance(tmp_db)
+
+    # reads open the shards their range reaches
+    assert [expense.id for expense in db.iter_expense_records(db_path = tmp_db)[1]] == [1, 2, 3]
+    assert [row[0] for row in db.iter_expenses(2, order = "desc", db_path = tmp_db)[1]] == [3, 2]
+    assert [row[0] for row in db.iter_expenses(before_date = date(2023, 1, 1), db_path = tmp_db)[1]] == [1]
+    assert [row[0] for row in db.iter_expenses(where = compile_filter("category = food", ExpCategory), db_path = tmp_db)[1]] == [1, 3]
+    assert [row[0] for row in db.get_expenses(tmp_db)[1]] == [1, 2, 3]
+    assert [row for chunk in db.iter_columns("exp", date(2023, 1, 1), date(2023, 12, 31), tmp_db)[1] for row in chunk] == [(db.to_day(date(2023, 5, 2)), 3, 2000)]
+    assert [row[1] for chunk in db.iter_export("inc", db_path = tmp_db)[1] for row in chunk] == [1]
+    assert [(type(record), record.id) for record in db.search(compile_search("coffee"), db_path = tmp_db)[1]] == [(Expense, 3), (Expense, 1)]
+    assert [record.id for record in db.search(compile_search("coffee"), limit = 1, offset = 1, db_path = tmp_db)[1]] == [1]
+
+    # archived entries are read-only
+    assert not db.del_expense(1, tmp_db)
+    assert not db.edit_expense(1, new_amount = 5, db_path = tmp_db)
+
+def test_archive_again(tmp_db, tmp_path):
+    """test that a second run adds the new entries of an archived year to its shard and nothing else moves"""
+
+    db.add_expense(Expense(10, date(2022, 3, 1), "a"), tmp_db)
+    assert db.archive(2023, tmp_db) == (True, (1, 0))
+    assert db.archive(2023, tmp_db) == (True, (0, 0))
+
+    db.add_expense(Expense(5, date(2022, 4, 1), "b"), tmp_db)
+    assert db.archive(2023, tmp_db) == (True, (1, 0))
+    assert [expense.description for expense in db.iter_expense_records(db_path = tmp_db)[1]] == ["a", "b"]
+    assert db.get_balance(tmp_db) == (True, -15)
+    assert db.get_monthly_totals(db_path = tmp_db)[1] == [("exp", "2022-03", "OTHER", 10, 1), ("exp", "2022-04", "OTHER", 5, 1)]
+
+def test_archive_reads_open_filtered_shards(tmp_db, monkeypatch):
+    """test that a date bound in --where limits the shards a listing or export opens"""
+
+    db.import_expenses([Expense(day, date(year, 1, day)) for year in (2020, 2021, 2022) for day in (1, 2)], tmp_db)
+    assert db.archive(2023, tmp_db) == (True, (6, 0))
+
+    opened = []
+    open_connection = db._open_connection
+    monkeypatch.setattr(db, "_open_connection", lambda path, **kwargs: opened.append(path) or open_connection(path, **kwargs))
+
+    where = compile_filter("date >= 2021-01-01 and date < 2022-01-01", ExpCategory)
+    assert [row[0] for row in db.iter_expenses(where = where, db_path = tmp_db)[1]] == [3, 4]
+    assert [os.path.basename(path.path) for path in opened if isinstance(path, db.ReadOnly)] == ["test_finances-2021.db"]
+
+    opened.clear()
+    where = compile_filter("date = 2020-01-02 or amount > 100", ExpCategory)
+    assert [row[1] for chunk in db.iter_export("exp", where = where, db_path = tmp_db)[1] for row in chunk] == [2]
+    assert len([path for path in opened if isinstance(path, db.ReadOnly)]) == 3
+
+def test_archive_search_pages(tmp_db):
+    """test that search ranks each index on its own, the db first and then the shards from the newest year"""
+
+    db.import_expenses([Expense(1, date(2021, 1, 1), "coffee"), Expense(1, date(2021, 1, 2), "coffee coffee"),
+                        Expense(1, date(2022, 1, 1), "coffee"), Expense(1, date(2024, 1, 1), "coffee")], tmp_db)
+    assert db.archive(2023, tmp_db) == (True, (3, 0))
+
+    ids = lambda **page: [record.id for record in db.search(compile_search("coffee"), db_path = tmp_db, **page)[1]]
+    assert ids() == [4, 3, 2, 1]
+    assert ids(limit = 2, offset = 1) == [3, 2]
+    assert ids(limit = 2, offset = 2) == [2, 1]
+    assert ids(offset = 4) == []
+
+def test_archive_negative(tmp_db, tmp_path, monkeypatch):
+    """test that archive refuses in-memory dbs and grouped sessions, and that a missing shard fails the reads"""
+
+    assert db.archive(2020, ":memory:") == (False, "An in-memory db can not be archived")
+
+    db.add_expense(Expense(10, date(2022, 3, 1)), tmp_db)
+    with db.Session(tmp_db) as session, session.group():
+        assert db.archive(2023, session) == (False, "Can not archive inside a grouped session")
+
+    assert db.archive(2023, tmp_db) == (True, (1, 0))
+    os.remove(tmp_path / "test_finances-2022.db")
+    assert db.iter_expenses(db_path = tmp_db) == (False, "Database error")
+    assert db.iter_expenses(before_date = date(2022, 1, 1), db_path = tmp_db)[0]
+
+def test_archive_guard_added_to_older_dbs(tmp_db):
+    """test that init_db gives the delete triggers of a version 3 db the archive guard"""
+
+    connection = sqlite3.connect(tmp_db)
+    for trigger in db.ARCHIVE_GUARDED_TRIGGERS:
+        connection.execute(f"DROP TRIGGER {trigger}")
+    connection.execute("CREATE TRIGGER expenses_balance_delete AFTER DELETE ON expenses BEGIN SELECT 1; END")
+    connection.execute("PRAGMA user_version = 3")
+    connection.commit()
+    connection.close()
+
+    assert db.init_db(tmp_db)
+
+    connection = sqlite3.connect(tmp_db)
+    sql = dict(connection.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'"))
+    connection.close()
+    assert all("archiving" in sql[trigger] for trigger in db.ARCHIVE_GUARDED_TRIGGERS)
+
+def test_archive_migration_is_atomic(tmp_db, monkeypatch):
+    """test that a failing version 4 upgrade keeps the old triggers and version instead of leaving them dropped"""
+
+    connection = sqlite3.connect(tmp_db)
+    connection.execute("PRAGMA user_version = 3")
+    connection.commit()
+    connection.close()
+
+    schema = db._read_schema()
+    monkeypatch.setattr(db, "_read_schema", lambda: "SELECT no_such_function();\n" + schema)
+    assert not db.init_db(tmp_db)
+
+    connection = sqlite3.connect(tmp_db)
+    triggers = {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == 3
+    connection.close()
+    assert set(db.ARCHIVE_GUARDED_TRIGGERS) <= triggers
+
+def _derived_tables(db_path) -> tuple:
+    connection = sqlite3.connect(db_path)
+    tables = tuple(connection.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall() for table in ("balance", "monthly_totals", "daily_balance"))
+    connection.close()
+    return tables
+
+def test_bulk_edit_and_delete(tmp_db):
+    """test that bulk edits and deletes change every selected entry at once and keep the derived tables right"""
+
+    db.import_expenses([Expense(10 + i, date(2024, 1 + i % 3, 1 + i), "amazon" if i % 2 else "rent", ExpCategory.FOOD) for i in range(10)], tmp_db)
+    db.import_incomes([Income(100, date(2024, 2, i + 1), "salary", IncCategory.SALARY) for i in range(3)], tmp_db)
+    amazon = compile_filter("description ~ amazon", ExpCategory)
+
+    assert db.edit_expenses(where = amazon, new_category = ExpCategory.GAMING, db_path = tmp_db) == (True, 5)
+    assert db.edit_expenses([1, 2, 3, 42], new_amount = 5, new_date = date(2023, 12, 31), db_path = tmp_db) == (True, 3)
+    assert db.edit_expenses([1, 2], where = amazon, new_description = "shop", db_path = tmp_db) == (True, 1) # both ids and filter
+    assert db.del_expenses([4, 5, 6], db_path = tmp_db) == (True, 3)
+    assert db.del_expenses(where = compile_filter("category = gaming", ExpCategory), db_path = tmp_db) == (True, 3)
+    assert db.del_incomes(where = compile_filter("date > 2024-02-01", IncCategory), db_path = tmp_db) == (True, 2)
+    assert db.edit_incomes([1], new_amount = 50, db_path = tmp_db) == (True, 1)
+    assert db.del_expenses([42], db_path = tmp_db) == (True, 0)
+
+    expenses = list(db.iter_expense_records(db_path = tmp_db)[1])
+    assert [(expense.id, expense.amount, expense.date, expense.description, expense.category) for expense in expenses] == [
+        (1, 5, date(2023, 12, 31), "rent", ExpCategory.FOOD),
+        (3, 5, date(2023, 12, 31), "rent", ExpCategory.FOOD),
+        (7, 16, date(2024, 1, 7), "rent", ExpCategory.FOOD),
+        (9, 18, date(2024, 3, 9), "rent", ExpCategory.FOOD)]
+    assert db.get_balance(tmp_db) == (True, 6)
+
+    # the set-based updates match a recomputation from scratch, and the guard is released
+    derived = _derived_tables(tmp_db)
+    assert db.rebuild_monthly_totals(tmp_db) and db.rebuild_daily_balance(tmp_db)
+    assert _derived_tables(tmp_db) == derived
+
+    connection = sqlite3.connect(tmp_db)
+    assert connection.execute("SELECT COUNT(*) FROM bulk_writing").fetchone()[0] == 0
+    connection.close()
+
+def test_bulk_edit_and_delete_in_sessions(tmp_db):
+    """test bulk writes through a grouped session, where a failing call only undoes its own changes"""
+
+    db.import_expenses([Expense(10, date(2024, 1, 1)), Expense(20, date(2024, 1, 2))], tmp_db)
+
+    with db.Session(tmp_db) as session, session.group():
+        assert db.del_expenses([1], db_path = session) == (True, 1)
+        assert db.edit_expenses([2], new_amount = 1, db_path = session) == (True, 1)
+        assert db.del_expenses([2], where = db.Filter("no_such_column = ?", (1,)), db_path = session) == (False, "Database error")
+
+    assert db.get_balance(tmp_db) == (True, -1)
+    assert db.get_balance_at(date(2024, 1, 2), tmp_db) == (True, -1)
+
+def test_bulk_edit_and_delete_negative(tmp_db, tmp_path, monkeypatch):
+    """test that bulk writes need a selection and a new value, leave archived entries alone and report db errors"""
+
+    db.add_expense(Expense(10, date(2022, 3, 1)), tmp_db)
+    assert db.archive(2023, tmp_db) == (True, (1, 0))
+    assert db.del_expenses([1], db_path = tmp_db) == (True, 0)
+    assert db.edit_expenses(where = compile_filter("amount > 0", ExpCategory), new_amount = 1, db_path = tmp_db) == (True, 0)
+    assert db.get_balance(tmp_db) == (True, -10)
+
+    assert db.del_expenses(db_path = tmp_db) == (False, "Choose the entries by id or with a filter")
+    assert db.del_incomes([], db_path = tmp_db) == (False, "Choose the entries by id or with a filter")
+    assert db.edit_incomes([1], db_path = tmp_db) == (False, "Choose at least one value to edit")
+    assert db.del_expenses([1], db_path = db.ReadOnly(tmp_db)) == (False, "Database error")
+
+    def mock_connect(*args, **kwargs):
+        raise RuntimeError("generic error")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    assert db.del_expenses([1], db_path = "fake_path") == (False, "Unexpected error")
+
+def test_bulk_guard_added_to_older_dbs(tmp_db):
+    """test that init_db gives the update and delete triggers of a version 4 db the bulk write guard"""
+
+    connection = sqlite3.connect(tmp_db)
+    connection.execute("DROP TRIGGER expenses_balance_update")
+    connection.execute("CREATE TRIGGER expenses_balance_update AFTER UPDATE OF cents ON expenses BEGIN SELECT 1; END")
+    connection.execute("PRAGMA user_version = 4")
+    connection.commit()
+    connection.close()
+
+    assert db.init_db(tmp_db)
+
+    connection = sqlite3.connect(tmp_db)
+    sql = dict(connection.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'"))
+    connection.close()
+    assert all("bulk_writing" in sql[trigger] for trigger in db.BULK_GUARDED_TRIGGERS)
+
+def test_bulk_guard_migration_is_atomic(tmp_db, monkeypatch):
+    """test that a failing version 5 upgrade keeps the old triggers and version instead of leaving them dropped"""
+
+    connection = sqlite3.connect(tmp_db)
+    connection.execute("PRAGMA user_version = 4")
+    connection.commit()
+    connection.close()
+
+    schema = db._read_schema()
+    monkeypatch.setattr(db, "_read_schema", lambda: "SELECT no_such_function();\n" + schema)
+    assert not db.init_db(tmp_db)
+
+    connection = sqlite3.connect(tmp_db)
+    triggers = {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == 4
+    connection.close()
+    assert set(db.BULK_GUARDED_TRIGGERS) <= triggers
@@ -1,9 +1,6 @@
-import sys
-import os
+import pytest
 from datetime import date
 
-sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
-
 from internal_libs.expense import Expense
 from internal_libs.category import ExpCategory
 
@@ -38,3 +35,15 @@ def test_expense_categories():
     """testing the list_categories method"""
 
     assert ExpCategory.list() == Expense.list_categories()
+
+def test_expense_slots():
+    """testing the Expense class is slotted and can carry the db id"""
+
+    e = Expense(50, date(1998, 6, 4), "test description", ExpCategory.GAMING, 7)
+
+    assert e.id == 7
+    assert Expense(10).id is None
+    assert not hasattr(e, "__dict__")
+    with pytest.raises(AttributeError):
+        e.unknown_attribute = 1
+
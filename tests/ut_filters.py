@@ -0,0 +1,126 @@
+import re
+import pytest
+
+from db.filters import FIELDS, Filter, FilterError, compile_filter, compile_search
+from internal_libs.category import ExpCategory
+
+TOKEN_REGEX = r"'\\'|[()?]|[^\s()?]+"
+
+# every piece of SQL the compiler is allowed to emit, anything else in the output means user text leaked into it
+SQL_VOCABULARY = {"(", ")", "AND", "OR", "NOT"}
+SQL_VOCABULARY |= {token for conditions, _ in FIELDS.values() for condition in conditions.values()
+                         for token in re.findall(TOKEN_REGEX, condition)}
+
+def assert_only_vocabulary(sql: str):
+    for token in re.findall(TOKEN_REGEX, sql):
+        assert token in SQL_VOCABULARY, f"unexpected SQL token {token!r} in {sql!r}"
+
+def test_compile_simple_comparison():
+    """testing a single comparison compiles to a parameterized condition"""
+
+    assert compile_filter("amount > 20.5") == Filter("cents > ?", (2050,))
+    assert compile_filter("date>=2024-01-01") == Filter("day >= ?", (19723,), 19723) # days since 1970-01-01
+
+def test_compile_combined_expression():
+    """testing and/or/not and parentheses precedence"""
+
+    res = compile_filter("date >= 2024-01-01 and (category = food or not amount < 5) or id = 3", ExpCategory)
+
+    assert res.sql == "((day >= ? AND (category = ? OR NOT cents < ?)) OR id = ?)"
+    assert res.params == (19723, "FOOD", 500, 3)
+
+def test_compile_date_bounds():
+    """testing the days a filter can match are kept for choosing the archive shards"""
+
+    day = lambda text: compile_filter(f"date = {text}").first_day
+
+    res = compile_filter("date >= 2010-01-01 and date < 2011-01-01 and amount > 5")
+    assert (res.first_day, res.last_day) == (day("2010-01-01"), day("2010-12-31"))
+
+    res = compile_filter("date = 2012-05-05 or (date > 2013-01-01 and date <= 2013-02-01)")
+    assert (res.first_day, res.last_day) == (day("2012-05-05"), day("2013-02-01"))
+
+    for text in ("amount > 5", "date > 2012-01-01 or amount > 5", "not date < 2012-01-01", "date != 2012-01-01"):
+        res = compile_filter(text)
+        assert (res.first_day, res.last_day) == (None, None)
+
+    assert compile_filter("date < 2020-01-01").narrow(day("2019-06-01"), None) == (day("2019-06-01"), day("2019-12-31"))
+
+def test_compile_description_match():
+    """testing the ~ operator becomes an escaped LIKE substring match"""
+
+    res = compile_filter("description ~ \"50% off_sale\"")
+
+    assert res.sql == "description_id IN (SELECT id FROM descriptions WHERE text LIKE ? ESCAPE '\\')"
+    assert res.params == ("%50\\% off\\_sale%",)
+
+def test_compile_category_accepts_name_or_value():
+    """testing categories are normalized to the stored enum name"""
+
+    assert compile_filter("category = Utilities", ExpCategory).params == ("UTILITIES",)
+    assert compile_filter("category != GAMING", ExpCategory).params == ("GAMING",)
+
+@pytest.mark.parametrize("text", [
+    "description = \"x'; DROP TABLE expenses; --\"",
+    "description ~ 'a\" OR 1=1 --'",
+    "category = \"FOOD) OR (1=1\"",
+    "description = 'amount > 0 or id'",
+    "description = \"?\" and description ~ \"'\\\\'\"",
+])
+def test_user_text_never_in_sql(text):
+    """testing that values, however crafted, only ever end up in the params"""
+
+    res = compile_filter(text)
+
+    assert_only_vocabulary(res.sql)
+    assert res.sql.count("?") == len(res.params)
+
+@pytest.mark.parametrize("text, message", [
+    ("", "Empty filter."),
+    ("amount >", "Unexpected \"end of filter\" in filter."),
+    ("colour = red", "Unknown filter field: \"colour\". Choose from ['id', 'date', 'amount', 'category', 'description']."),
+    ("category > food", "Operator \">\" can not be used with category."),
+    ("date = yesterday", "Invalid date: \"yesterday\". Expected YYYY-MM-DD."),
+    ("amount = lots", "Invalid amount: \"lots\"."),
+    ("amount > inf", "Invalid amount: \"inf\"."),
+    ("amount < -Infinity", "Invalid amount: \"-Infinity\"."),
+    ("amount = nan", "Invalid amount: \"nan\"."),
+    ("(amount = 1", "Unexpected \"end of filter\" in filter."),
+    ("amount = 1 amount = 2", "Unexpected \"amount\" in filter."),
+    ("category = salary", "Invalid category: \"salary\". Choose from ['Food', 'Transport', 'Gaming', 'Utilities', 'Other']."),
+])
+def test_compile_errors(text, message):
+    """testing invalid filters raise a FilterError with a helpful message"""
+
+    with pytest.raises(FilterError) as err:
+        compile_filter(text, ExpCategory)
+
+    assert str(err.value) == message
+
+@pytest.mark.parametrize("text, expected", [
+    ("amazon", '"amazon"'),
+    ("Amazon order", '"Amazon" "order"'),
+    ("ama*", '"ama"*'),
+    ('"monthly rent" lidl*', '"monthly rent" "lidl"*'),
+    ('"monthly re"*', '"monthly re"*'),
+    ("NOT OR AND ^x col:val", '"NOT" "OR" "AND" "^x" "col:val"'),
+])
+def test_compile_search(text, expected):
+    """testing that every search term reaches FTS5 as a quoted string, so user text is never read as FTS5 syntax"""
+
+    assert compile_search(text) == expected
+
+@pytest.mark.parametrize("text, message", [
+    ("", "Empty search."),
+    ("   ", "Empty search."),
+    ('"amazon', "Unbalanced quotes in search."),
+    ("amazon *", "Empty search term at position 6."),
+    ('"" rent', "Empty search term at position 0."),
+])
+def test_compile_search_errors(text, message):
+    """testing invalid search queries raise a FilterError with a helpful message"""
+
+    with pytest.raises(FilterError) as err:
+        compile_search(text)
+
+    assert str(err.value) == message
@@ -0,0 +1,45 @@
+import os
+from datetime import date
+
+import db.database as db
+from internal_libs import household
+from internal_libs.expense import Expense, ExpCategory
+from internal_libs.income import Income, IncCategory
+
+def make_db(path, expenses, incomes):
+    assert db.init_db(path), "Failed to initialize test database"
+    db.import_expenses(expenses, path)
+    db.import_incomes(incomes, path)
+    return str(path)
+
+def test_get_report(tmp_path):
+    """testing that the aggregates of several dbs are merged, in worker processes too"""
+
+    first = make_db(tmp_path / "a.db", [Expense(10.1, date(2024, 1, 5), "a", ExpCategory.FOOD),
+                                        Expense(20, date(2024, 2, 5), "b", ExpCategory.GAMING)],
+                    [Income(100, date(2024, 1, 31), "salary", IncCategory.SALARY)])
+    second = make_db(tmp_path / "b.db", [Expense(0.2, date(2024, 1, 6), "c", ExpCategory.FOOD)],
+                     [Income(50, date(2024, 3, 1), "salary", IncCategory.SALARY)])
+
+    for workers in (1, 2):
+        success, report = household.get_report([first, second, first], workers = workers)
+        assert success
+        assert report.files == [first, second]
+        assert report.balance == 119.7
+        assert report.totals == {"exp": (30.3, 3), "inc": (150, 2)}
+        assert report.categories == {("exp", "FOOD"): (10.3, 2), ("exp", "GAMING"): (20, 1), ("inc", "SALARY"): (150, 2)}
+        assert report.months == ["2024-01", "2024-02", "2024-03"]
+        assert report.monthly == {("exp", "2024-01"): 10.3, ("inc", "2024-01"): 100, ("exp", "2024-02"): 20, ("inc", "2024-03"): 50}
+
+    _, report = household.get_report([first, second], "2024-02", "2024-02")
+    assert report.totals == {"exp": (20, 1)}
+    assert report.balance == 119.7 # the balance is the current one whatever the period
+
+def test_get_report_negative(tmp_path):
+    """testing that a db that can not be read fails the report and is never created"""
+
+    first = make_db(tmp_path / "a.db", [Expense(1)], [])
+    missing = str(tmp_path / "missing.db")
+
+    assert household.get_report([first, missing]) == (False, f"{missing}: Database error")
+    assert not os.path.exists(missing)
@@ -1,9 +1,6 @@
-import sys
-import os
+import pytest
 from datetime import date
 
-sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
-
 from internal_libs.income import Income
 from internal_libs.category import IncCategory
 
@@ -38,3 +35,15 @@ def test_income_categories():
     """testing the list_categories method"""
 
     assert IncCategory.list() == Income.list_categories()
+
+def test_income_slots():
+    """testing the Income class is slotted and can carry the db id"""
+
+    e = Income(50, date(1998, 6, 4), "test description", IncCategory.SALARY, 7)
+
+    assert e.id == 7
+    assert Income(10).id is None
+    assert not hasattr(e, "__dict__")
+    with pytest.raises(AttributeError):
+        e.unknown_attribute = 1
+
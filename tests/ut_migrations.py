@@ -0,0 +1,161 @@
+import sqlite3
+import pytest
+from datetime import date
+
+import db.database as db
+import db.migrations as migrations
+from internal_libs.expense import Expense
+
+V1_SCHEMA = """
+    CREATE TABLE expenses (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, description TEXT, category TEXT, amount REAL NOT NULL);
+    CREATE TABLE incomes (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, description TEXT, category TEXT, amount REAL NOT NULL);
+    CREATE TABLE balance (id INTEGER PRIMARY KEY CHECK (id = 1), curr_balance REAL NOT NULL DEFAULT 0);
+    INSERT INTO balance VALUES (1, 1234.56);
+"""
+
+@pytest.fixture
+def v1_db(tmp_path):
+    """create a db in storage format v1 with a few rows"""
+
+    db_path = tmp_path / "v1_finances.db"
+    connection = sqlite3.connect(db_path)
+    connection.executescript(V1_SCHEMA)
+    connection.executemany("INSERT INTO expenses (date, description, category, amount) VALUES (?, ?, ?, ?)", [
+        ("2024-01-05", "Groceries", "FOOD", 45.9),
+        ("2024-01-12", "Groceries", "FOOD", 0.1),
+        ("1969-12-31", None, "OTHER", 3),
+        ("2024-02-01", "Bus", "Transport", 2.2),
+        ("2024-02-03", "deleted later", "OTHER", 1),
+    ])
+    connection.execute("DELETE FROM expenses WHERE id = 5")
+    connection.execute("INSERT INTO incomes (date, description, category, amount) VALUES ('2024-01-31', 'Salary', 'SALARY', 1500)")
+    connection.commit()
+    connection.close()
+
+    return db_path
+
+def test_split_script():
+    """testing that scripts are split on statement boundaries, trigger bodies included"""
+
+    statements = migrations.split_script("CREATE TABLE a (x);\n-- comment\nCREATE TRIGGER t AFTER INSERT ON a BEGIN\n    DELETE FROM a;\nEND;\n")
+
+    assert len(statements) == 2
+    assert statements[1].endswith("END;")
+
+def test_run_migrations(tmp_path):
+    """testing migrations run in order, only once, and resume after the last one that finished"""
+
+    connection = sqlite3.connect(tmp_path / "versions.db")
+    applied = []
+
+    def failing(connection):
+        raise sqlite3.OperationalError("interrupted")
+
+    steps = [(1, lambda connection: applied.append(1)),
+             (2, lambda connection: applied.append(2)),
+             (3, failing)]
+
+    with pytest.raises(sqlite3.OperationalError):
+        migrations.run_migrations(connection, steps)
+    assert applied == [1, 2]
+    assert migrations.get_user_version(connection) == 2
+
+    steps[2] = (3, lambda connection: applied.append(3))
+    migrations.run_migrations(connection, steps)
+    migrations.run_migrations(connection, steps)
+    assert applied == [1, 2, 3]
+    assert migrations.get_user_version(connection) == 3
+
+    with pytest.raises(ValueError):
+        migrations.run_migrations(connection, steps[:2])
+    connection.close()
+
+def test_migrate_v1_to_v2(v1_db):
+    """testing a v1 db is converted to the v2 storage format in several batches"""
+
+    connection = sqlite3.connect(v1_db)
+    assert migrations.is_v1_format(connection)
+
+    with open(db.SCHEMA_PATH) as inf:
+        schema = inf.read()
+    migrations.migrate_v1_to_v2(connection, schema, db._rebuild_derived_tables, batch_size = 2)
+
+    assert not migrations.is_v1_format(connection)
+    rows = connection.execute("SELECT id, day, description_id, category, cents FROM expenses ORDER BY id").fetchall()
+    descriptions = connection.execute("SELECT COUNT(*) FROM descriptions").fetchone()[0]
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    connection.close()
+
+    assert [row[0] for row in rows] == [1, 2, 3, 4]
+    assert rows[0][1] == 19727 and rows[2][1] == -1 # days since 1970-01-01
+    assert [row[4] for row in rows] == [4590, 10, 300, 220]
+    assert rows[0][2] == rows[1][2] # same description stored once
+    assert descriptions == 4 # Groceries, "", Bus and Salary
+    assert "expenses_v2" not in tables and "balance_v2" not in tables
+
+def test_migrate_v1_to_v2_concurrent_writes(v1_db, monkeypatch):
+    """testing that v1 edits and deletes of rows copied in an earlier batch are not lost by the swap"""
+
+    connection = sqlite3.connect(v1_db)
+    copy_batch = migrations._copy_batch
+    writes = []
+
+    def copy_then_write(connection, table, batch_size):
+        copied = copy_batch(connection, table, batch_size)
+        if table == "expenses" and not writes: # a v1 client writes right after the first batch committed
+            connection.execute("UPDATE expenses SET amount = 50, description = 'Market' WHERE id = 1")
+            connection.execute("DELETE FROM expenses WHERE id = 2")
+            connection.execute("UPDATE balance SET curr_balance = curr_balance + 45.9 - 50 + 0.1")
+            writes.append(table)
+        return copied
+    monkeypatch.setattr(migrations, "_copy_batch", copy_then_write)
+
+    with open(db.SCHEMA_PATH) as inf:
+        schema = inf.read()
+    migrations.migrate_v1_to_v2(connection, schema, db._rebuild_derived_tables, batch_size = 2)
+    connection.close()
+
+    _, expenses = db.get_expenses(v1_db)
+    _, balance = db.get_balance(v1_db)
+
+    assert writes == ["expenses"]
+    assert [expense[0] for expense in expenses] == [1, 3, 4]
+    assert expenses[0] == (1, "2024-01-05", "Market", "FOOD", 50)
+    assert balance == 1230.56
+
+def test_init_db_migrates_v1(v1_db):
+    """testing init_db upgrades a v1 db transparently for the read and write functions"""
+
+    assert db.init_db(v1_db)
+
+    _, balance = db.get_balance(v1_db)
+    _, expenses = db.get_expenses(v1_db)
+    _, totals = db.get_monthly_totals("exp", db_path = v1_db)
+
+    assert balance == 1234.56
+    assert expenses[0] == (1, "2024-01-05", "Groceries", "FOOD", 45.9)
+    assert expenses[2] == (3, "1969-12-31", "", "OTHER", 3)
+    assert ("exp", "2024-01", "FOOD", 46, 2) in totals
+
+    # the deleted id 5 is not handed out again and the triggers work on the new tables
+    assert db.add_expense(Expense(0.5, date(2024, 3, 1), "Groceries"), v1_db)
+    _, expenses = db.get_expenses(v1_db)
+    _, balance = db.get_balance(v1_db)
+
+    assert expenses[-1][0] == 6
+    assert balance == 1234.06
+
+def test_migration_resumes(v1_db):
+    """testing an interrupted migration continues from the rows it already copied"""
+
+    connection = sqlite3.connect(v1_db)
+    for statement in migrations.V2_STAGING_STATEMENTS:
+        connection.execute(statement)
+    migrations._copy_batch(connection, "expenses", 2)
+    connection.commit()
+    connection.close()
+
+    assert db.init_db(v1_db)
+
+    _, expenses = db.get_expenses(v1_db)
+    assert [row[0] for row in expenses] == [1, 2, 3, 4]
@@ -0,0 +1,187 @@
+import sys
+import pytest
+from datetime import date
+
+import db.database as db
+import cli.cli as cli
+from db import tracing
+from internal_libs.expense import Expense
+from internal_libs.income import Income
+
+@pytest.fixture(autouse = True)
+def reset_tracing():
+    """every test starts and ends with tracing off and no recorded stats"""
+
+    tracing.tracer.reset()
+    yield
+    tracing.disable()
+    tracing.tracer.reset()
+
+def test_tracing_records_operations(tmp_db):
+    """test the latency, statement and row counts of traced db operations"""
+
+    original = db.add_expense
+    tracing.enable()
+
+    assert db.add_expense(Expense(5, date(2024, 1, 1)), tmp_db)
+    assert db.add_income(Income(7, date(2024, 1, 2)), tmp_db)
+    assert db.get_balance(tmp_db) == (True, 2)
+
+    operations = tracing.tracer.operations
+    assert operations["db.add_expense"].count == 1
+    assert operations["db.add_expense"].statements > 0
+    assert operations["db.add_expense"].rows_written > 1 # the expense and the rows its triggers update
+    assert operations["db.get_balance"].rows_written == 0
+    assert operations["db.connect"].count == 3
+    # the connect time is counted by db.connect, not by the operation that opened the connection
+    assert operations["db.add_expense"].own < operations["db.add_expense"].total
+    assert sum(operations["db.add_expense"].buckets) == 1
+
+    tracing.disable()
+    assert db.add_expense is original
+    db.add_expense(Expense(5), tmp_db)
+    assert operations["db.add_expense"].count == 1
+
+def test_tracing_nested_session_calls(tmp_db):
+    """test that statements run through a session are added to the innermost operation"""
+
+    tracing.enable()
+    with db.Session(tmp_db) as session:
+        with session.group():
+            db.import_expenses([Expense(1, date(2024, 1, day)) for day in range(1, 11)], session)
+
+    stats = tracing.tracer.operations["db.import_expenses"]
+    assert stats.count == 1
+    assert stats.rows_written >= 10
+    assert "db.connect" not in tracing.tracer.operations
+
+def test_tracing_failed_operation_rows_written(tmp_db):
+    """test that the rows an operation wrote before it failed are still counted"""
+
+    def expenses():
+        yield from (Expense(1, date(2024, 1, day)) for day in range(1, 6))
+        raise ValueError("Line 6: invalid row")
+
+    tracing.enable()
+    with db.Session(tmp_db) as session:
+        assert db.import_expenses(expenses(), session, batch_size = 5) == (False, "Line 6: invalid row")
+
+    assert tracing.tracer.operations["db.import_expenses"].rows_written >= 5
+
+def test_tracing_rows_read(tmp_db):
+    """test that the rows fetched by an operation are counted, and the rows read from its results"""
+
+    db.import_expenses([Expense(1, date(2024, 1, day)) for day in range(1, 6)], tmp_db)
+    tracing.enable()
+
+    assert db.get_balance(tmp_db)[0]
+    success, expenses = db.get_expenses(tmp_db)
+    assert success and len(expenses) == 5
+
+    operations = tracing.tracer.operations
+    assert operations["db.get_balance"].rows_read == 1
+    assert operations["db.get_expenses"].rows_read == 5
+
+def test_tracing_streamed_operation(tmp_db):
+    """test that an operation returning a stream lasts until the stream is exhausted or closed"""
+
+    db.import_expenses([Expense(1, date(2024, 1, day)) for day in range(1, 11)], tmp_db)
+    tracing.enable()
+
+    success, rows = db.iter_expenses(db_path = tmp_db, chunk_size = 3)
+    assert success
+    assert "db.iter_expenses" not in tracing.tracer.operations
+
+    with tracing.span("consumer"):
+        assert len(list(rows)) == 10
+
+    operations = tracing.tracer.operations
+    stats = operations["db.iter_expenses"]
+    assert stats.count == 1
+    assert stats.rows_read == 10
+    assert operations["consumer"].rows_read == 0 # the rows are counted by the operation that produced them
+    assert operations["consumer"].own < operations["consumer"].total
+
+    success, rows = db.iter_expenses(db_path = tmp_db, chunk_size = 3)
+    next(rows)
+    rows.close()
+    assert stats.count == 2
+    assert stats.rows_read == 13
+
+def test_prometheus_text(tmp_db):
+    """test the Prometheus text exposition of the recorded stats"""
+
+    tracing.enable()
+    for _ in range(3):
+        db.get_balance(tmp_db)
+
+    text = tracing.prometheus_text()
+    lines = text.splitlines()
+
+    assert "# TYPE finances_operation_duration_seconds histogram" in lines
+    assert "finances_operation_duration_seconds_bucket{operation=\"db.get_balance\",le=\"+Inf\"} 3" in lines
+    assert "finances_operation_duration_seconds_count{operation=\"db.get_balance\"} 3" in lines
+    assert "finances_operation_rows_written_total{operation=\"db.get_balance\"} 0" in lines
+    assert "finances_operation_rows_read_total{operation=\"db.get_balance\"} 3" in lines
+
+    buckets = [int(line.rsplit(" ", 1)[1]) for line in lines if line.startswith("finances_operation_duration_seconds_bucket{operation=\"db.get_balance\"")]
+    assert buckets == sorted(buckets) # cumulative
+    assert len(buckets) == len(tracing.HISTOGRAM_BUCKETS) + 1
+
+def test_quantile():
+    """test that quantiles are read from the histogram bucket bounds"""
+
+    stats = tracing.OperationStats()
+    for duration in (0.00005, 0.0003, 0.0003, 0.02, 30):
+        stats.observe(duration, duration, 0, 0)
+
+    assert stats.quantile(0.5) == 0.0005
+    assert stats.quantile(0.8) == 0.025
+    assert stats.quantile(1) == float("inf")
+    assert tracing.OperationStats().quantile(0.5) == 0.0
+
+def test_cli_trace_summary(tmp_path, monkeypatch, capsys):
+    """test that --trace times the handler and prints a summary on stderr"""
+
+    monkeypatch.chdir(tmp_path)
+    assert db.init_db()
+    monkeypatch.setattr(sys, "argv", ["src/main.py", "--trace", "add_exp", "5", "--description", "x"])
+
+    cli.main()
+
+    captured = capsys.readouterr()
+    assert captured.out == "SUCCESS: Expense added to the db.\n"
+    assert "cli.handle_add_exp_command" in captured.err
+    assert "db.add_expense" in captured.err
+
+def test_cli_trace_file(tmp_path, monkeypatch):
+    """test that --trace-file writes the metrics in the Prometheus text format"""
+
+    monkeypatch.chdir(tmp_path)
+    assert db.init_db()
+    monkeypatch.setattr(sys, "argv", ["src/main.py", "--trace-file", "metrics.prom", "show_balance"])
+
+    cli.main()
+
+    with open(tmp_path / "metrics.prom") as inf:
+        text = inf.read()
+    assert "finances_operation_duration_seconds_count{operation=\"cli.handle_show_balance\"} 1" in text
+    assert "finances_operation_duration_seconds_count{operation=\"db.get_balance\"} 1" in text
+
+def test_enable_from_env(monkeypatch):
+    """test the values of the FINANCES_TRACE environment variable"""
+
+    monkeypatch.delenv(tracing.TRACE_ENV_VAR, raising = False)
+    assert not tracing.enable_from_env()
+
+    monkeypatch.setenv(tracing.TRACE_ENV_VAR, "0")
+    assert not tracing.enable_from_env()
+    assert not tracing.enabled()
+
+    monkeypatch.setenv(tracing.TRACE_ENV_VAR, "1")
+    assert tracing.enable_from_env()
+    assert tracing.tracer.destination == tracing.SUMMARY_DESTINATION
+
+    monkeypatch.setenv(tracing.TRACE_ENV_VAR, "metrics.prom")
+    assert tracing.enable_from_env()
+    assert tracing.tracer.destination == "metrics.prom"
@@ -0,0 +1,129 @@
+import sqlite3
+import threading
+import pytest
+from datetime import date
+
+import db.database as db
+from db.writer import GroupWriter
+from internal_libs.expense import Expense
+from internal_libs.income import Income
+
+def test_group_writer_many_producers(tmp_db):
+    """test that rows from many threads are all written and share commits"""
+
+    futures = []
+    futures_lock = threading.Lock()
+
+    with GroupWriter(tmp_db, max_group = 50, max_wait = 0.05) as writer:
+        def producer(i):
+            for j in range(25):
+                future = writer.add_expense(Expense(1, date(2024, 1, j + 1))) if i % 2 else writer.add_income(Income(3))
+                with futures_lock:
+                    futures.append(future)
+
+        threads = [threading.Thread(target = producer, args = (i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert all(future.result(timeout = 10) for future in futures)
+
+    assert len(futures) == 200
+    assert writer.groups_committed < 200
+    assert db.get_balance(tmp_db) == (True, 100 * 3 - 100 * 1)
+
+    success, expenses = db.get_expenses(tmp_db)
+    assert len(expenses) == 100
+
+def test_group_writer_invalid_row(tmp_db):
+    """test that an invalid row only fails its own future"""
+
+    bad_expense = Expense(5)
+    bad_expense.category = "not a category"
+
+    with GroupWriter(tmp_db, max_wait = 0.5) as writer:
+        good = writer.add_expense(Expense(2))
+        bad = writer.add_expense(bad_expense)
+        other = writer.add_income(Income(10))
+
+    assert good.result() and other.result()
+    assert not bad.result()
+    assert db.get_balance(tmp_db) == (True, 8)
+
+def test_group_writer_row_raises(tmp_db, monkeypatch):
+    """test that a row raising an error only fails its own future, the other producers complete"""
+
+    add_expense = db.add_expense
+    def failing_add_expense(expense, db_path):
+        if expense.amount == 13:
+            raise RuntimeError("bad write")
+        return add_expense(expense, db_path)
+    monkeypatch.setattr(db, "add_expense", failing_add_expense)
+
+    futures = {}
+    with GroupWriter(tmp_db, max_group = 20, max_wait = 0.05) as writer:
+        def producer(i):
+            futures[i] = [writer.add_expense(Expense(13 if i == 0 and j == 5 else 1)) for j in range(10)]
+
+        threads = [threading.Thread(target = producer, args = (i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        bad = futures[0].pop(5)
+        with pytest.raises(RuntimeError, match = "bad write"):
+            bad.result(timeout = 10)
+        assert all(future.result(timeout = 10) for producer_futures in futures.values() for future in producer_futures)
+
+    assert db.get_balance(tmp_db) == (True, -39)
+
+def test_group_writer_commit_raises(tmp_db, monkeypatch):
+    """test that an error while committing fails every future of the group and the writer keeps running"""
+
+    end_group = db.Session.end_group
+    calls = []
+    def failing_end_group(self, commit = True):
+        calls.append(commit)
+        if len(calls) == 1:
+            self.grouped = False
+            raise RuntimeError("commit failed")
+        end_group(self, commit)
+    monkeypatch.setattr(db.Session, "end_group", failing_end_group)
+
+    with GroupWriter(tmp_db, max_wait = 0.5) as writer:
+        failed = [writer.add_income(Income(5)), writer.add_expense(Expense(2))]
+        for future in failed:
+            with pytest.raises(RuntimeError, match = "commit failed"):
+                future.result(timeout = 10)
+
+        later = writer.add_income(Income(7))
+        assert later.result(timeout = 10)
+
+    assert writer.groups_committed == 1
+    assert db.get_balance(tmp_db) == (True, 7)
+
+def test_group_writer_close(tmp_db):
+    """test that close commits the queued rows and refuses new ones"""
+
+    writer = GroupWriter(tmp_db, max_wait = 10)
+    future = writer.add_income(Income(1))
+    writer.close()
+    writer.close()
+
+    assert future.done() and future.result()
+    with pytest.raises(RuntimeError):
+        writer.add_income(Income(1))
+
+def test_group_writer_db_error(monkeypatch):
+    """test that the futures resolve to False when the db can not be opened"""
+
+    def mock_connect(*args, **kwargs):
+        raise sqlite3.Error("connection failed")
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+
+    with GroupWriter("fake_path") as writer:
+        future = writer.add_expense(Expense(1))
+
+    assert future.result() is False